@@ -4,6 +4,8 @@ from django.conf import settings
 class Cart(models.Model):
     """Shopping cart"""
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Bumped whenever the contents or their prices change; keys cached quotes
+    version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -20,6 +22,10 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
 class Order(models.Model):
     """Customer orders"""
     STATUS_CHOICES = [
@@ -0,0 +1,32 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.models import Product, prices_updated
+from payments.checkout import bump_cart_versions
+from .models import Cart, CartItem
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def cart_item_changed(sender, instance, **kwargs):
+    """Invalidate cached quotes and checkout pages for the cart"""
+    carts = Cart.objects.filter(id=instance.cart_id)
+    carts.update(version=F('version') + 1)
+    bump_cart_versions(carts.values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, created, **kwargs):
+    """Invalidate cached quotes and checkout pages for carts holding the product"""
+    if not created:
+        carts = Cart.objects.filter(items__product_id=instance.id)
+        carts.update(version=F('version') + 1)
+        bump_cart_versions(carts.values_list('user_id', flat=True))
+
+
+@receiver(prices_updated, sender=Product)
+def product_prices_updated(sender, prices, **kwargs):
+    """Invalidate cached quotes and checkout pages for carts holding bulk repriced products"""
+    carts = Cart.objects.filter(items__product_id__in=list(prices))
+    carts.update(version=F('version') + 1)
+    bump_cart_versions(carts.values_list('user_id', flat=True))
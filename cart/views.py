@@ -9,46 +9,38 @@ from decimal import Decimal
 import json
 
 from .models import Cart, CartItem
+from insights.cube import record_event
 from marketplace.models import Product
+from payments.pricing import quote_cart, quote_items
 
 def cart_view(request):
     """Shopping cart view"""
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart.items.all()
+        cart_items = cart.items.select_related('product')
+        quote = quote_cart(cart, request.user.location)
     else:
         # Handle anonymous users with session-based cart
         cart_items = []
         session_cart = request.session.get('cart', {})
+        products = Product.objects.in_bulk([int(product_id) for product_id in session_cart])
         for product_id, quantity in session_cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                cart_items.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'total_price': product.price * Decimal(quantity)
-                })
-            except Product.DoesNotExist:
+            product = products.get(int(product_id))
+            if product is None:
                 continue
-    
-    # Calculate totals using Decimal arithmetic
-    total = sum(
-        item.total_price if hasattr(item, 'total_price') 
-        else item.product.price * Decimal(item.quantity) 
-        for item in cart_items
-    )
-    
-    # Convert to Decimal for consistent arithmetic
-    shipping = Decimal('5.99') if total > 0 else Decimal('0')
-    tax = total * Decimal('0.08')  # 8% tax rate
-    grand_total = total + shipping + tax
+            cart_items.append({
+                'product': product,
+                'quantity': quantity,
+                'total_price': product.price * Decimal(quantity)
+            })
+        quote = quote_items((item['product'], item['quantity']) for item in cart_items)
     
     return render(request, 'cart/view.html', {
         'cart_items': cart_items,
-        'total': total,
-        'shipping': shipping,
-        'tax': tax,
-        'grand_total': grand_total,
+        'total': quote.subtotal,
+        'shipping': quote.shipping,
+        'tax': quote.tax,
+        'grand_total': quote.total,
     })
 
 @require_POST
@@ -83,6 +75,7 @@ def add_to_cart(request):
             cart[str(product_id)] = cart.get(str(product_id), 0) + quantity
             request.session['cart'] = cart
             request.session.modified = True
+        record_event(product, 'cart_adds')
         
         return JsonResponse({
             'success': True,
@@ -184,17 +177,18 @@ def get_cart_count(request):
 def checkout(request):
     """Checkout process"""
     cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.items.all()
+    cart_items = cart.items.select_related('product')
     
     if not cart_items.exists():
         messages.warning(request, 'Your cart is empty')
         return redirect('cart:view')
     
-    total = sum(item.product.price * Decimal(item.quantity) for item in cart_items)
+    quote = quote_cart(cart, request.user.location)
     
     return render(request, 'cart/checkout.html', {
         'cart_items': cart_items,
-        'total': total,
+        'total': quote.subtotal,
+        'quote': quote,
     })
 
 @login_required
@@ -2,6 +2,7 @@
 Base settings for AgroMarket project.
 """
 import environ
+from decimal import Decimal
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -184,10 +185,67 @@ SESSION_CACHE_ALIAS = 'default'
 # Celery settings
 CELERY_BROKER_URL = env('REDIS_URL', default='redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = env('REDIS_URL', default='redis://127.0.0.1:6379/0')
+CELERY_BEAT_SCHEDULE = {
+    'refresh-market-metrics': {
+        'task': 'insights.tasks.refresh_market_metrics',
+        'schedule': 300,  # seconds
+    },
+    'rollup-market-trends': {
+        'task': 'insights.tasks.rollup_market_trends',
+        'schedule': 900,  # seconds; keeps today's trend rows current
+    },
+    'append-columnar-store': {
+        'task': 'insights.tasks.append_columnar_store',
+        'schedule': 60,  # seconds; a no-op while INSIGHTS_COLUMNAR_DIR is empty
+    },
+    'detect-price-anomalies': {
+        'task': 'insights.tasks.detect_price_anomalies',
+        'schedule': 3600,  # seconds
+    },
+    'update-price-forecasts': {
+        'task': 'insights.tasks.update_price_forecasts',
+        'schedule': 3600,  # seconds; only does work once a day has completed
+    },
+    'refresh-seller-analytics': {
+        'task': 'insights.tasks.refresh_seller_analytics',
+        'schedule': 60,  # seconds
+    },
+}
 
 # Payment settings
 STRIPE_PUBLISHABLE_KEY = env('STRIPE_PUBLISHABLE_KEY', default='')
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY', default='')
+PAYMENT_WEBHOOK_SECRET = env('PAYMENT_WEBHOOK_SECRET', default='')
+PAYMENT_WEBHOOK_DEDUPE_TTL = env.int('PAYMENT_WEBHOOK_DEDUPE_TTL', default=86400)  # 24 hours
+PAYMENT_METHOD_CATALOG_CHECK_INTERVAL = 5  # seconds between version checks
+PAYMENT_PRICING_RULES_CHECK_INTERVAL = 5  # seconds between version checks
+PAYMENT_DEFAULT_SHIPPING_FEE = Decimal('5.99')  # per order, when no default PricingRule exists
+PAYMENT_DEFAULT_TAX_RATE = Decimal('8.00')  # percent, when no default PricingRule exists
+PAYMENT_FRAUD_RULES = ['blocked_ip', 'suspicious_user_agent', 'high_amount', 'unusual_time']
+PAYMENT_FRAUD_THRESHOLD = 70  # risk scores above this are blocked
+PAYMENT_SECURITY_RETENTION_DAYS = env.int('PAYMENT_SECURITY_RETENTION_DAYS', default=90)
+PAYMENT_SECURITY_ARCHIVE_DIR = env('PAYMENT_SECURITY_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'payment_security'))
+PAYMENT_SIGNING_KEYS = env.dict('PAYMENT_SIGNING_KEYS', default={})  # key id -> secret
+PAYMENT_SIGNING_KEY_ID = env('PAYMENT_SIGNING_KEY_ID', default='')
+PAYMENT_GATEWAY_URL = env('PAYMENT_GATEWAY_URL', default='')  # empty uses the built-in processing page
+PAYMENT_GATEWAY_API_KEY = env('PAYMENT_GATEWAY_API_KEY', default='')
+PAYMENT_GATEWAY_CURRENCY = env('PAYMENT_GATEWAY_CURRENCY', default='USD')
+PAYMENT_GATEWAY_TIMEOUT = env.float('PAYMENT_GATEWAY_TIMEOUT', default=3.0)  # seconds per call, retries included
+PAYMENT_GATEWAY_RETRIES = env.int('PAYMENT_GATEWAY_RETRIES', default=2)
+PAYMENT_GATEWAY_MAX_CONNECTIONS = env.int('PAYMENT_GATEWAY_MAX_CONNECTIONS', default=20)  # per process
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = 5  # consecutive failures before the circuit opens
+PAYMENT_GATEWAY_BREAKER_RESET = 30  # seconds before a probe call is allowed
+PAYOUT_SETTLE_DELAY = env.int('PAYOUT_SETTLE_DELAY', default=300)  # seconds before a completed payment is paid out
+
+# Insights settings
+INSIGHTS_SETTLE_DELAY = env.int('INSIGHTS_SETTLE_DELAY', default=60)  # seconds before a new order is counted
+INSIGHTS_EXPORT_STREAM_MAX_ROWS = env.int('INSIGHTS_EXPORT_STREAM_MAX_ROWS', default=1000000)  # larger exports run in the background
+# Background export files; never under MEDIA_URL, they are served by the export download view
+INSIGHTS_EXPORT_STORAGE = 'django.core.files.storage.FileSystemStorage'
+INSIGHTS_EXPORT_STORAGE_OPTIONS = {'location': env('INSIGHTS_EXPORT_DIR', default=str(BASE_DIR / 'private' / 'exports'))}
+INSIGHTS_EXCLUDE_PRICE_ANOMALIES = env.bool('INSIGHTS_EXCLUDE_PRICE_ANOMALIES', default=True)  # leave flagged prices out of trends
+INSIGHTS_FORECAST_WORKERS = env.int('INSIGHTS_FORECAST_WORKERS', default=1)  # processes for full forecast fits
+INSIGHTS_COLUMNAR_DIR = env('INSIGHTS_COLUMNAR_DIR', default='')  # empty reads chart series from the database
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
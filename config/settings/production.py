@@ -56,6 +56,12 @@ if USE_S3:
     # Media files
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
     MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
+
+    # Insights exports, private and fetched through the app
+    INSIGHTS_EXPORT_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    INSIGHTS_EXPORT_STORAGE_OPTIONS = {
+        'location': 'private/exports', 'default_acl': 'private', 'querystring_auth': True,
+    }
 else:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import PriceHistory, MarketTrend
+from .anomalies import review
+from .models import (
+    PriceHistory, MarketTrend, MarketSummary, ProductSales, CategorySales, InsightsExport, PriceAnomaly,
+    PriceForecast, SellerProductDay,
+)
 
 @admin.register(PriceHistory)
 class PriceHistoryAdmin(admin.ModelAdmin):
@@ -12,4 +16,65 @@ class PriceHistoryAdmin(admin.ModelAdmin):
 class MarketTrendAdmin(admin.ModelAdmin):
     list_display = ['category', 'average_price', 'total_sales', 'date', 'created_at']
     list_filter = ['category', 'date', 'created_at']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['created_at']
+    list_select_related = ['category']
+@admin.register(MarketSummary)
+class MarketSummaryAdmin(admin.ModelAdmin):
+    list_display = ['product_count', 'active_sellers', 'average_price', 'order_count', 'revenue', 'refreshed_at']
+    readonly_fields = ['product_count', 'active_sellers', 'average_price', 'order_count', 'revenue',
+                       'watermark_created_at', 'watermark_change_id', 'refreshed_at']
+
+@admin.register(ProductSales)
+class ProductSalesAdmin(admin.ModelAdmin):
+    list_display = ['product', 'units_sold', 'order_count', 'revenue']
+    search_fields = ['product__name']
+    readonly_fields = ['product', 'units_sold', 'order_count', 'revenue']
+    list_select_related = ['product']
+
+@admin.register(CategorySales)
+class CategorySalesAdmin(admin.ModelAdmin):
+    list_display = ['category', 'product_count', 'units_sold', 'revenue']
+    readonly_fields = ['category', 'product_count', 'units_sold', 'revenue']
+    list_select_related = ['category']
+
+@admin.register(InsightsExport)
+class InsightsExportAdmin(admin.ModelAdmin):
+    list_display = ['id', 'dataset', 'export_format', 'start', 'end', 'status', 'created_by', 'created_at',
+                    'finished_at']
+    list_filter = ['status', 'dataset', 'export_format']
+    list_select_related = ['created_by']
+    readonly_fields = ['dataset', 'export_format', 'start', 'end', 'category', 'created_by', 'status', 'file',
+                       'error', 'created_at', 'finished_at']
+
+@admin.register(PriceAnomaly)
+class PriceAnomalyAdmin(admin.ModelAdmin):
+    list_display = ['product', 'price', 'expected_price', 'score', 'basis', 'status', 'detected_at']
+    list_filter = ['status', 'basis', 'detected_at']
+    search_fields = ['product__name']
+    readonly_fields = ['price_history', 'product', 'price', 'expected_price', 'score', 'basis', 'status',
+                       'detected_at', 'reviewed_at']
+    list_select_related = ['product']
+    actions = ['confirm', 'dismiss']
+
+    @admin.action(description='Confirm as wrong prices (kept out of trends)')
+    def confirm(self, request, queryset):
+        self.message_user(request, f"Confirmed {review(queryset, 'confirmed')} anomalies.")
+
+    @admin.action(description='Dismiss as genuine prices (counted in trends)')
+    def dismiss(self, request, queryset):
+        self.message_user(request, f"Dismissed {review(queryset, 'dismissed')} anomalies.")
+
+@admin.register(PriceForecast)
+class PriceForecastAdmin(admin.ModelAdmin):
+    list_display = ['category', 'date', 'price', 'lower', 'upper', 'created_at']
+    list_filter = ['category']
+    readonly_fields = ['category', 'date', 'price', 'lower', 'upper', 'created_at']
+    list_select_related = ['category']
+
+@admin.register(SellerProductDay)
+class SellerProductDayAdmin(admin.ModelAdmin):
+    list_display = ['product', 'seller', 'date', 'views', 'cart_adds', 'orders', 'units_sold', 'revenue']
+    list_filter = ['date']
+    search_fields = ['product__name', 'seller__username']
+    readonly_fields = ['seller', 'product', 'date', 'views', 'cart_adds', 'orders', 'units_sold', 'revenue']
+    list_select_related = ['product', 'seller']
@@ -0,0 +1,188 @@
+"""
+Price anomaly detection.
+
+``detect_anomalies()`` loads the whole price history in one ordered query
+and scores every row with NumPy:
+
+* Against the product's own recent prices: the median and median absolute
+  deviation (MAD) of its previous ``WINDOW`` prices, taken from a lagged
+  ``(rows, WINDOW)`` matrix sorted along its rows.
+* Against its category peers, for products with fewer than
+  ``MIN_HISTORY`` earlier prices: the median and MAD of the category's
+  log prices, since a category spans prices of very different scale.
+
+Rows whose robust z-score (0.6745 * deviation / MAD) passes ``THRESHOLD``
+are kept in ``PriceAnomaly`` for review. The MAD is floored, so a product
+whose price never moved does not flag its first ordinary change. A genuine
+repricing is flagged until the new price fills most of the window; dismiss
+those.
+
+With ``INSIGHTS_EXCLUDE_PRICE_ANOMALIES`` on, pending and confirmed
+anomalies are left out of the ``MarketTrend`` averages and price sketches,
+and the days they fall on are rolled up again whenever flags change.
+"""
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import PriceAnomaly, PriceHistory
+
+WINDOW = 10
+MIN_HISTORY = 3
+THRESHOLD = 3.5
+PRODUCT_MAD_FLOOR = 0.1  # fraction of the median price
+CATEGORY_MAD_FLOOR = 0.25  # log units, about 28%
+CHUNK_SIZE = 250000
+EXCLUDED_STATUSES = ['pending', 'confirmed']
+
+
+def trend_prices(queryset):
+    """``PriceHistory`` rows that should count towards trends"""
+    if not settings.INSIGHTS_EXCLUDE_PRICE_ANOMALIES:
+        return queryset
+    return queryset.exclude(anomaly__status__in=EXCLUDED_STATUSES)
+
+
+def _sorted_median(values, counts):
+    """Row medians of ``values`` sorted along axis 1 with ``counts`` leading non-NaN entries"""
+    rows = np.arange(len(values))
+    low = np.maximum((counts - 1) // 2, 0)
+    high = np.maximum(counts // 2, 0)
+    median = (values[rows, low] + values[rows, high]) / 2
+    return np.where(counts > 0, median, np.nan)
+
+
+def rolling_median_mad(product, price, window=WINDOW):
+    """Median, MAD and count of each row's previous ``window`` prices for the same product"""
+    n = len(price)
+    lagged = np.full((n, window), np.nan)
+    for lag in range(1, min(window, n - 1) + 1):
+        same = product[lag:] == product[:-lag]
+        lagged[lag:, lag - 1] = np.where(same, price[:-lag], np.nan)
+    counts = np.count_nonzero(~np.isnan(lagged), axis=1)
+    # NaN sorts last, so each row's history is its first ``counts`` entries
+    median = _sorted_median(np.sort(lagged, axis=1), counts)
+    mad = _sorted_median(np.sort(np.abs(lagged - median[:, None]), axis=1), counts)
+    return median, mad, counts
+
+
+def group_median(groups, values):
+    """Median of ``values`` per group, for dense group ids ``0..k-1``"""
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    ordered = values[order]
+    return (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+
+
+def score_prices(product, category, price, chunk_size=CHUNK_SIZE):
+    """
+    Flag outlying prices.
+
+    Rows must be ordered by product, then time. Returns boolean ``flagged``,
+    the ``expected`` price, the robust ``score`` and ``by_product`` (whether
+    the product's own history was the basis) per row.
+    """
+    n = len(price)
+    if not n:
+        return np.zeros(0, dtype=bool), np.empty(0), np.empty(0), np.zeros(0, dtype=bool)
+    median, mad, counts = np.empty(n), np.empty(n), np.empty(n, dtype=np.int64)
+    for start in range(0, n, chunk_size):
+        # Overlap the previous chunk so every row sees its full window
+        first = max(start - WINDOW, 0)
+        end = min(start + chunk_size, n)
+        chunk = rolling_median_mad(product[first:end], price[first:end])
+        for out, values in zip((median, mad, counts), chunk):
+            out[start:end] = values[start - first:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        product_score = 0.6745 * (price - median) / np.maximum(mad, PRODUCT_MAD_FLOOR * median)
+
+        logs = np.log(np.maximum(price, 0.01))
+        _, groups = np.unique(category, return_inverse=True)
+        category_median = group_median(groups, logs)
+        category_mad = group_median(groups, np.abs(logs - category_median[groups]))
+        category_score = (
+            0.6745 * (logs - category_median[groups]) / np.maximum(category_mad[groups], CATEGORY_MAD_FLOOR)
+        )
+
+    by_product = counts >= MIN_HISTORY
+    score = np.where(by_product, product_score, category_score)
+    expected = np.where(by_product, median, np.exp(category_median[groups]))
+    return np.abs(score) > THRESHOLD, expected, score, by_product
+
+
+def load_history():
+    """``(ids, product ids, category ids, prices)`` of all price history, ordered by product and time"""
+    rows = (
+        PriceHistory.objects.order_by('product_id', 'recorded_at', 'id')
+        .values_list('id', 'product_id', 'product__category_id', 'price')
+        .iterator(chunk_size=10000)
+    )
+    # Converted in slices, so the Python tuples never all exist at once
+    chunks = [np.empty((0, 4))]
+    while batch := list(islice(rows, 100000)):
+        chunks.append(np.array(batch, dtype=np.float64))
+    data = np.concatenate(chunks)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2].astype(np.int64), data[:, 3]
+
+
+def _days(price_history_ids):
+    return set(
+        PriceHistory.objects.filter(id__in=price_history_ids)
+        .annotate(day=TruncDate('recorded_at'))
+        .values_list('day', flat=True)
+        .distinct()
+    )
+
+
+def refresh_trends(price_history_ids):
+    """Roll up again the days of price history whose flags changed"""
+    # trends imports this module for trend_prices
+    from .trends import rollup_days
+
+    if settings.INSIGHTS_EXCLUDE_PRICE_ANOMALIES and price_history_ids:
+        rollup_days(_days(price_history_ids))
+
+
+def detect_anomalies():
+    """
+    Score all price history and sync the pending ``PriceAnomaly`` rows.
+
+    Reviewed anomalies are kept as they are. Returns ``(rows scored, new
+    anomalies, cleared anomalies)``.
+    """
+    ids, products, categories, prices = load_history()
+    flagged, expected, score, by_product = score_prices(products, categories, prices)
+    found = {
+        int(ids[i]): PriceAnomaly(
+            price_history_id=int(ids[i]), product_id=int(products[i]), price=f'{prices[i]:.2f}',
+            expected_price=f'{expected[i]:.2f}', score=float(score[i]),
+            basis='product' if by_product[i] else 'category',
+        )
+        for i in np.flatnonzero(flagged)
+    }
+
+    with transaction.atomic():
+        known = dict(PriceAnomaly.objects.values_list('price_history_id', 'status'))
+        cleared = [pk for pk, status in known.items() if status == 'pending' and pk not in found]
+        PriceAnomaly.objects.filter(price_history_id__in=cleared).delete()
+        new = [anomaly for pk, anomaly in found.items() if pk not in known]
+        PriceAnomaly.objects.bulk_create(new, batch_size=1000)
+        refresh_trends([anomaly.price_history_id for anomaly in new] + cleared)
+    return len(ids), len(new), len(cleared)
+
+
+def review(anomalies, status):
+    """Confirm or dismiss anomalies and roll their days up again"""
+    ids = list(anomalies.values_list('price_history_id', flat=True))
+    with transaction.atomic():
+        updated = PriceAnomaly.objects.filter(price_history_id__in=ids).update(
+            status=status, reviewed_at=timezone.now()
+        )
+        refresh_trends(ids)
+    return updated
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class InsightsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'insights'
\ No newline at end of file
+    name = 'insights'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,262 @@
+"""
+Local columnar copy of price history and sales lines.
+
+``append()`` copies ``PriceHistory`` rows and ``OrderItem`` lines past a
+``(timestamp, id)`` watermark into raw column files, one directory per
+table and UTC day under ``INSIGHTS_COLUMNAR_DIR``::
+
+    prices/2024-03-02/{timestamp,product,category,price}.bin
+    sales/2024-03-02/{timestamp,product,category,price,qty}.bin
+
+Each file is a flat array of one fixed-width dtype, so a partition is
+opened with ``np.memmap`` and scanned without parsing or copying, and
+aggregations run as vectorised NumPy over the mapped pages. The row count
+of every partition, the watermarks and the category names live in
+``manifest.json``, which is replaced atomically after the columns are
+written. Readers only look at the first ``rows`` values of a partition, and
+the next append truncates anything past that count first, so an append
+that dies half way leaves nothing visible and nothing duplicated.
+
+Like the trend rollup, rows are only copied once they are
+``INSIGHTS_SETTLE_DELAY`` seconds old. An empty ``INSIGHTS_COLUMNAR_DIR``
+turns the store off and the series are read from the database instead.
+The directory must be shared by the web and worker processes; there is a
+single writer, the periodic ``append_columnar_store`` task.
+"""
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from marketplace.models import Category
+from payments.models import Order, OrderItem
+from .models import PriceHistory
+
+TABLES = {
+    'prices': {'timestamp': np.int64, 'product': np.int64, 'category': np.int64, 'price': np.float64},
+    'sales': {'timestamp': np.int64, 'product': np.int64, 'category': np.int64, 'price': np.float64,
+              'qty': np.int64},
+}
+BATCH_SIZE = 50000
+MANIFEST = 'manifest.json'
+DAY = 86400  # seconds
+
+
+def store_dir():
+    """Root of the store, or ``None`` when it is turned off"""
+    return Path(settings.INSIGHTS_COLUMNAR_DIR) if settings.INSIGHTS_COLUMNAR_DIR else None
+
+
+def load_manifest(root=None):
+    """The store manifest, or ``None`` before the first append"""
+    root = root or store_dir()
+    try:
+        with open(root / MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_ready():
+    """Whether reads can be served from the store"""
+    return store_dir() is not None and load_manifest() is not None
+
+
+def _save_manifest(root, manifest):
+    fd, path = tempfile.mkstemp(dir=root, prefix='.manifest-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path, root / MANIFEST)
+
+
+def _empty_manifest():
+    return {
+        'tables': {table: {'watermark': None, 'partitions': {}} for table in TABLES},
+        'categories': {},
+    }
+
+
+def _partition_dir(root, table, day):
+    return root / table / day
+
+
+def _write_partition(root, table, day, rows, columns):
+    """Append ``columns`` to a partition that holds ``rows`` committed rows"""
+    path = _partition_dir(root, table, day)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, dtype in TABLES[table].items():
+        with open(path / f'{name}.bin', 'ab') as f:
+            # Drop whatever an interrupted append left past the manifest
+            f.truncate(rows * np.dtype(dtype).itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+
+def _append_rows(root, manifest, table, columns):
+    """Write rows sorted by timestamp into their day partitions"""
+    partitions = manifest['tables'][table]['partitions']
+    days = columns['timestamp'] // DAY
+    bounds = np.flatnonzero(np.diff(days)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(days)]):
+        day = (date(1970, 1, 1) + timedelta(days=int(days[start]))).isoformat()
+        rows = partitions.get(day, 0)
+        _write_partition(root, table, day, rows, {name: values[start:end] for name, values in columns.items()})
+        partitions[day] = rows + int(end - start)
+
+
+def _seconds(moments):
+    return np.fromiter((moment.timestamp() for moment in moments), dtype=np.int64, count=len(moments))
+
+
+def _watermark(value):
+    """``(aware datetime, id)`` from a manifest watermark"""
+    if value is None:
+        return None, None
+    return datetime.fromisoformat(value[0]), value[1]
+
+
+def _after(queryset, time_field, id_field, watermark):
+    at, last_id = _watermark(watermark)
+    if last_id is None:
+        return queryset
+    return queryset.filter(Q(**{f'{time_field}__gt': at}) | Q(**{time_field: at, f'{id_field}__gt': last_id}))
+
+
+def _price_batch(watermark, cutoff, batch_size):
+    rows = list(
+        _after(PriceHistory.objects.filter(recorded_at__lte=cutoff), 'recorded_at', 'id', watermark)
+        .order_by('recorded_at', 'id')
+        .values_list('recorded_at', 'id', 'product_id', 'product__category_id', 'price')[:batch_size]
+    )
+    if not rows:
+        return None, watermark
+    recorded_at, ids, products, categories, prices = zip(*rows)
+    columns = {
+        'timestamp': _seconds(recorded_at),
+        'product': np.array(products, dtype=np.int64),
+        'category': np.array(categories, dtype=np.int64),
+        'price': np.array(prices, dtype=np.float64),
+    }
+    return columns, [recorded_at[-1].isoformat(), ids[-1]]
+
+
+def _sales_batch(watermark, cutoff, batch_size):
+    orders = list(
+        _after(Order.objects.filter(created_at__lte=cutoff), 'created_at', 'id', watermark)
+        .order_by('created_at', 'id')
+        .values_list('created_at', 'id')[:batch_size]
+    )
+    if not orders:
+        return None, watermark
+    rows = list(
+        OrderItem.objects.filter(order_id__in=[order_id for _, order_id in orders])
+        .order_by('order__created_at', 'order_id', 'id')
+        .values_list('order__created_at', 'product_id', 'product__category_id', 'unit_price', 'quantity')
+    )
+    new_watermark = [orders[-1][0].isoformat(), orders[-1][1]]
+    if not rows:
+        return None, new_watermark
+    created_at, products, categories, prices, quantities = zip(*rows)
+    columns = {
+        'timestamp': _seconds(created_at),
+        'product': np.array(products, dtype=np.int64),
+        'category': np.array(categories, dtype=np.int64),
+        'price': np.array(prices, dtype=np.float64),
+        'qty': np.array(quantities, dtype=np.int64),
+    }
+    return columns, new_watermark
+
+
+BATCHES = {'prices': _price_batch, 'sales': _sales_batch}
+
+
+def append(now=None, batch_size=BATCH_SIZE):
+    """
+    Copy new price history and sales lines into the store.
+
+    Returns ``{table: rows appended}``, or ``None`` when the store is off.
+    """
+    root = store_dir()
+    if root is None:
+        return None
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(root) or _empty_manifest()
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=settings.INSIGHTS_SETTLE_DELAY)
+
+    manifest['categories'] = {str(pk): name for pk, name in Category.objects.values_list('id', 'name')}
+    appended = {}
+    for table, batch in BATCHES.items():
+        state = manifest['tables'][table]
+        appended[table] = 0
+        while True:
+            columns, watermark = batch(state['watermark'], cutoff, batch_size)
+            if watermark == state['watermark']:
+                break
+            if columns is not None:
+                _append_rows(root, manifest, table, columns)
+                appended[table] += len(columns['timestamp'])
+            state['watermark'] = watermark
+            _save_manifest(root, manifest)
+    _save_manifest(root, manifest)
+    return appended
+
+
+def partition(table, day, manifest=None, root=None):
+    """Read-only memory maps of a day partition's columns, or ``None``"""
+    root = root or store_dir()
+    manifest = manifest or load_manifest(root)
+    rows = manifest['tables'][table]['partitions'].get(day.isoformat(), 0)
+    if not rows:
+        return None
+    path = _partition_dir(root, table, day.isoformat())
+    return {
+        name: np.memmap(path / f'{name}.bin', dtype=dtype, mode='r', shape=(rows,))
+        for name, dtype in TABLES[table].items()
+    }
+
+
+def scan(table, start, end, columns, category_id=None):
+    """
+    ``columns`` of the rows in ``[start, end)``, as ``{name: array}``.
+
+    Partitions entirely inside the range are used as mapped; only the edge
+    days are filtered by timestamp.
+    """
+    root = store_dir()
+    manifest = load_manifest(root)
+    first, last = int(start.timestamp()), int(end.timestamp())
+    day = datetime.fromtimestamp(first, dt_timezone.utc).date()
+    last_day = datetime.fromtimestamp(last - 1, dt_timezone.utc).date()
+    parts = {name: [] for name in columns}
+    while day <= last_day:
+        data = manifest and partition(table, day, manifest, root)
+        day += timedelta(days=1)
+        if data is None:
+            continue
+        keep = None
+        timestamps = data['timestamp']
+        if timestamps[0] < first or timestamps[-1] >= last:
+            keep = (timestamps >= first) & (timestamps < last)
+        if category_id is not None:
+            in_category = data['category'] == category_id
+            keep = in_category if keep is None else keep & in_category
+        for name in columns:
+            parts[name].append(data[name] if keep is None else data[name][keep])
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0, dtype=TABLES[table][name])
+        for name, arrays in parts.items()
+    }
+
+
+def category_names():
+    """``{category id: name}`` as of the last append"""
+    manifest = load_manifest() or _empty_manifest()
+    return {int(pk): name for pk, name in manifest['categories'].items()}
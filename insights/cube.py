@@ -0,0 +1,238 @@
+"""
+Seller analytics cube.
+
+``SellerProductDay`` holds one row per product and day with its views,
+cart adds, orders, units sold and revenue, keyed by seller for the seller
+dashboard. The dashboard only ever groups these rows, never the order or
+event history.
+
+Views and cart adds come from ``record_event()``, which the product page
+and the add-to-cart endpoint call. Counts are buffered in the process and
+added to the cube with one ``F()`` update per touched row at most every
+``FLUSH_INTERVAL`` seconds or ``FLUSH_SIZE`` distinct rows, so a busy
+product page does not write on every hit. A timer thread flushes the
+buffer ``FLUSH_INTERVAL`` seconds after its first count, so a quiet
+process does not sit on counts until its next event, and the buffer is
+flushed once more when the process exits. Counts lost to a crash are
+tolerated; they are analytics, not accounting.
+
+Sales are folded in by ``refresh_seller_cube()`` from the order status
+changes past the ``SellerCubeWatermark``, in the same transaction that
+moves it, exactly like the market metrics: only paid orders count, and a
+cancellation or refund takes the order off the day it was placed. Days
+follow the project time zone.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from marketplace.models import Product
+from payments.models import OrderItem
+from .metrics import SALE_STATUSES, latest_change, pending_changes, sale_signs, signed_lines
+from .models import SellerCubeWatermark, SellerProductDay
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('views', 'cart_adds')
+FLUSH_INTERVAL = 5  # seconds
+FLUSH_SIZE = 500  # distinct (product, day) rows
+WATERMARK_ID = 1
+DEFAULT_DAYS = 30
+PRODUCT_LIMIT = 50
+CACHE_TIMEOUT = 60  # seconds
+CACHE_KEY = 'insights:seller:{}:{}:{}'
+SALE_TOTALS = {
+    'orders': Count('order_id', distinct=True), 'units': Sum('quantity'), 'revenue': Sum('total_price'),
+}
+SALE_FIELDS = ('product__seller_id', 'product_id', 'day')
+
+_lock = threading.Lock()
+_buffer = {}
+_flushed_at = time.monotonic()
+_timer = None
+
+
+def _add(rows):
+    """Add ``{(seller id, product id, day): {field: delta}}`` to the cube, all or nothing"""
+    with transaction.atomic():
+        SellerProductDay.objects.bulk_create(
+            [SellerProductDay(seller_id=seller_id, product_id=product_id, date=day)
+             for seller_id, product_id, day in rows],
+            ignore_conflicts=True,
+        )
+        for (_, product_id, day), deltas in rows.items():
+            SellerProductDay.objects.filter(product_id=product_id, date=day).update(
+                **{field: F(field) + delta for field, delta in deltas.items()}
+            )
+
+
+def flush_events():
+    """Write the buffered event counts to the cube"""
+    global _buffer, _flushed_at
+    with _lock:
+        rows, _buffer = _buffer, {}
+        _flushed_at = time.monotonic()
+    if not rows:
+        return
+    try:
+        # Skip products deleted since the events were counted
+        existing = set(Product.objects.filter(id__in={key[1] for key in rows}).values_list('id', flat=True))
+        _add({key: deltas for key, deltas in rows.items() if key[1] in existing})
+    except Exception:
+        logger.exception(f"Dropped {len(rows)} buffered seller cube event rows")
+
+
+def _timed_flush():
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        flush_events()
+    finally:
+        # The timer thread's own connection, not the request's
+        connection.close()
+
+
+def record_event(product, event, count=1):
+    """Count a ``views`` or ``cart_adds`` event for ``product`` today"""
+    global _timer
+    key = (product.seller_id, product.id, timezone.localdate())
+    with _lock:
+        deltas = _buffer.setdefault(key, dict.fromkeys(EVENTS, 0))
+        deltas[event] += count
+        due = len(_buffer) >= FLUSH_SIZE or time.monotonic() - _flushed_at >= FLUSH_INTERVAL
+        if not due and _timer is None:
+            _timer = threading.Timer(FLUSH_INTERVAL, _timed_flush)
+            _timer.daemon = True
+            _timer.start()
+    if due:
+        flush_events()
+
+
+atexit.register(flush_events)
+
+
+def _order_lines():
+    return OrderItem.objects.annotate(day=TruncDate('order__created_at'))
+
+
+def rebuild_seller_sales():
+    """Recount the cube's sales from every paid order and restart folding after the latest change"""
+    with transaction.atomic():
+        watermark, _ = SellerCubeWatermark.objects.select_for_update().get_or_create(pk=WATERMARK_ID)
+        watermark.watermark_created_at, watermark.watermark_change_id = latest_change()
+        SellerProductDay.objects.update(orders=0, units_sold=0, revenue=0)
+        lines = (
+            _order_lines().filter(order__status__in=SALE_STATUSES)
+            .values_list(*SALE_FIELDS).annotate(**SALE_TOTALS).order_by()
+        )
+        SellerProductDay.objects.bulk_create(
+            [
+                SellerProductDay(seller_id=seller_id, product_id=product_id, date=day,
+                                 orders=orders, units_sold=units, revenue=revenue)
+                for seller_id, product_id, day, orders, units, revenue in lines.iterator()
+            ],
+            batch_size=1000, update_conflicts=True, unique_fields=['product', 'date'],
+            update_fields=['orders', 'units_sold', 'revenue'],
+        )
+        watermark.refreshed_at = timezone.now()
+        watermark.save()
+
+
+def refresh_seller_cube(batch_size=5000, now=None):
+    """Fold status changes past the watermark into the cube; returns how many"""
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=settings.INSIGHTS_SETTLE_DELAY)
+    if not SellerCubeWatermark.objects.filter(pk=WATERMARK_ID, watermark_change_id__isnull=False).exists():
+        rebuild_seller_sales()
+    total = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = SellerCubeWatermark.objects.select_for_update().get_or_create(pk=WATERMARK_ID)
+            changes = list(
+                pending_changes(watermark, cutoff).values_list('id', 'created_at', 'order_id', 'to_status')[:batch_size]
+            )
+            if not changes:
+                break
+            signs = sale_signs((order_id, to_status) for _, _, order_id, to_status in changes)
+            rows = {}
+            for sign, (seller_id, product_id, day, orders, units, revenue) in signed_lines(
+                signs, _order_lines(), SALE_FIELDS, **SALE_TOTALS
+            ):
+                deltas = rows.setdefault((seller_id, product_id, day), {'orders': 0, 'units_sold': 0, 'revenue': 0})
+                deltas['orders'] += sign * orders
+                deltas['units_sold'] += sign * units
+                deltas['revenue'] += sign * revenue
+            _add(rows)
+            watermark.watermark_change_id, watermark.watermark_created_at = changes[-1][:2]
+            watermark.refreshed_at = timezone.now()
+            watermark.save()
+        total += len(changes)
+        if len(changes) < batch_size:
+            break
+    return total
+
+
+def _conversion(orders, views):
+    """Orders per hundred views, or ``None`` without views"""
+    return round(orders * 100 / views, 1) if views else None
+
+
+def seller_dashboard_context(seller, days=DEFAULT_DAYS, today=None):
+    """Totals, daily series and top products of ``seller`` over the last ``days`` days, from the cube"""
+    today = today or timezone.localdate()
+    key = CACHE_KEY.format(seller.pk, days, today.isoformat())
+    context = cache.get(key)
+    if context is not None:
+        return context
+
+    start = today - timezone.timedelta(days=days - 1)
+    rows = SellerProductDay.objects.filter(seller=seller, date__gte=start, date__lte=today)
+    measures = {
+        'views': Sum('views'), 'cart_adds': Sum('cart_adds'), 'orders': Sum('orders'),
+        'units_sold': Sum('units_sold'), 'revenue': Sum('revenue'),
+    }
+    daily = {row['date']: row for row in rows.values('date').annotate(**measures).order_by()}
+    series = []
+    for offset in range(days):
+        day = start + timezone.timedelta(days=offset)
+        row = daily.get(day, {})
+        series.append({
+            'date': day.isoformat(),
+            'views': row.get('views', 0),
+            'cart_adds': row.get('cart_adds', 0),
+            'orders': row.get('orders', 0),
+            'revenue': float(row.get('revenue') or 0),
+        })
+
+    products = list(
+        rows.values('product_id', 'product__name')
+        .annotate(**measures)
+        .order_by('-revenue', '-views', 'product_id')[:PRODUCT_LIMIT]
+    )
+    for product in products:
+        product['conversion'] = _conversion(product['orders'], product['views'])
+
+    totals = {field: sum(day[field] for day in series) for field in ['views', 'cart_adds', 'orders']}
+    totals['revenue'] = sum(row['revenue'] or 0 for row in daily.values())
+    totals['units_sold'] = sum(row['units_sold'] or 0 for row in daily.values())
+    totals['conversion'] = _conversion(totals['orders'], totals['views'])
+
+    context = {
+        'days': days,
+        'start': start,
+        'end': today,
+        'totals': totals,
+        'series': series,
+        'top_products': products,
+        'listing_count': Product.objects.filter(seller=seller).count(),
+    }
+    cache.set(key, context, CACHE_TIMEOUT)
+    return context
@@ -0,0 +1,178 @@
+"""
+Streaming exports of insights data.
+
+The datasets are price history, daily market trends and sales lines. Rows
+are read through ``.iterator()`` (a server-side cursor on PostgreSQL) and
+encoded as they arrive: CSV and JSONL in chunks of about 64 KB, Parquet one
+row group at a time, each drained to the response as soon as it is
+written. A download starts sending bytes straight away and worker memory
+stays flat whatever the range.
+
+Exports of more than ``INSIGHTS_EXPORT_STREAM_MAX_ROWS`` rows run as a
+background job instead and are saved, named after the export's id, to the
+private ``INSIGHTS_EXPORT_STORAGE``; its creator downloads the file through
+the export download view. See ``InsightsExport``.
+"""
+import io
+import logging
+import tempfile
+
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from payments.exports import CHUNK_SIZE, CSV_BUFFER_SIZE, csv_chunks, parquet_row_groups, parquet_schema
+from payments.models import OrderItem
+from .models import MarketTrend, PriceHistory
+
+logger = logging.getLogger(__name__)
+
+# (column, lookup, type) per dataset
+DATASETS = {
+    'prices': [
+        ('recorded_at', 'recorded_at', 'datetime'),
+        ('product_id', 'product_id', 'int'),
+        ('product', 'product__name', 'str'),
+        ('category', 'product__category__name', 'str'),
+        ('price', 'price', 'decimal'),
+    ],
+    'trends': [
+        ('date', 'date', 'date'),
+        ('category', 'category__name', 'str'),
+        ('average_price', 'average_price', 'decimal'),
+        ('total_sales', 'total_sales', 'int'),
+    ],
+    'sales': [
+        ('ordered_at', 'order__created_at', 'datetime'),
+        ('item_id', 'id', 'int'),
+        ('product_id', 'product_id', 'int'),
+        ('product', 'product__name', 'str'),
+        ('category', 'product__category__name', 'str'),
+        ('quantity', 'quantity', 'int'),
+        ('unit_price', 'unit_price', 'decimal'),
+        ('line_total', 'total_price', 'decimal'),
+    ],
+}
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'jsonl': ('application/x-ndjson', '.jsonl'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+PARQUET_ROW_GROUP_SIZE = 50000
+
+
+def export_queryset(dataset, start, end, category_id=None):
+    """Rows of ``dataset`` in ``[start, end)``, as a ``values_list`` queryset"""
+    if dataset == 'prices':
+        rows = PriceHistory.objects.filter(recorded_at__gte=start, recorded_at__lt=end).order_by('recorded_at', 'id')
+        category_lookup = 'product__category_id'
+    elif dataset == 'trends':
+        rows = MarketTrend.objects.filter(
+            date__gte=timezone.localdate(start), date__lt=timezone.localdate(end)
+        ).order_by('date', 'category_id')
+        category_lookup = 'category_id'
+    else:
+        rows = OrderItem.objects.filter(
+            order__created_at__gte=start, order__created_at__lt=end
+        ).order_by('order__created_at', 'order_id', 'id')
+        category_lookup = 'product__category_id'
+    if category_id is not None:
+        rows = rows.filter(**{category_lookup: category_id})
+    return rows.values_list(*[lookup for _, lookup, _ in DATASETS[dataset]])
+
+
+def jsonl_chunks(rows, columns):
+    """One JSON object per line, in chunks of about ``CSV_BUFFER_SIZE`` bytes"""
+    names = [name for name, _, _ in columns]
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    buffer = []
+    size = 0
+    for row in rows:
+        line = encoder.encode(dict(zip(names, row))) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CSV_BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    yield ''.join(buffer).encode()
+
+
+class _Drain(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(rows, columns, row_group_size=None):
+    """Parquet file bytes, yielded after each row group and the footer"""
+    import pyarrow.parquet as pq
+
+    row_group_size = row_group_size or PARQUET_ROW_GROUP_SIZE
+    schema = parquet_schema(columns)
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for table in parquet_row_groups(rows, schema, row_group_size):
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    'csv': csv_chunks,
+    'jsonl': jsonl_chunks,
+    'parquet': parquet_chunks,
+}
+
+
+def export_chunks(dataset, export_format, start, end, category_id=None):
+    """Encoded export of ``dataset``, as a stream of byte chunks"""
+    rows = export_queryset(dataset, start, end, category_id).iterator(chunk_size=CHUNK_SIZE)
+    return ENCODERS[export_format](rows, DATASETS[dataset])
+
+
+def export_filename(dataset, export_format, start, end):
+    return f"{dataset}-{start:%Y%m%d}-{end:%Y%m%d}{FORMATS[export_format][1]}"
+
+
+def run_export(export):
+    """Produce an ``InsightsExport`` into the export storage"""
+    export.status = 'running'
+    export.save(update_fields=['status'])
+    try:
+        with tempfile.TemporaryFile() as spool:
+            for chunk in export_chunks(export.dataset, export.export_format, export.start, export.end,
+                                       export.category_id):
+                spool.write(chunk)
+            spool.seek(0)
+            export.file.save(f"{export.id}{FORMATS[export.export_format][1]}", File(spool), save=False)
+        export.status = 'done'
+    except Exception as e:
+        logger.exception(f"Insights export {export.id} failed")
+        export.status = 'failed'
+        export.error = str(e)
+    export.finished_at = timezone.now()
+    export.save()
+    return export
@@ -0,0 +1,290 @@
+"""
+Daily price forecasts per category.
+
+The ``MarketTrend`` average price of each category is modelled as a daily
+series with damped additive Holt-Winters smoothing and a weekly season, in
+error-correction form::
+
+    error    = price - (level + PHI * trend + seasonal[day])
+    level   += PHI * trend + alpha * error   (trend damped first)
+    trend    = PHI * trend + beta * error
+    seasonal[day] += gamma * error
+
+Seasonal slots are keyed by ``date.toordinal() % 7`` and days without a
+trend row carry the last price forward. The recursion steps through time
+once and is vectorised over categories and over the whole
+``(alpha, beta, gamma)`` grid, so a fit picks each category's parameters by
+one-step squared error in one pass.
+
+``update_forecasts()`` fully fits categories with no state, or whose state
+is older than ``REFIT_DAYS``, optionally spreading them over a process
+pool. Every other category only runs the recursion over the days
+completed since its ``ForecastState``, with its parameters kept. Each run
+then stores ``HORIZON`` days of ``PriceForecast`` rows with 95% intervals
+from the model's h-step error variance. Only completed days (before today)
+are used.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ForecastState, MarketTrend, PriceForecast
+
+SEASON = 7
+HORIZON = 30
+MIN_DAYS = 2 * SEASON
+PHI = 0.98
+REFIT_DAYS = 7
+Z = 1.96  # 95% interval
+GRID = np.array([
+    (alpha, beta, gamma)
+    for alpha in (0.05, 0.1, 0.2, 0.3, 0.5, 0.7)
+    for beta in (0.0, 0.01, 0.05, 0.1)
+    for gamma in (0.0, 0.05, 0.1, 0.2)
+    if beta <= alpha and gamma <= 1 - alpha
+])
+
+
+def smooth(values, start, first_ordinal, level, trend, seasonal, alpha, beta, gamma):
+    """
+    Run the recursion over ``values`` (categories x days) from column ``start``.
+
+    ``level`` and ``trend`` are (categories x K) for K parameter sets,
+    ``seasonal`` is (categories x K x 7), and the parameters broadcast to
+    (categories x K). Returns the new level, trend and seasonal, the sum of
+    squared one-step errors and the number of errors per category.
+    """
+    level, trend, seasonal = level.copy(), trend.copy(), seasonal.copy()
+    sse = np.zeros(level.shape)
+    count = np.zeros(len(values), dtype=np.int64)
+    for t in range(values.shape[1]):
+        active = (t >= start) & ~np.isnan(values[:, t])
+        if not active.any():
+            continue
+        slot = (first_ordinal + t) % SEASON
+        on = active[:, None]
+        error = np.where(on, values[:, t, None] - (level + PHI * trend + seasonal[:, :, slot]), 0.0)
+        level = np.where(on, level + PHI * trend, level) + alpha * error
+        trend = np.where(on, PHI * trend, trend) + beta * error
+        seasonal[:, :, slot] += gamma * error
+        sse += error ** 2
+        count += active
+    return level, trend, seasonal, sse, count
+
+
+def fit(values, first, first_ordinal):
+    """
+    Fit the parameter grid to each series, starting at its column ``first``.
+
+    Series need ``MIN_DAYS`` columns from ``first``. The first week sets
+    the initial level and season, the second the initial trend. Returns the
+    chosen ``(alpha, beta, gamma)`` rows, level, trend, seasonal, sse and
+    error count per category.
+    """
+    categories = np.arange(len(values))[:, None]
+    window = first[:, None] + np.arange(MIN_DAYS)
+    initial = values[categories, window]
+    first_week = initial[:, :SEASON].mean(axis=1)
+    trend = (initial[:, SEASON:].mean(axis=1) - first_week) / SEASON
+    # Level at the end of the first week, and the season net of the trend
+    level = first_week + (SEASON - 1) / 2 * trend
+    seasonal = np.zeros((len(values), SEASON))
+    offsets = np.arange(SEASON) - (SEASON - 1) / 2
+    seasonal[categories, (first_ordinal + window[:, :SEASON]) % SEASON] = (
+        initial[:, :SEASON] - first_week[:, None] - offsets * trend[:, None]
+    )
+
+    k = len(GRID)
+    level, trend, seasonal, sse, count = smooth(
+        values, first + SEASON, first_ordinal,
+        np.repeat(level[:, None], k, axis=1), np.repeat(trend[:, None], k, axis=1),
+        np.repeat(seasonal[:, None, :], k, axis=1), GRID[:, 0], GRID[:, 1], GRID[:, 2],
+    )
+    best = sse.argmin(axis=1)
+    rows = categories[:, 0]
+    return GRID[best], level[rows, best], trend[rows, best], seasonal[rows, best], sse[rows, best], count
+
+
+def fit_parallel(values, first, first_ordinal, workers=1):
+    """``fit`` with the categories split over ``workers`` processes"""
+    if workers <= 1 or len(values) < 2:
+        return fit(values, first, first_ordinal)
+    chunks = np.array_split(np.arange(len(values)), min(workers, len(values)))
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        results = list(pool.map(fit, [values[c] for c in chunks], [first[c] for c in chunks],
+                                [first_ordinal] * len(chunks)))
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def forecast(level, trend, seasonal, params, sigma, last_ordinal, horizon=HORIZON):
+    """Mean, lower and upper forecasts (categories x ``horizon``) after ``last_ordinal``"""
+    categories = np.arange(len(level))[:, None]
+    steps = np.arange(1, horizon + 1)
+    damped = np.cumsum(PHI ** steps)  # PHI + ... + PHI ** h
+    mean = level[:, None] + damped * trend[:, None] + seasonal[categories, (last_ordinal[:, None] + steps) % SEASON]
+    # h-step variance: sigma**2 * (1 + sum of c_j**2 for j < h)
+    alpha, beta, gamma = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+    c = alpha + beta * damped[:-1] + gamma * (steps[:-1] % SEASON == 0)
+    spread = np.concatenate([np.zeros((len(level), 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+    half = Z * sigma[:, None] * np.sqrt(1 + spread)
+    mean = np.maximum(mean, 0)
+    return mean, np.maximum(mean - half, 0), mean + half
+
+
+def _series(category_ids, since, through):
+    """``(category id, date, price)`` trend rows, ordered"""
+    rows = MarketTrend.objects.filter(category_id__in=category_ids, date__lte=through)
+    if since is not None:
+        rows = rows.filter(date__gt=since)
+    return rows.order_by('category_id', 'date').values_list('category_id', 'date', 'average_price')
+
+
+def _matrix(category_ids, rows, base, through):
+    """Prices (categories x days from ``base``), carried forward over missing days"""
+    index = {category_id: i for i, category_id in enumerate(category_ids)}
+    values = np.full((len(category_ids), (through - base).days + 1), np.nan)
+    for category_id, day, price in rows:
+        values[index[category_id], (day - base).days] = float(price)
+    filled = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(filled, axis=1, out=filled)
+    return values[np.arange(len(values))[:, None], filled]
+
+
+def _refit(category_ids, through, workers, fitted_at):
+    """Full fits of ``category_ids``; returns ``{category id: unsaved ForecastState}``"""
+    rows = list(_series(category_ids, None, through))
+    firsts = {}
+    for category_id, day, _ in rows:
+        firsts.setdefault(category_id, day)
+    category_ids = [c for c, day in firsts.items() if (through - day).days + 1 >= MIN_DAYS]
+    if not category_ids:
+        return {}
+    base = min(firsts[c] for c in category_ids)
+    kept = set(category_ids)
+    values = _matrix(category_ids, [row for row in rows if row[0] in kept], base, through)
+    first = np.array([(firsts[c] - base).days for c in category_ids])
+    params, level, trend, seasonal, sse, count = fit_parallel(
+        values, first, base.toordinal(), workers or settings.INSIGHTS_FORECAST_WORKERS
+    )
+    return {
+        category_id: ForecastState(
+            category_id=category_id, alpha=params[i, 0], beta=params[i, 1], gamma=params[i, 2],
+            level=level[i], trend=trend[i], seasonal=seasonal[i].tolist(), last_price=values[i, -1],
+            sse=sse[i], errors=int(count[i]), last_date=through, fitted_at=fitted_at,
+        )
+        for i, category_id in enumerate(category_ids)
+    }
+
+
+def _advance(states, through):
+    """Run the recursion over the days after each state's ``last_date``"""
+    base = min(state.last_date for state in states)
+    category_ids = [state.category_id for state in states]
+    last = {state.category_id: state.last_date for state in states}
+    rows = [row for row in _series(category_ids, base, through) if row[1] > last[row[0]]]
+    # Seed each series with its last price, so missing days carry it forward
+    rows += [(state.category_id, state.last_date, state.last_price) for state in states]
+    values = _matrix(category_ids, rows, base, through)
+    start = np.array([(state.last_date - base).days + 1 for state in states])
+    params = np.array([(state.alpha, state.beta, state.gamma) for state in states])
+    level, trend, seasonal, sse, count = smooth(
+        values, start, base.toordinal(),
+        np.array([[state.level] for state in states]), np.array([[state.trend] for state in states]),
+        np.array([[state.seasonal] for state in states]), params[:, 0:1], params[:, 1:2], params[:, 2:3],
+    )
+    for i, state in enumerate(states):
+        state.level, state.trend, state.seasonal = level[i, 0], trend[i, 0], seasonal[i, 0].tolist()
+        state.sse += sse[i, 0]
+        state.errors += int(count[i])
+        state.last_price = values[i, -1]
+        state.last_date = through
+    return {state.category_id: state for state in states}
+
+
+def _store(states, through):
+    """Save ``states`` and replace their categories' forecasts"""
+    states = list(states.values())
+    params = np.array([(state.alpha, state.beta, state.gamma) for state in states])
+    sigma = np.sqrt([state.sse / max(state.errors, 1) for state in states])
+    mean, lower, upper = forecast(
+        np.array([state.level for state in states]), np.array([state.trend for state in states]),
+        np.array([state.seasonal for state in states]), params, sigma,
+        np.full(len(states), through.toordinal()),
+    )
+    cents = Decimal('0.01')
+    forecasts = [
+        PriceForecast(
+            category_id=state.category_id, date=through + timedelta(days=h + 1),
+            price=Decimal(mean[i, h]).quantize(cents), lower=Decimal(lower[i, h]).quantize(cents),
+            upper=Decimal(upper[i, h]).quantize(cents),
+        )
+        for i, state in enumerate(states) for h in range(mean.shape[1])
+    ]
+    with transaction.atomic():
+        ForecastState.objects.bulk_create(
+            states, update_conflicts=True, unique_fields=['category'],
+            update_fields=['alpha', 'beta', 'gamma', 'level', 'trend', 'seasonal', 'last_price', 'sse', 'errors',
+                           'last_date', 'fitted_at', 'updated_at'],
+        )
+        PriceForecast.objects.filter(category_id__in=[state.category_id for state in states]).delete()
+        PriceForecast.objects.bulk_create(forecasts, batch_size=1000)
+
+
+def update_forecasts(now=None, refit=False, workers=None):
+    """
+    Bring every category's forecast up to the last completed day.
+
+    Returns ``(categories fully fitted, categories updated incrementally)``.
+    """
+    now = now or timezone.now()
+    through = timezone.localdate(now) - timedelta(days=1)
+    category_ids = set(MarketTrend.objects.filter(date__lte=through).values_list('category_id', flat=True).distinct())
+    states = {} if refit else ForecastState.objects.in_bulk(list(category_ids))
+    stale_before = now - timedelta(days=REFIT_DAYS)
+    to_fit = [c for c in category_ids if c not in states or states[c].fitted_at < stale_before]
+    to_advance = [state for c, state in states.items() if c not in to_fit and state.last_date < through]
+
+    fitted = _refit(to_fit, through, workers, now) if to_fit else {}
+    advanced = _advance(to_advance, through) if to_advance else {}
+    if fitted or advanced:
+        _store({**fitted, **advanced}, through)
+    return len(fitted), len(advanced)
+
+
+def category_forecasts(category_id=None):
+    """Stored forecasts per category, those expected to gain the most first"""
+    states = ForecastState.objects.select_related('category')
+    forecasts = PriceForecast.objects.order_by('category_id', 'date')
+    if category_id is not None:
+        states = states.filter(category_id=category_id)
+        forecasts = forecasts.filter(category_id=category_id)
+    series = {}
+    for row in forecasts.values_list('category_id', 'date', 'price', 'lower', 'upper'):
+        series.setdefault(row[0], []).append(row[1:])
+
+    categories = []
+    for state in states:
+        points = series.get(state.category_id)
+        if not points:
+            continue
+        dates, prices, lowers, uppers = zip(*points)
+        categories.append({
+            'id': state.category_id,
+            'name': state.category.name,
+            'last_price': round(state.last_price, 2),
+            'through': state.last_date.isoformat(),
+            'change': round((float(prices[-1]) / state.last_price - 1) * 100, 1) if state.last_price else None,
+            'forecast': {
+                'dates': [day.isoformat() for day in dates],
+                'price': [float(price) for price in prices],
+                'lower': [float(price) for price in lowers],
+                'upper': [float(price) for price in uppers],
+            },
+        })
+    categories.sort(key=lambda category: -(category['change'] or 0))
+    return categories
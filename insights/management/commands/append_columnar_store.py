@@ -0,0 +1,27 @@
+import shutil
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from insights import columnar
+
+
+class Command(BaseCommand):
+    help = 'Append new price history and sales lines to the columnar analytics store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Delete the store and copy every row again')
+
+    def handle(self, *args, **options):
+        root = columnar.store_dir()
+        if root is None:
+            raise CommandError('INSIGHTS_COLUMNAR_DIR is not set')
+        if options['rebuild']:
+            shutil.rmtree(root, ignore_errors=True)
+        started = time.perf_counter()
+        appended = columnar.append()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Appended {appended['prices']} price rows and {appended['sales']} sales lines in {elapsed:.2f}s"
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from insights.models import PriceHistory
+from insights.prices import FLUSH_SIZE, batch_price_history, capture_price
+from marketplace.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Record the current price of every product whose price history does not end with it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=FLUSH_SIZE,
+                            help='Rows per insert')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        latest = PriceHistory.objects.filter(product=OuterRef('pk')).order_by('-recorded_at', '-id')
+        products = (
+            Product.objects.annotate(last_price=Subquery(latest.values('price')[:1]))
+            .values_list('id', 'price', 'last_price')
+            .order_by('id')
+        )
+        recorded = 0
+        with batch_price_history(flush_size=options['batch_size']):
+            for product_id, price, last_price in products.iterator(chunk_size=options['batch_size']):
+                if last_price != price:
+                    capture_price(product_id, price)
+                    recorded += 1
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Recorded {recorded} current prices in {elapsed:.2f}s")
@@ -0,0 +1,36 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from insights.anomalies import score_prices
+
+
+class Command(BaseCommand):
+    help = 'Measure price anomaly scoring throughput on synthetic price history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000,
+                            help='Synthetic price history rows')
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--categories', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = np.random.default_rng(0)
+        products = np.sort(rng.integers(0, options['products'], rows))
+        categories = products % options['categories']
+        base = np.exp(rng.normal(2, 1, options['products']))
+        prices = np.round(base[products] * rng.normal(1, 0.05, rows), 2)
+        # One in a thousand prices typed a hundred times too high
+        typos = rng.random(rows) < 0.001
+        prices[typos] *= 100
+
+        started = time.perf_counter()
+        flagged, _, _, _ = score_prices(products, categories, prices)
+        elapsed = time.perf_counter() - started
+        caught = int((flagged & typos).sum())
+        self.stdout.write(
+            f"Scored {rows} prices in {elapsed * 1000:.1f} ms ({rows / elapsed:,.0f}/s): "
+            f"{int(flagged.sum())} flagged, {caught} of {int(typos.sum())} typos caught"
+        )
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from insights.anomalies import detect_anomalies
+
+
+class Command(BaseCommand):
+    help = 'Flag recorded prices that stand out from the product history or category peers'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        scored, new, cleared = detect_anomalies()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Scored {scored} prices in {elapsed:.2f}s ({scored / max(elapsed, 1e-9):,.0f}/s): "
+            f"{new} new anomalies, {cleared} cleared"
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from insights.metrics import rebuild_sales, refresh_metrics
+from insights.models import MarketSummary
+
+
+class Command(BaseCommand):
+    help = 'Fold new order status changes and the current catalog into the insights dashboard tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Status changes folded per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount the sales totals from every paid order first')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            rebuild_sales()
+        changes = refresh_metrics(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+
+        summary = MarketSummary.objects.get()
+        self.stdout.write(
+            f"Folded {changes} new status changes in {elapsed:.2f}s; "
+            f"{summary.order_count} orders, {summary.product_count} products, "
+            f"{summary.active_sellers} sellers in total"
+        )
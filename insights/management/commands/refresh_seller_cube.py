@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from insights.cube import rebuild_seller_sales, refresh_seller_cube
+
+
+class Command(BaseCommand):
+    help = 'Fold new order status changes into the per seller, product and day analytics cube'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Status changes folded per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount the cube sales from every paid order first')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            rebuild_seller_sales()
+        count = refresh_seller_cube(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Folded {count} status changes into the seller cube in {elapsed:.2f}s")
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from insights.trends import rollup_trends
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily per-category market trends touched since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every day instead of only the days touched since the last run')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rollup_trends(rebuild=options['rebuild'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Wrote {count} market trend rows in {elapsed:.2f}s")
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from insights.forecasts import update_forecasts
+
+
+class Command(BaseCommand):
+    help = 'Update per-category price forecasts with the days completed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refit', action='store_true',
+                            help='Fit every category from its full history instead of updating')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes for full fits (defaults to INSIGHTS_FORECAST_WORKERS)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        fitted, advanced = update_forecasts(refit=options['refit'], workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Fitted {fitted} and updated {advanced} category forecasts in {elapsed:.2f}s")
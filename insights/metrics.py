@@ -0,0 +1,251 @@
+"""
+Materialized dashboard metrics.
+
+The dashboard reads the ``MarketSummary`` row and the top ``ProductSales``
+and ``CategorySales`` rows instead of aggregating products and orders on
+every request. ``refresh_metrics()`` keeps them current:
+
+* Only paid orders count as sales: those in one of ``SALE_STATUSES``. Sales
+  totals are folded in incrementally from the ``OrderStatusHistory`` rows
+  past the ``(created_at, id)`` watermark stored on the summary. A change
+  into a sale status adds the order's lines and a change out of one (a
+  cancellation or refund) takes them off again. This happens in the same
+  transaction that moves the watermark, so a crash never counts a change
+  twice.
+* Without a watermark (a fresh install, or after ``--rebuild``) the totals
+  are recounted from the orders' current status instead.
+* Catalog figures (product count, active sellers, average price and
+  products per category) are recomputed with one grouped query over
+  active products.
+
+Status changes are only folded once they are ``INSIGHTS_SETTLE_DELAY``
+seconds old, so changes still being written when a refresh starts are not
+skipped.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from marketplace.models import Product
+from payments.models import Order, OrderItem, OrderStatusHistory
+from .models import CategorySales, MarketSummary, ProductSales
+
+SUMMARY_ID = 1
+TOP_LIMIT = 5
+SALE_STATUSES = ['confirmed', 'processing', 'shipped', 'delivered']
+
+
+def sale_changes():
+    """Status changes that start or stop a sale"""
+    into_sale = Q(to_status__in=SALE_STATUSES)
+    from_sale = Q(from_status__in=SALE_STATUSES)
+    return OrderStatusHistory.objects.filter((into_sale & ~from_sale) | (from_sale & ~into_sale))
+
+
+def pending_changes(watermark, cutoff):
+    """Status changes after the watermark, made before ``cutoff``, that start or stop a sale"""
+    changes = sale_changes().filter(created_at__lte=cutoff)
+    if watermark.watermark_change_id is not None:
+        changes = changes.filter(
+            Q(created_at__gt=watermark.watermark_created_at)
+            | Q(created_at=watermark.watermark_created_at, id__gt=watermark.watermark_change_id)
+        )
+    return changes.order_by('created_at', 'id')
+
+
+def sale_signs(changes):
+    """``{order id: +1 or -1}`` for ``(order id, to status)`` changes, netted per order"""
+    signs = {}
+    for order_id, to_status in changes:
+        signs[order_id] = signs.get(order_id, 0) + (1 if to_status in SALE_STATUSES else -1)
+    return {order_id: sign for order_id, sign in signs.items() if sign}
+
+
+def signed_lines(signs, lines, fields, **annotations):
+    """``(sign, row)`` pairs of the ``lines`` of the orders in ``signs``, grouped by ``fields``"""
+    for sign in (1, -1):
+        order_ids = [order_id for order_id, order_sign in signs.items() if order_sign == sign]
+        if not order_ids:
+            continue
+        rows = lines.filter(order_id__in=order_ids).values_list(*fields).annotate(**annotations)
+        for row in rows.order_by():
+            yield sign, row
+
+
+def latest_change():
+    """``(created_at, id)`` of the newest status change, to restart folding from"""
+    return (
+        OrderStatusHistory.objects.order_by('-created_at', '-id').values_list('created_at', 'id').first()
+        or (timezone.now(), 0)
+    )
+
+
+def _add_totals(model, totals, fields):
+    """Add ``{pk: {field: delta}}`` to existing rows and create the missing ones"""
+    rows = model.objects.select_for_update().in_bulk(list(totals))
+    new_rows = []
+    for pk, deltas in totals.items():
+        row = rows.get(pk)
+        if row is None:
+            new_rows.append(model(pk=pk, **deltas))
+            continue
+        for field in fields:
+            setattr(row, field, getattr(row, field) + deltas[field])
+    model.objects.bulk_update(rows.values(), fields)
+    model.objects.bulk_create(new_rows)
+
+
+def _fold(products, categories, summary, sign, product_id, category_id, units, revenue, orders):
+    product = products.setdefault(
+        product_id, {'units_sold': 0, 'revenue': Decimal('0.00'), 'order_count': 0}
+    )
+    category = categories.setdefault(category_id, {'units_sold': 0, 'revenue': Decimal('0.00')})
+    for totals in (product, category):
+        totals['units_sold'] += sign * units
+        totals['revenue'] += sign * revenue
+    product['order_count'] += sign * orders
+    summary.revenue += sign * revenue
+
+
+LINE_TOTALS = {
+    'units': Sum('quantity'), 'revenue': Sum('total_price'), 'orders': Count('order_id', distinct=True),
+}
+
+
+def rebuild_sales():
+    """Recount the sales totals from every paid order and restart folding after the latest change"""
+    with transaction.atomic():
+        summary, _ = MarketSummary.objects.select_for_update().get_or_create(pk=SUMMARY_ID)
+        # Taken before the orders are read, so a change racing the rebuild
+        # is folded again rather than lost
+        summary.watermark_created_at, summary.watermark_change_id = latest_change()
+        paid = Order.objects.filter(status__in=SALE_STATUSES)
+        summary.order_count = paid.count()
+        summary.revenue = Decimal('0.00')
+        products, categories = {}, {}
+        lines = (
+            OrderItem.objects.filter(order__in=paid)
+            .values_list('product_id', 'product__category_id')
+            .annotate(**LINE_TOTALS)
+            .order_by()
+        )
+        for row in lines:
+            _fold(products, categories, summary, 1, *row)
+
+        ProductSales.objects.all().delete()
+        ProductSales.objects.bulk_create([ProductSales(pk=pk, **totals) for pk, totals in products.items()])
+        CategorySales.objects.update(units_sold=0, revenue=Decimal('0.00'))
+        _add_totals(CategorySales, categories, ['units_sold', 'revenue'])
+        summary.refreshed_at = timezone.now()
+        summary.save()
+    return summary.order_count
+
+
+def refresh_sales_batch(limit=5000, cutoff=None):
+    """Fold up to ``limit`` new status changes into the sales totals; returns how many"""
+    cutoff = cutoff or timezone.now() - timezone.timedelta(seconds=settings.INSIGHTS_SETTLE_DELAY)
+    with transaction.atomic():
+        summary, _ = MarketSummary.objects.select_for_update().get_or_create(pk=SUMMARY_ID)
+        changes = list(
+            pending_changes(summary, cutoff).values_list('id', 'created_at', 'order_id', 'to_status')[:limit]
+        )
+        if not changes:
+            return 0
+
+        signs = sale_signs((order_id, to_status) for _, _, order_id, to_status in changes)
+        products, categories = {}, {}
+        lines = signed_lines(signs, OrderItem.objects.all(), ('product_id', 'product__category_id'), **LINE_TOTALS)
+        for sign, row in lines:
+            _fold(products, categories, summary, sign, *row)
+        _add_totals(ProductSales, products, ['units_sold', 'revenue', 'order_count'])
+        _add_totals(CategorySales, categories, ['units_sold', 'revenue'])
+
+        summary.order_count += sum(signs.values())
+        summary.watermark_change_id, summary.watermark_created_at = changes[-1][:2]
+        summary.refreshed_at = timezone.now()
+        summary.save()
+    return len(changes)
+
+
+def refresh_catalog():
+    """Recompute the catalog figures from active products"""
+    products = Product.objects.filter(is_active=True)
+    with transaction.atomic():
+        summary, _ = MarketSummary.objects.select_for_update().get_or_create(pk=SUMMARY_ID)
+        stats = products.aggregate(
+            product_count=Count('id'),
+            active_sellers=Count('seller', distinct=True),
+            average_price=Avg('price'),
+        )
+        summary.product_count = stats['product_count']
+        summary.active_sellers = stats['active_sellers']
+        summary.average_price = Decimal(stats['average_price'] or 0).quantize(Decimal('0.01'))
+        summary.refreshed_at = timezone.now()
+        summary.save()
+
+        counts = dict(products.values_list('category_id').annotate(n=Count('id')).order_by())
+        changed = []
+        for row in CategorySales.objects.select_for_update():
+            product_count = counts.pop(row.category_id, 0)
+            if row.product_count != product_count:
+                row.product_count = product_count
+                changed.append(row)
+        CategorySales.objects.bulk_update(changed, ['product_count'])
+        CategorySales.objects.bulk_create([
+            CategorySales(category_id=category_id, product_count=n) for category_id, n in counts.items()
+        ])
+    return summary
+
+
+def refresh_metrics(batch_size=5000, now=None):
+    """Bring the dashboard tables up to date; returns the number of status changes folded"""
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=settings.INSIGHTS_SETTLE_DELAY)
+    if not MarketSummary.objects.filter(pk=SUMMARY_ID, watermark_change_id__isnull=False).exists():
+        rebuild_sales()
+    total = 0
+    while True:
+        folded = refresh_sales_batch(limit=batch_size, cutoff=cutoff)
+        total += folded
+        if folded < batch_size:
+            break
+    refresh_catalog()
+    return total
+
+
+def dashboard_context():
+    """Template context for the insights dashboard, from the materialized tables"""
+    summary = MarketSummary.objects.filter(pk=SUMMARY_ID).first() or MarketSummary()
+    top_products = [
+        {
+            'name': sales.product.name,
+            'sku': sales.product.slug,
+            'category': sales.product.category.name,
+            'price': sales.product.price,
+            'sales': sales.units_sold,
+            'revenue': sales.revenue,
+        }
+        for sales in ProductSales.objects.select_related('product__category').order_by('-units_sold')[:TOP_LIMIT]
+    ]
+    top_categories = [
+        {
+            'name': sales.category.name,
+            'product_count': sales.product_count,
+            'units_sold': sales.units_sold,
+            'total_sales': sales.revenue,
+        }
+        for sales in CategorySales.objects.select_related('category').order_by('-revenue')[:TOP_LIMIT]
+    ]
+    return {
+        'total_products': summary.product_count,
+        'active_sellers': summary.active_sellers,
+        'avg_price': summary.average_price,
+        'total_orders': summary.order_count,
+        'total_revenue': summary.revenue,
+        'refreshed_at': summary.refreshed_at,
+        'top_products': top_products,
+        'top_categories': top_categories,
+        'detailed_products': top_products,
+    }
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0003_market_metrics'),
+        ('marketplace', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['product', 'recorded_at'], name='insights_price_product_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0004_price_history_index'),
+        ('marketplace', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_recorded_at', models.DateTimeField(blank=True, null=True)),
+                ('price_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('order_created_at', models.DateTimeField(blank=True, null=True)),
+                ('order_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['recorded_at', 'id'], name='insights_price_recorded_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='markettrend',
+            constraint=models.UniqueConstraint(fields=('category', 'date'), name='insights_trend_category_date_uniq'),
+        ),
+    ]
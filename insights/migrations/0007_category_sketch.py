@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0006_insights_export'),
+        ('marketplace', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('buyers', models.BinaryField()),
+                ('sellers', models.BinaryField()),
+                ('list_prices', models.BinaryField()),
+                ('paid_prices', models.BinaryField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='marketplace.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='insights_sketch_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='categorysketch',
+            constraint=models.UniqueConstraint(fields=('category', 'date'), name='insights_sketch_category_date_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0007_category_sketch'),
+        ('marketplace', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('expected_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('score', models.FloatField(help_text='Robust z-score against the basis')),
+                ('basis', models.CharField(choices=[('product', "Product's recent prices"), ('category', 'Category peers')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending review'), ('confirmed', 'Confirmed'), ('dismissed', 'Dismissed')], default='pending', max_length=10)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('price_history', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='anomaly', to='insights.pricehistory')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='marketplace.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Price anomalies',
+                'indexes': [models.Index(fields=['status', '-detected_at'], name='insights_anomaly_status_idx')],
+            },
+        ),
+    ]
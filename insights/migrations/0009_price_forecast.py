@@ -0,0 +1,49 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0008_price_anomaly'),
+        ('marketplace', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastState',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast_state', serialize=False, to='marketplace.category')),
+                ('alpha', models.FloatField()),
+                ('beta', models.FloatField()),
+                ('gamma', models.FloatField()),
+                ('level', models.FloatField()),
+                ('trend', models.FloatField()),
+                ('seasonal', models.JSONField(default=list, help_text='Seasonal offsets by date ordinal mod 7')),
+                ('last_price', models.FloatField()),
+                ('sse', models.FloatField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('last_date', models.DateField()),
+                ('fitted_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('lower', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('upper', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='marketplace.category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='priceforecast',
+            constraint=models.UniqueConstraint(fields=('category', 'date'), name='insights_forecast_category_date_uniq'),
+        ),
+    ]
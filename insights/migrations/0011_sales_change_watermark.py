@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:31
+
+from django.db import migrations
+
+
+def reset_watermarks(apps, schema_editor):
+    # The old watermarks point at orders, not status changes; clearing them
+    # makes the next refresh recount the sales from paid orders
+    for name in ('MarketSummary', 'SellerCubeWatermark'):
+        apps.get_model('insights', name).objects.update(watermark_created_at=None, watermark_change_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0010_seller_cube'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='marketsummary',
+            old_name='watermark_order_id',
+            new_name='watermark_change_id',
+        ),
+        migrations.RenameField(
+            model_name='sellercubewatermark',
+            old_name='watermark_order_id',
+            new_name='watermark_change_id',
+        ),
+        migrations.RunPython(reset_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:46
+
+import insights.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0012_insightsexport_created_by'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='insightsexport',
+            name='file',
+            field=models.FileField(blank=True, storage=insights.models.export_storage, upload_to='insights/'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:52
+
+from django.db import migrations
+
+
+def reset_watermark(apps, schema_editor):
+    # Trends counted every order before; clearing the watermark makes the
+    # next rollup recompute every day with paid orders only
+    apps.get_model('insights', 'TrendWatermark').objects.update(
+        price_recorded_at=None, price_id=None, change_created_at=None, change_id=None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0013_insightsexport_private_file'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='trendwatermark',
+            old_name='order_created_at',
+            new_name='change_created_at',
+        ),
+        migrations.RenameField(
+            model_name='trendwatermark',
+            old_name='order_id',
+            new_name='change_id',
+        ),
+        migrations.RunPython(reset_watermark, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 class PriceHistory(models.Model):
     """Track product price changes"""
@@ -9,6 +12,11 @@ class PriceHistory(models.Model):
 
     class Meta:
         verbose_name_plural = "Price Histories"
+        indexes = [
+            models.Index(fields=['product', 'recorded_at'], name='insights_price_product_idx'),
+            # Incremental scans by the trend rollup
+            models.Index(fields=['recorded_at', 'id'], name='insights_price_recorded_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - ${self.price} on {self.recorded_at.date()}"
@@ -21,5 +29,222 @@ class MarketTrend(models.Model):
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='insights_trend_category_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.category.name} trend for {self.date}"
+
+class CategorySketch(models.Model):
+    """Mergeable daily sketches of buyers, sellers and prices per category, see insights.sketches"""
+    category = models.ForeignKey('marketplace.Category', on_delete=models.CASCADE)
+    date = models.DateField()
+    buyers = models.BinaryField()
+    sellers = models.BinaryField()
+    list_prices = models.BinaryField()
+    paid_prices = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='insights_sketch_category_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='insights_sketch_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.category.name} sketches for {self.date}"
+
+class TrendWatermark(models.Model):
+    """Price history and order status changes already rolled up into MarketTrend, a single row"""
+    price_recorded_at = models.DateTimeField(null=True, blank=True)
+    price_id = models.PositiveBigIntegerField(null=True, blank=True)
+    change_created_at = models.DateTimeField(null=True, blank=True)
+    change_id = models.PositiveBigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Trend watermark at {self.updated_at}"
+
+class MarketSummary(models.Model):
+    """Materialized dashboard totals, a single row kept up to date by refresh_market_metrics"""
+    product_count = models.PositiveIntegerField(default=0)
+    active_sellers = models.PositiveIntegerField(default=0)
+    average_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # (created_at, id) of the last order status change folded into the sales tables
+    watermark_created_at = models.DateTimeField(null=True, blank=True)
+    watermark_change_id = models.PositiveBigIntegerField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Market summary"
+
+    def __str__(self):
+        return f"Market summary at {self.refreshed_at}"
+
+class ProductSales(models.Model):
+    """Running sales totals per product"""
+    product = models.OneToOneField('marketplace.Product', on_delete=models.CASCADE, primary_key=True,
+                                   related_name='sales_summary')
+    units_sold = models.PositiveIntegerField(default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "Product sales"
+        indexes = [
+            models.Index(fields=['-units_sold'], name='insights_product_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.units_sold} sold"
+
+class CategorySales(models.Model):
+    """Running sales totals and product count per category"""
+    category = models.OneToOneField('marketplace.Category', on_delete=models.CASCADE, primary_key=True,
+                                    related_name='sales_summary')
+    product_count = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "Category sales"
+        indexes = [
+            models.Index(fields=['-revenue'], name='insights_category_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id}: ${self.revenue}"
+
+def export_storage():
+    """Private storage for background exports, from ``INSIGHTS_EXPORT_STORAGE``"""
+    return import_string(settings.INSIGHTS_EXPORT_STORAGE)(**settings.INSIGHTS_EXPORT_STORAGE_OPTIONS)
+
+class InsightsExport(models.Model):
+    """An export too large to stream, produced by a background job"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    dataset = models.CharField(max_length=20)
+    export_format = models.CharField(max_length=10)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    category = models.ForeignKey('marketplace.Category', on_delete=models.SET_NULL, null=True, blank=True)
+    # Only the creator may poll the export and fetch its file
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField(upload_to='insights/', storage=export_storage, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.dataset} export {self.id} ({self.status})"
+
+class PriceAnomaly(models.Model):
+    """A recorded price that looks like a typo, flagged by detect_price_anomalies for review"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending review'),
+        ('confirmed', 'Confirmed'),
+        ('dismissed', 'Dismissed'),
+    ]
+    BASIS_CHOICES = [
+        ('product', "Product's recent prices"),
+        ('category', 'Category peers'),
+    ]
+
+    price_history = models.OneToOneField(PriceHistory, on_delete=models.CASCADE, related_name='anomaly')
+    product = models.ForeignKey('marketplace.Product', on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    expected_price = models.DecimalField(max_digits=10, decimal_places=2)
+    score = models.FloatField(help_text='Robust z-score against the basis')
+    basis = models.CharField(max_length=10, choices=BASIS_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    detected_at = models.DateTimeField(auto_now_add=True)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Price anomalies"
+        indexes = [
+            models.Index(fields=['status', '-detected_at'], name='insights_anomaly_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} at ${self.price} (expected ${self.expected_price})"
+
+class ForecastState(models.Model):
+    """Fitted smoothing parameters and state of a category's daily price series, see insights.forecasts"""
+    category = models.OneToOneField('marketplace.Category', on_delete=models.CASCADE, primary_key=True,
+                                    related_name='forecast_state')
+    alpha = models.FloatField()
+    beta = models.FloatField()
+    gamma = models.FloatField()
+    level = models.FloatField()
+    trend = models.FloatField()
+    seasonal = models.JSONField(default=list, help_text='Seasonal offsets by date ordinal mod 7')
+    last_price = models.FloatField()
+    sse = models.FloatField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    last_date = models.DateField()
+    fitted_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.category.name} forecast state through {self.last_date}"
+
+class PriceForecast(models.Model):
+    """Forecast average price of a category on a day, with a 95% interval"""
+    category = models.ForeignKey('marketplace.Category', on_delete=models.CASCADE)
+    date = models.DateField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    lower = models.DecimalField(max_digits=10, decimal_places=2)
+    upper = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='insights_forecast_category_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.category.name} forecast for {self.date}"
+
+class SellerProductDay(models.Model):
+    """Daily views, cart adds and sales of a product, pre-aggregated for the seller dashboard"""
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    product = models.ForeignKey('marketplace.Product', on_delete=models.CASCADE)
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    cart_adds = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='insights_cube_product_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'date'], name='insights_cube_seller_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} on {self.date}"
+
+class SellerCubeWatermark(models.Model):
+    """Order status changes already folded into SellerProductDay, a single row"""
+    watermark_created_at = models.DateTimeField(null=True, blank=True)
+    watermark_change_id = models.PositiveBigIntegerField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
-        return f"{self.category.name} trend for {self.date}"
\ No newline at end of file
+        return f"Seller cube watermark at {self.refreshed_at}"
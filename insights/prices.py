@@ -0,0 +1,77 @@
+"""
+Automatic price history.
+
+Products remember the price they were loaded with, and a save that changes
+it records a ``PriceHistory`` row. By default the row is inserted straight
+away, in the same transaction as the save. Inside ``batch_price_history()``
+rows are buffered and written with ``bulk_create`` every ``flush_size``
+captures and when the block exits, so repricing many products costs one
+batched insert stream instead of an insert per product::
+
+    with transaction.atomic(), batch_price_history():
+        for product in products:
+            product.price = new_prices[product.id]
+            product.save(update_fields=['price', 'updated_at'])
+
+``Product.objects`` bulk writes (``QuerySet.update()`` and ``bulk_update()``)
+that touch the price announce the changed prices with ``prices_updated``,
+and those are recorded as one batch.
+
+Prices are compared as decimals of their text, so a price assigned as
+``4.5`` or ``'4.50'`` is not a change from a stored ``4.50``.
+"""
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import PriceHistory
+
+FLUSH_SIZE = 1000
+
+_local = threading.local()
+
+
+def normalize_price(price):
+    return None if price is None else Decimal(str(price))
+
+
+def _write(rows):
+    PriceHistory.objects.bulk_create(
+        [PriceHistory(product_id=product_id, price=normalize_price(price)) for product_id, price in rows],
+        batch_size=FLUSH_SIZE,
+    )
+
+
+def capture_price(product_id, price):
+    """Record a new price, buffered if a batch is open"""
+    batch = getattr(_local, 'batch', None)
+    if batch is None:
+        _write([(product_id, price)])
+        return
+    batch['rows'].append((product_id, price))
+    if len(batch['rows']) >= batch['flush_size']:
+        _write(batch['rows'])
+        batch['rows'] = []
+
+
+@contextmanager
+def batch_price_history(flush_size=FLUSH_SIZE):
+    """Buffer price captures in this thread and bulk insert them"""
+    if getattr(_local, 'batch', None) is not None:
+        # Nested; the outermost block flushes
+        yield
+        return
+    _local.batch = batch = {'rows': [], 'flush_size': flush_size}
+    try:
+        yield
+    except BaseException:
+        _local.batch = None
+        # Outside a transaction the saves have already committed
+        if batch['rows'] and not transaction.get_connection().in_atomic_block:
+            _write(batch['rows'])
+        raise
+    _local.batch = None
+    if batch['rows']:
+        _write(batch['rows'])
@@ -0,0 +1,175 @@
+"""
+Price and sales time series for the insights charts.
+
+Raw rows are loaded with ``values_list`` into NumPy arrays, then bucketed,
+averaged and summed with vectorised operations. Series longer than the
+requested number of points are downsampled with Largest-Triangle-Three-
+Buckets, which keeps the peaks and dips that plain striding drops. Results
+are cached per (range, resolution, category, points).
+
+When the columnar store is built (see ``columnar``) the rows are scanned
+from its memory-mapped day partitions instead of the database.
+
+Buckets are in UTC, the project time zone; weeks start on Monday.
+"""
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Sum
+
+from payments.models import OrderItem
+from . import columnar
+from .models import PriceHistory
+
+RESOLUTIONS = {'hour': 'h', 'day': 'D', 'week': 'D', 'month': 'M'}
+MAX_POINTS = 500
+MAX_BUCKETS = 100000  # per series before downsampling
+TOP_CATEGORIES = 10
+CACHE_TIMEOUT = 300  # seconds
+CACHE_KEY = 'insights:series:{}:{}:{}:{}:{}'
+
+
+class RangeTooLarge(ValueError):
+    """The range holds more buckets than ``MAX_BUCKETS`` at this resolution"""
+
+
+def _arrays(rows):
+    """Epoch seconds and float values of ``(datetime, number)`` rows"""
+    if not rows:
+        return np.empty(0), np.empty(0)
+    times, values = zip(*rows)
+    return (
+        np.fromiter((t.timestamp() for t in times), dtype=np.float64, count=len(times)),
+        np.array(values, dtype=np.float64),
+    )
+
+
+def bucket_starts(seconds, resolution):
+    """Start of the bucket holding each epoch second, as ``datetime64``"""
+    moments = np.asarray(seconds, dtype=np.int64).astype('datetime64[s]')
+    buckets = moments.astype(f'datetime64[{RESOLUTIONS[resolution]}]')
+    if resolution == 'week':
+        # 1970-01-01 was a Thursday
+        buckets = buckets - (buckets.astype(np.int64) + 3) % 7
+    return buckets
+
+
+def _step(resolution):
+    return np.timedelta64(7 if resolution == 'week' else 1, RESOLUTIONS[resolution])
+
+
+def _epoch(buckets):
+    return buckets.astype('datetime64[s]').astype(np.int64)
+
+
+def aggregate(times, values, resolution, mean=False):
+    """Sum (or mean) of ``values`` per bucket, for non-empty buckets only"""
+    buckets, index = np.unique(bucket_starts(times, resolution), return_inverse=True)
+    totals = np.bincount(index, weights=values)
+    if mean:
+        totals = totals / np.bincount(index)
+    return buckets, totals
+
+
+def bucket_grid(start, end, resolution):
+    """Every bucket start from ``start`` up to, not including, ``end``"""
+    first, last = bucket_starts([start.timestamp(), end.timestamp() - 1], resolution)
+    step = _step(resolution)
+    if (last - first) // step >= MAX_BUCKETS:
+        raise RangeTooLarge(f'Range is too long for {resolution} resolution')
+    return np.arange(first, last + step, step)
+
+
+def lttb(x, y, threshold):
+    """Indices of ``threshold`` points that keep the shape of ``(x, y)``"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Twice the area of the triangle (a, candidate, next bucket average)
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _compact(buckets, values, points, decimals=2):
+    """``{'t': epoch seconds, 'v': values}`` with at most ``points`` points"""
+    t = _epoch(buckets)
+    keep = lttb(t.astype(np.float64), values, points)
+    return {'t': t[keep].tolist(), 'v': np.round(values[keep], decimals).tolist()}
+
+
+def _database_rows(start, end, category_id):
+    """Price changes, sales and top categories in ``[start, end)``, from the database"""
+    prices = PriceHistory.objects.filter(recorded_at__gte=start, recorded_at__lt=end)
+    items = OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+    if category_id is not None:
+        prices = prices.filter(product__category_id=category_id)
+        items = items.filter(product__category_id=category_id)
+    categories = (
+        items.values_list('product__category__name')
+        .annotate(units=Sum('quantity'))
+        .order_by('-units')[:TOP_CATEGORIES]
+    )
+    return (
+        _arrays(list(prices.values_list('recorded_at', 'price'))),
+        _arrays(list(items.values_list('order__created_at', 'quantity'))),
+        list(categories),
+    )
+
+
+def _store_rows(start, end, category_id):
+    """Same as ``_database_rows``, scanned from the columnar store"""
+    prices = columnar.scan('prices', start, end, ['timestamp', 'price'], category_id)
+    sales = columnar.scan('sales', start, end, ['timestamp', 'qty', 'category'], category_id)
+    ids, index = np.unique(sales['category'], return_inverse=True)
+    units = np.bincount(index, weights=sales['qty']).astype(np.int64)
+    top = np.argsort(-units, kind='stable')[:TOP_CATEGORIES]
+    names = columnar.category_names()
+    return (
+        (prices['timestamp'].astype(np.float64), prices['price']),
+        (sales['timestamp'].astype(np.float64), sales['qty'].astype(np.float64)),
+        [(names.get(int(ids[i])), int(units[i])) for i in top],
+    )
+
+
+def build_series(start, end, resolution='day', category_id=None, points=MAX_POINTS):
+    """Chart data for orders and price changes in ``[start, end)``"""
+    grid = bucket_grid(start, end, resolution)
+    rows = _store_rows if columnar.is_ready() else _database_rows
+    (price_times, prices), (sale_times, quantities), categories = rows(start, end, category_id)
+
+    price_buckets, averages = aggregate(price_times, prices, resolution, mean=True)
+    sale_buckets, units = aggregate(sale_times, quantities, resolution)
+    # Zero-filled, so bar charts show quiet periods
+    sales = np.zeros(len(grid))
+    sales[np.searchsorted(grid, sale_buckets)] = units
+
+    return {
+        'resolution': resolution,
+        'price': _compact(price_buckets, averages, points),
+        'sales': _compact(grid, sales, points, decimals=0),
+        'categories': {
+            'labels': [name for name, _ in categories],
+            'data': [units for _, units in categories],
+        },
+    }
+
+
+def get_series(start, end, resolution='day', category_id=None, points=MAX_POINTS):
+    """Cached ``build_series``"""
+    key = CACHE_KEY.format(int(start.timestamp()), int(end.timestamp()), resolution, category_id or '', points)
+    series = cache.get(key)
+    if series is None:
+        series = build_series(start, end, resolution, category_id, points)
+        cache.set(key, series, CACHE_TIMEOUT)
+    return series
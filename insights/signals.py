@@ -0,0 +1,42 @@
+from django.db.models.signals import post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from marketplace.models import Product, prices_updated
+from .prices import batch_price_history, capture_price, normalize_price
+
+
+@receiver(post_init, sender=Product)
+def remember_price(sender, instance, **kwargs):
+    """Keep the loaded price so saves can tell whether it changed"""
+    instance._loaded_price = instance.__dict__.get('price')
+
+
+@receiver(pre_save, sender=Product)
+def check_price(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding:
+        instance._price_changed = True
+        return
+    if update_fields is not None and 'price' not in update_fields:
+        instance._price_changed = False
+        return
+    previous = instance._loaded_price
+    if previous is None:
+        # Loaded with price deferred
+        previous = Product.objects.filter(pk=instance.pk).values_list('price', flat=True).first()
+    instance._price_changed = normalize_price(previous) != normalize_price(instance.price)
+
+
+@receiver(post_save, sender=Product)
+def record_price(sender, instance, **kwargs):
+    """Append to the product's price history when its price changed"""
+    if getattr(instance, '_price_changed', False):
+        capture_price(instance.pk, instance.price)
+        instance._loaded_price = instance.price
+
+
+@receiver(prices_updated, sender=Product)
+def record_bulk_prices(sender, prices, **kwargs):
+    """Append the prices changed by a bulk update to their products' history"""
+    with batch_price_history():
+        for product_id, price in prices.items():
+            capture_price(product_id, price)
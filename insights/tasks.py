@@ -0,0 +1,52 @@
+from celery import shared_task
+
+from . import columnar
+from .anomalies import detect_anomalies
+from .cube import refresh_seller_cube
+from .exports import run_export
+from .forecasts import update_forecasts
+from .metrics import refresh_metrics
+from .models import InsightsExport
+from .trends import rollup_trends
+
+
+@shared_task
+def refresh_market_metrics():
+    """Periodic refresh of the dashboard tables"""
+    return refresh_metrics()
+
+
+@shared_task
+def rollup_market_trends():
+    """Periodic incremental MarketTrend rollup"""
+    return rollup_trends()
+
+
+@shared_task
+def append_columnar_store():
+    """Periodic append of new rows to the columnar store"""
+    return columnar.append()
+
+
+@shared_task
+def detect_price_anomalies():
+    """Periodic scan of price history for typo'd prices"""
+    return detect_anomalies()
+
+
+@shared_task
+def update_price_forecasts():
+    """Periodic incremental forecast update, with full refits when due"""
+    return update_forecasts()
+
+
+@shared_task
+def refresh_seller_analytics():
+    """Periodic fold of new orders into the seller cube"""
+    return refresh_seller_cube()
+
+
+@shared_task
+def run_insights_export(export_id):
+    """Background export for ranges too large to stream"""
+    run_export(InsightsExport.objects.get(pk=export_id))
@@ -0,0 +1,793 @@
+import csv
+import json
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace.models import Category, Product
+from payments.models import Order, OrderItem, OrderStatusHistory
+from payments.transitions import transition_order
+
+from . import columnar, cube
+from .anomalies import detect_anomalies, review, score_prices
+from .exports import run_export
+from .forecasts import fit, fit_parallel, update_forecasts
+from .metrics import rebuild_sales, refresh_metrics
+from .models import (
+    CategorySales, CategorySketch, ForecastState, InsightsExport, MarketSummary, MarketTrend, PriceAnomaly,
+    PriceForecast, PriceHistory, ProductSales, SellerProductDay,
+)
+from .prices import batch_price_history
+from .series import build_series, bucket_starts, lttb
+from .sketches import HyperLogLog, QuantileSketch
+from .tasks import rollup_market_trends
+from .trends import rollup_trends
+
+User = get_user_model()
+
+
+class InsightsTestMixin:
+    """Shared catalog and order fixtures for insights tests"""
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.seller = User.objects.create_user(username='farmer', email='farmer@example.com', password='password')
+        self.vegetables = Category.objects.create(name='Vegetables', slug='vegetables')
+        self.fruits = Category.objects.create(name='Fruits', slug='fruits')
+        self.tomatoes = self.create_product('Tomatoes', Decimal('4.00'), self.vegetables)
+        self.apples = self.create_product('Apples', Decimal('2.00'), self.fruits)
+
+    def create_product(self, name, price, category, seller=None):
+        return Product.objects.create(
+            name=name, slug=name.lower(), description=name, price=price, category=category,
+            seller=seller or self.seller, quantity_available=100,
+        )
+
+    def create_order(self, *lines, created_at=None, paid=False):
+        total = sum(product.price * quantity for product, quantity in lines)
+        order = Order.objects.create(
+            customer=self.buyer, total_amount=total, grand_total=total,
+            shipping_address='1 Farm Road', billing_address='1 Farm Road',
+        )
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=product.price)
+        if paid:
+            self.pay(order)
+        if created_at is not None:
+            Order.objects.filter(id=order.id).update(created_at=created_at)
+            OrderStatusHistory.objects.filter(order=order).update(created_at=created_at)
+        return order
+
+    def pay(self, *orders):
+        for order in orders:
+            transition_order(order, 'confirmed')
+
+
+class MarketMetricsTests(InsightsTestMixin, TestCase):
+
+    def later(self, minutes=10):
+        return timezone.now() + timezone.timedelta(minutes=minutes)
+
+    def test_sales_are_folded_incrementally(self):
+        refresh_metrics()
+        first = self.create_order((self.tomatoes, 2), (self.apples, 1))
+        second = self.create_order((self.tomatoes, 1))
+        self.create_order((self.apples, 9))
+        self.pay(first, second)
+        self.assertEqual(refresh_metrics(batch_size=1, now=self.later()), 2)
+        self.assertEqual(refresh_metrics(now=self.later()), 0)
+
+        self.pay(self.create_order((self.apples, 5)))
+        self.assertEqual(refresh_metrics(now=self.later()), 1)
+
+        summary = MarketSummary.objects.get()
+        self.assertEqual((summary.order_count, summary.revenue), (3, Decimal('24.00')))
+        tomatoes = ProductSales.objects.get(product=self.tomatoes)
+        self.assertEqual((tomatoes.units_sold, tomatoes.order_count, tomatoes.revenue), (3, 2, Decimal('12.00')))
+        fruits = CategorySales.objects.get(category=self.fruits)
+        self.assertEqual((fruits.units_sold, fruits.revenue, fruits.product_count), (6, Decimal('12.00'), 1))
+
+    def test_cancellations_and_refunds_are_taken_off(self):
+        refresh_metrics()
+        kept, cancelled, refunded = (self.create_order((self.tomatoes, n)) for n in (1, 2, 3))
+        self.pay(kept, cancelled, refunded)
+        transition_order(cancelled, 'cancelled')
+        self.assertEqual(refresh_metrics(now=self.later()), 4)
+
+        transition_order(refunded, 'processing')
+        transition_order(refunded, 'refunded')
+        self.assertEqual(refresh_metrics(now=self.later()), 1)
+
+        summary = MarketSummary.objects.get()
+        self.assertEqual((summary.order_count, summary.revenue), (1, Decimal('4.00')))
+        tomatoes = ProductSales.objects.get(product=self.tomatoes)
+        self.assertEqual((tomatoes.units_sold, tomatoes.order_count, tomatoes.revenue), (1, 1, Decimal('4.00')))
+        self.assertEqual(CategorySales.objects.get(category=self.vegetables).revenue, Decimal('4.00'))
+
+    def test_admin_cancellation_reverses_the_totals(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        refresh_metrics()
+        kept, cancelled = self.create_order((self.tomatoes, 1)), self.create_order((self.apples, 2))
+        changelist = reverse('admin:payments_order_changelist')
+        self.client.post(changelist, {'action': 'mark_confirmed', '_selected_action': [kept.id, cancelled.id]})
+        refresh_metrics(now=self.later())
+        self.assertEqual(MarketSummary.objects.get().order_count, 2)
+
+        self.client.post(changelist, {'action': 'mark_cancelled', '_selected_action': [cancelled.id]})
+        self.assertIn('status', self.client.get(reverse('admin:payments_order_change', args=[kept.id]))
+                      .context['adminform'].readonly_fields)
+        self.assertEqual(refresh_metrics(now=self.later()), 1)
+        summary = MarketSummary.objects.get()
+        self.assertEqual((summary.order_count, summary.revenue), (1, Decimal('4.00')))
+        self.assertEqual(ProductSales.objects.get(product=self.apples).units_sold, 0)
+        self.assertEqual(CategorySales.objects.get(category=self.fruits).revenue, Decimal('0.00'))
+
+    def test_first_refresh_recounts_paid_orders(self):
+        self.pay(self.create_order((self.tomatoes, 2)), self.create_order((self.apples, 1)))
+        self.create_order((self.apples, 4))
+        self.assertEqual(refresh_metrics(now=self.later()), 0)
+        summary = MarketSummary.objects.get()
+        self.assertEqual((summary.order_count, summary.revenue), (2, Decimal('10.00')))
+
+        rebuild_sales()
+        self.assertEqual(refresh_metrics(now=self.later()), 0)
+        summary.refresh_from_db()
+        self.assertEqual((summary.order_count, summary.revenue), (2, Decimal('10.00')))
+        self.assertEqual(ProductSales.objects.get(product=self.apples).units_sold, 1)
+
+    def test_recent_orders_wait_for_the_settle_delay(self):
+        refresh_metrics()
+        self.pay(self.create_order((self.tomatoes, 1)))
+        self.assertEqual(refresh_metrics(), 0)
+        self.assertEqual(refresh_metrics(now=self.later()), 1)
+
+    def test_catalog_figures_are_recomputed(self):
+        other = User.objects.create_user(username='grower', email='grower@example.com', password='password')
+        self.create_product('Pears', Decimal('3.00'), self.fruits, seller=other)
+        refresh_metrics()
+        summary = MarketSummary.objects.get()
+        self.assertEqual((summary.product_count, summary.active_sellers, summary.average_price),
+                         (3, 2, Decimal('3.00')))
+
+        Product.objects.filter(name='Pears').update(is_active=False)
+        refresh_metrics()
+        summary.refresh_from_db()
+        self.assertEqual((summary.product_count, summary.active_sellers), (2, 1))
+        self.assertEqual(CategorySales.objects.get(category=self.fruits).product_count, 1)
+
+    def test_dashboard_reads_materialized_rows(self):
+        self.pay(self.create_order((self.tomatoes, 3), (self.apples, 1)))
+        self.create_order((self.apples, 8))
+        out = StringIO()
+        call_command('refresh_market_metrics', '--rebuild', stdout=out)
+        self.assertIn('Folded 0 new status changes', out.getvalue())
+        refresh_metrics(now=self.later())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('insights:dashboard'))
+        self.assertEqual(response.context['total_orders'], 1)
+        self.assertEqual(response.context['total_products'], 2)
+        self.assertEqual([p['name'] for p in response.context['top_products']], ['Tomatoes', 'Apples'])
+        self.assertEqual(response.context['top_categories'][0]['name'], 'Vegetables')
+        tables = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('payments_order', tables)
+
+
+class PriceHistoryTests(InsightsTestMixin, TestCase):
+
+    def prices(self, product):
+        return list(PriceHistory.objects.filter(product=product).order_by('id').values_list('price', flat=True))
+
+    def test_only_price_changes_are_recorded(self):
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00')])
+        self.tomatoes.quantity_available = 50
+        self.tomatoes.save()
+        self.tomatoes.price = Decimal('4.25')
+        self.tomatoes.save(update_fields=['quantity_available'])
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00')])
+
+        product = Product.objects.defer('price').get(id=self.tomatoes.id)
+        product.price = Decimal('4.50')
+        product.save()
+        product.save()
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00'), Decimal('4.50')])
+
+    def test_batched_repricing_uses_bulk_inserts(self):
+        for i in range(5):
+            self.create_product(f'Product{i}', Decimal('1.00'), self.fruits)
+        products = list(Product.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic(), batch_price_history(flush_size=4):
+                for product in products:
+                    product.price += 1
+                    product.save(update_fields=['price', 'updated_at'])
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "insights_pricehistory"')]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(PriceHistory.objects.count(), 2 * len(products))
+
+    def test_equal_prices_of_another_type_are_not_changes(self):
+        self.tomatoes.price = 4.0
+        self.tomatoes.save()
+        self.tomatoes.price = '4.00'
+        self.tomatoes.save()
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00')])
+
+    def test_bulk_repricing_is_recorded(self):
+        with CaptureQueriesContext(connection) as queries:
+            Product.objects.filter(category=self.vegetables).update(price=F('price') + 1)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "insights_pricehistory"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00'), Decimal('5.00')])
+
+        self.tomatoes.refresh_from_db()
+        self.tomatoes.price, self.apples.price = Decimal('6.00'), 2
+        Product.objects.bulk_update([self.tomatoes, self.apples], ['price'])
+        Product.objects.filter(category=self.fruits).update(price='2.00')
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00'), Decimal('5.00'), Decimal('6.00')])
+        self.assertEqual(self.prices(self.apples), [Decimal('2.00')])
+
+        with mock.patch('marketplace.models.PRICE_CHUNK_SIZE', 1):
+            Product.objects.update(price=F('price') * 2)
+        self.assertEqual(self.prices(self.apples), [Decimal('2.00'), Decimal('4.00')])
+        self.assertEqual(self.prices(self.tomatoes)[-1], Decimal('12.00'))
+
+    def test_backfill_records_missing_current_prices(self):
+        PriceHistory.objects.filter(product=self.apples).delete()
+        Product.objects.filter(id=self.tomatoes.id).update(price=Decimal('5.00'))
+        PriceHistory.objects.filter(price=Decimal('5.00')).delete()
+        out = StringIO()
+        call_command('backfill_price_history', stdout=out)
+        self.assertIn('Recorded 2 current prices', out.getvalue())
+        self.assertEqual(self.prices(self.tomatoes), [Decimal('4.00'), Decimal('5.00')])
+
+        call_command('backfill_price_history', stdout=out)
+        self.assertIn('Recorded 0 current prices', out.getvalue())
+
+
+class MarketTrendTests(InsightsTestMixin, TestCase):
+
+    def at(self, day, hour=12):
+        return timezone.make_aware(datetime(2024, 3, day, hour))
+
+    def trends(self):
+        return {
+            (t.category_id, t.date.day): (t.average_price, t.total_sales)
+            for t in MarketTrend.objects.all()
+        }
+
+    def test_rollup_recomputes_only_touched_days(self):
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        self.create_order((self.tomatoes, 2), created_at=self.at(1), paid=True)
+        self.create_order((self.apples, 3), created_at=self.at(2), paid=True)
+        self.assertEqual(rollup_trends(), 3)
+        self.assertEqual(self.trends(), {
+            (self.vegetables.id, 1): (Decimal('4.00'), 2),
+            (self.fruits.id, 1): (Decimal('2.00'), 0),
+            (self.fruits.id, 2): (Decimal('2.00'), 3),
+        })
+
+        MarketTrend.objects.filter(date=date(2024, 3, 1)).update(total_sales=99)
+        self.create_order((self.apples, 1), created_at=self.at(2, hour=18), paid=True)
+        self.assertEqual(rollup_trends(), 1)
+        trends = self.trends()
+        self.assertEqual(trends[self.fruits.id, 2], (Decimal('2.00'), 4))
+        self.assertEqual(trends[self.vegetables.id, 1][1], 99)
+        self.assertEqual(MarketTrend.objects.count(), 3)
+
+        self.assertEqual(rollup_trends(), 0)
+        self.assertEqual(rollup_trends(rebuild=True), 3)
+        self.assertEqual(self.trends()[self.vegetables.id, 1][1], 2)
+
+    def test_only_paid_orders_count_and_cancellations_recompute_their_day(self):
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        cancelled = self.create_order((self.apples, 3), created_at=self.at(2), paid=True)
+        self.create_order((self.apples, 1), created_at=self.at(2, hour=18), paid=True)
+        self.create_order((self.apples, 5), created_at=self.at(2, hour=19))
+        rollup_trends()
+        self.assertEqual(self.trends()[self.fruits.id, 2], (Decimal('2.00'), 4))
+        self.assertEqual(CategorySketch.objects.get(date=date(2024, 3, 2)).paid_prices,
+                         QuantileSketch().add([2.0, 2.0], [3, 1]).to_bytes())
+
+        transition_order(cancelled, 'cancelled')
+        later = timezone.now() + timezone.timedelta(minutes=10)
+        self.assertEqual(rollup_trends(now=later), 1)
+        self.assertEqual(self.trends()[self.fruits.id, 2], (Decimal('2.00'), 1))
+
+    def test_list_price_changes_set_the_average(self):
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        self.tomatoes.price = Decimal('6.00')
+        self.tomatoes.save()
+        PriceHistory.objects.filter(price=Decimal('6.00')).update(recorded_at=self.at(5))
+        self.create_order((self.tomatoes, 1), created_at=self.at(5), paid=True)
+        rollup_market_trends.apply()
+        self.assertEqual(self.trends()[self.vegetables.id, 5], (Decimal('6.00'), 1))
+
+
+class PriceAnomalyTests(InsightsTestMixin, TestCase):
+
+    def at(self, day, hour=12):
+        return timezone.make_aware(datetime(2024, 3, day, hour))
+
+    def test_scores_against_history_and_category_peers(self):
+        products = np.array([1] * 10 + [2, 3, 3])
+        categories = np.array([1] * 10 + [1, 1, 1])
+        prices = np.array([15, 15, 16, 15, 14, 15, 1500, 15, 17, 30, 1500, 12, 15], dtype=float)
+        flagged, expected, _, by_product = score_prices(products, categories, prices, chunk_size=4)
+        self.assertEqual(np.flatnonzero(flagged).tolist(), [6, 9, 10])
+        self.assertEqual(expected[6], 15)
+        self.assertEqual(by_product[[6, 10]].tolist(), [True, False])
+
+    def test_flagged_prices_are_kept_out_of_trends_until_dismissed(self):
+        PriceHistory.objects.all().delete()
+        for day, price in enumerate(['4.00', '4.10', '3.90', '4.00', '400.00'], start=1):
+            PriceHistory.objects.create(product=self.tomatoes, price=Decimal(price))
+            PriceHistory.objects.filter(price=Decimal(price)).update(recorded_at=self.at(day))
+        rollup_trends()
+        self.assertEqual(MarketTrend.objects.get(date=date(2024, 3, 5)).average_price, Decimal('400.00'))
+
+        self.assertEqual(detect_anomalies(), (5, 1, 0))
+        anomaly = PriceAnomaly.objects.get()
+        self.assertEqual((anomaly.price, anomaly.expected_price, anomaly.basis),
+                         (Decimal('400.00'), Decimal('4.00'), 'product'))
+        self.assertFalse(MarketTrend.objects.filter(date=date(2024, 3, 5)).exists())
+
+        self.create_order((self.tomatoes, 1), created_at=self.at(5), paid=True)
+        rollup_trends()
+        self.assertEqual(MarketTrend.objects.get(date=date(2024, 3, 5)).average_price, Decimal('4.00'))
+
+        review(PriceAnomaly.objects.all(), 'dismissed')
+        self.assertEqual(MarketTrend.objects.get(date=date(2024, 3, 5)).average_price, Decimal('400.00'))
+        self.assertEqual(detect_anomalies(), (5, 0, 0))
+        self.assertEqual(PriceAnomaly.objects.get().status, 'dismissed')
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command('benchmark_price_anomalies', rows=5000, products=100, stdout=out)
+        self.assertIn('Scored 5000 prices', out.getvalue())
+
+
+class SketchTests(InsightsTestMixin, TestCase):
+
+    def at(self, day, hour=12):
+        return timezone.make_aware(datetime(2024, 3, day, hour))
+
+    def test_hyperloglog_merges_to_the_union(self):
+        first = HyperLogLog().add(np.arange(0, 60000))
+        second = HyperLogLog().add(np.arange(40000, 100000))
+        self.assertAlmostEqual(first.count() / 60000, 1, delta=0.05)
+        union = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(union.count() / 100000, 1, delta=0.05)
+        self.assertEqual(HyperLogLog().add([7, 7, 8]).count(), 2)
+
+    def test_quantiles_are_within_relative_accuracy(self):
+        values = np.random.default_rng(1).lognormal(1.5, 0.8, 20000)
+        sketch = QuantileSketch().add(values[:12000])
+        sketch.merge(QuantileSketch.from_bytes(QuantileSketch().add(values[12000:]).to_bytes()))
+        self.assertEqual(sketch.count, 20000)
+        for q in [0.5, 0.9, 0.99]:
+            exact = np.quantile(values, q, method='lower')
+            self.assertAlmostEqual(sketch.quantile(q) / exact, 1, delta=0.011)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+    def test_rollup_keeps_daily_sketches_for_any_range(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='password')
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        self.create_order((self.tomatoes, 2), (self.apples, 1), created_at=self.at(1), paid=True)
+        order = self.create_order((self.apples, 3), created_at=self.at(2), paid=True)
+        Order.objects.filter(id=order.id).update(customer=other)
+        self.create_order((self.tomatoes, 1), created_at=self.at(3), paid=True)
+        rollup_trends()
+        self.assertEqual(CategorySketch.objects.count(), 4)
+
+        response = self.client.get(reverse('insights:api_stats'), {'start': '2024-03-01', 'end': '2024-03-04'})
+        stats = response.json()
+        self.assertEqual((stats['start'], stats['end']), ('2024-03-01', '2024-03-03'))
+        self.assertEqual((stats['unique_buyers'], stats['active_sellers']), (2, 1))
+        self.assertAlmostEqual(stats['paid_price']['p50'], 2.0, delta=0.02)
+        self.assertAlmostEqual(stats['paid_price']['p99'], 4.0, delta=0.04)
+        self.assertAlmostEqual(stats['list_price']['p50'], 2.0, delta=0.02)
+
+        stats = self.client.get(reverse('insights:api_stats'), {
+            'start': '2024-03-02', 'end': '2024-03-03', 'category': self.vegetables.id,
+        }).json()
+        self.assertEqual(stats['unique_buyers'], 0)
+        self.assertIsNone(stats['paid_price']['p50'])
+
+
+class PriceForecastTests(InsightsTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start = date(2024, 1, 1)
+        days = np.arange(70)
+        # Vegetables rise 5 cents a day with a weekend bump; fruits are flat with gaps
+        self.add_trends(self.vegetables, days, 4 + 0.05 * days + 0.3 * (days % 7 >= 5))
+        self.add_trends(self.fruits, days[::3], np.full(len(days[::3]), 2.0))
+
+    def add_trends(self, category, days, prices):
+        MarketTrend.objects.bulk_create([
+            MarketTrend(category=category, date=self.start + timezone.timedelta(days=int(day)),
+                        average_price=Decimal(f'{price:.2f}'))
+            for day, price in zip(days, prices)
+        ])
+
+    def now(self, days):
+        """Noon on the day after ``days`` completed days"""
+        return timezone.make_aware(datetime.combine(self.start + timezone.timedelta(days=days), datetime.min.time())
+                                   + timezone.timedelta(hours=12))
+
+    def test_full_fit_then_incremental_updates(self):
+        self.assertEqual(update_forecasts(now=self.now(70)), (2, 0))
+        self.assertEqual(PriceForecast.objects.filter(category=self.vegetables).count(), 30)
+        first = PriceForecast.objects.get(category=self.vegetables, date=date(2024, 3, 11))
+        # Day 70 is a Monday, so no weekend bump
+        self.assertAlmostEqual(float(first.price), 4 + 0.05 * 70, delta=0.15)
+        self.assertLess(first.lower, first.price)
+        self.assertGreater(first.upper, first.price)
+        fruits = PriceForecast.objects.filter(category=self.fruits).order_by('date')
+        self.assertTrue(all(abs(f.price - Decimal('2.00')) <= Decimal('0.01') for f in fruits))
+
+        self.assertEqual(update_forecasts(now=self.now(70)), (0, 0))
+        self.add_trends(self.vegetables, [70], [4 + 0.05 * 70])
+        self.assertEqual(update_forecasts(now=self.now(71)), (0, 2))
+        state = ForecastState.objects.get(category=self.vegetables)
+        self.assertEqual(state.last_date, date(2024, 3, 11))
+        self.assertEqual(state.errors, 70 - 7 + 1)
+        self.assertEqual(PriceForecast.objects.filter(category=self.vegetables).earliest('date').date,
+                         date(2024, 3, 12))
+
+        # A stale fit is redone from the full history
+        self.assertEqual(update_forecasts(now=self.now(71) + timezone.timedelta(days=8)), (2, 0))
+
+    def test_process_pool_fit_matches_in_process(self):
+        rng = np.random.default_rng(3)
+        values = 10 + np.cumsum(rng.normal(0, 0.2, (4, 40)), axis=1)
+        first = np.array([0, 3, 10, 0])
+        serial = fit(values, first, 738000)
+        for expected, actual in zip(serial, fit_parallel(values, first, 738000, workers=2)):
+            np.testing.assert_allclose(actual, expected)
+
+    def test_forecast_api(self):
+        update_forecasts(now=self.now(70))
+        data = self.client.get(reverse('insights:api_forecast')).json()
+        self.assertEqual([c['name'] for c in data['categories']], ['Vegetables', 'Fruits'])
+        vegetables = data['categories'][0]
+        self.assertGreater(vegetables['change'], 5)
+        self.assertEqual(data['categories'][1]['change'], 0)
+        self.assertEqual(len(vegetables['forecast']['dates']), 30)
+        self.assertEqual(vegetables['through'], '2024-03-10')
+
+        data = self.client.get(reverse('insights:api_forecast'), {'category': self.fruits.id}).json()
+        self.assertEqual([c['name'] for c in data['categories']], ['Fruits'])
+        self.assertEqual(self.client.get(reverse('insights:api_forecast'), {'category': 'x'}).status_code, 400)
+
+
+class SellerCubeTests(InsightsTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cube._buffer.clear()
+        if cube._timer is not None:
+            cube._timer.cancel()
+            cube._timer = None
+        self.seller.is_seller = True
+        self.seller.save()
+        self.today = timezone.localdate()
+
+    def cube_row(self, product):
+        return SellerProductDay.objects.get(product=product, date=self.today)
+
+    def test_events_and_orders_are_counted_per_product_and_day(self):
+        for _ in range(3):
+            self.client.get(reverse('marketplace:product_detail', args=[self.tomatoes.id]))
+        self.client.post(reverse('cart:add'), json.dumps({'product_id': self.tomatoes.id, 'quantity': 2}),
+                         content_type='application/json')
+        self.assertFalse(SellerProductDay.objects.exists())
+        cube.flush_events()
+        row = self.cube_row(self.tomatoes)
+        self.assertEqual((row.seller_id, row.views, row.cart_adds), (self.seller.id, 3, 1))
+
+        cube.refresh_seller_cube()
+        first = self.create_order((self.tomatoes, 2), (self.apples, 1))
+        second = self.create_order((self.tomatoes, 1))
+        self.create_order((self.tomatoes, 5))
+        self.pay(first, second)
+        later = timezone.now() + timezone.timedelta(minutes=10)
+        self.assertEqual(cube.refresh_seller_cube(batch_size=1, now=later), 2)
+        self.assertEqual(cube.refresh_seller_cube(now=later), 0)
+        row = self.cube_row(self.tomatoes)
+        self.assertEqual((row.views, row.orders, row.units_sold, row.revenue), (3, 2, 3, Decimal('12.00')))
+        self.assertEqual(self.cube_row(self.apples).orders, 1)
+
+        transition_order(second, 'cancelled')
+        self.assertEqual(cube.refresh_seller_cube(now=later), 1)
+        row = self.cube_row(self.tomatoes)
+        self.assertEqual((row.views, row.orders, row.units_sold, row.revenue), (3, 1, 2, Decimal('8.00')))
+
+        cube.rebuild_seller_sales()
+        row = self.cube_row(self.tomatoes)
+        self.assertEqual((row.views, row.orders, row.units_sold, row.revenue), (3, 1, 2, Decimal('8.00')))
+        self.assertEqual(self.cube_row(self.apples).units_sold, 1)
+
+    def test_buffered_events_are_flushed_by_a_timer(self):
+        flushed = threading.Event()
+        with mock.patch.object(cube, 'FLUSH_INTERVAL', 0.05), \
+                mock.patch.object(cube, 'flush_events', side_effect=flushed.set) as flush:
+            cube._flushed_at = time.monotonic()
+            cube.record_event(self.tomatoes, 'views')
+            cube.record_event(self.apples, 'views')
+            self.assertTrue(flushed.wait(5))
+        flush.assert_called_once_with()
+        self.assertIsNone(cube._timer)
+
+    def test_dashboard_reads_a_fixed_number_of_queries(self):
+        def dashboard_queries(listings):
+            products = Product.objects.bulk_create([
+                Product(name=f'Listing {n}', slug=f'listing-{listings}-{n}', description='Listing',
+                        price=Decimal('1.00'), category=self.vegetables, seller=self.seller, quantity_available=1)
+                for n in range(listings)
+            ])
+            SellerProductDay.objects.bulk_create([
+                SellerProductDay(seller=self.seller, product=product, date=self.today - timezone.timedelta(days=day),
+                                 views=10, orders=day % 2, units_sold=day % 2, revenue=day % 2)
+                for product in products for day in range(5)
+            ])
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                context = cube.seller_dashboard_context(self.seller)
+            return context, len(queries)
+
+        context, small = dashboard_queries(10)
+        self.assertEqual(context['totals']['views'], 10 * 5 * 10)
+        self.assertEqual(context['totals']['conversion'], 4.0)
+        context, large = dashboard_queries(400)
+        self.assertEqual(small, large)
+        self.assertEqual(len(context['top_products']), cube.PRODUCT_LIMIT)
+        self.assertEqual(context['listing_count'], 412)
+
+    def test_dashboard_is_for_sellers_only(self):
+        cube.record_event(self.tomatoes, 'views')
+        cube.flush_events()
+        self.client.force_login(self.seller)
+        response = self.client.get(reverse('insights:seller_dashboard'), {'days': '7'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totals']['views'], 1)
+        self.assertContains(response, 'Tomatoes')
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(reverse('insights:seller_dashboard')).status_code, 403)
+
+
+class SeriesApiTests(InsightsTestMixin, TestCase):
+
+    def at(self, day, hour=12):
+        return timezone.make_aware(datetime(2024, 3, day, hour))
+
+    def get(self, **params):
+        return self.client.get(reverse('insights:api_data'), params)
+
+    def test_lttb_keeps_endpoints_and_peaks(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        y[437] = 10
+        keep = lttb(x, y, 50)
+        self.assertEqual(len(keep), 50)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertIn(437, keep)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+
+    def test_weeks_start_on_monday(self):
+        # 2024-03-07 is a Thursday
+        (week,) = bucket_starts([self.at(7).timestamp()], 'week')
+        self.assertEqual(str(week), '2024-03-04')
+
+    def test_daily_series(self):
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        self.tomatoes.price = Decimal('6.00')
+        self.tomatoes.save()
+        PriceHistory.objects.filter(price=Decimal('6.00')).update(recorded_at=self.at(3))
+        self.create_order((self.tomatoes, 2), created_at=self.at(1))
+        self.create_order((self.tomatoes, 1), (self.apples, 4), created_at=self.at(3, hour=20))
+
+        data = self.get(start='2024-03-01', end='2024-03-05').json()
+        day = 86400
+        first = int(self.at(1, hour=0).timestamp())
+        self.assertEqual(data['sales'], {'t': [first, first + day, first + 2 * day, first + 3 * day],
+                                         'v': [2, 0, 5, 0]})
+        self.assertEqual(data['price'], {'t': [first, first + 2 * day], 'v': [3.0, 6.0]})
+        self.assertEqual(data['categories'], {'labels': ['Fruits', 'Vegetables'], 'data': [4, 3]})
+
+        data = self.get(start='2024-03-01', end='2024-03-05', category=self.vegetables.id).json()
+        self.assertEqual(data['sales']['v'], [2, 0, 1, 0])
+
+    def test_series_are_downsampled_and_cached(self):
+        self.create_order((self.tomatoes, 2), created_at=self.at(10, hour=5))
+        params = {'start': '2024-01-01', 'end': '2024-04-01', 'resolution': 'hour'}
+        data = self.get(**params).json()
+        self.assertEqual(len(data['sales']['t']), 500)
+        self.assertEqual(sum(data['sales']['v']), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(**params).json(), data)
+        self.assertFalse([q for q in queries if 'payments_orderitem' in q['sql']])
+
+    def test_invalid_parameters(self):
+        for params in [{'start': 'March'}, {'start': '2024-03-05', 'end': '2024-03-01'},
+                       {'resolution': 'minute'}, {'category': 'fruit'},
+                       {'start': '1900-01-01', 'resolution': 'hour'}]:
+            response = self.get(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertFalse(response.json()['success'])
+
+
+class ColumnarStoreTests(InsightsTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(INSIGHTS_COLUMNAR_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.later = timezone.now() + timezone.timedelta(minutes=10)
+
+    def at(self, day, hour=12):
+        return timezone.make_aware(datetime(2024, 3, day, hour))
+
+    def test_series_from_store_match_database(self):
+        PriceHistory.objects.update(recorded_at=self.at(1))
+        self.tomatoes.price = Decimal('6.00')
+        self.tomatoes.save()
+        PriceHistory.objects.filter(price=Decimal('6.00')).update(recorded_at=self.at(3))
+        self.create_order((self.tomatoes, 2), created_at=self.at(1))
+        self.create_order((self.tomatoes, 1), (self.apples, 4), created_at=self.at(3, hour=20))
+        start, end = self.at(1, hour=0), self.at(5, hour=0)
+        expected = [build_series(start, end, resolution, category_id)
+                    for resolution in ['hour', 'day'] for category_id in [None, self.vegetables.id]]
+
+        self.assertFalse(columnar.is_ready())
+        self.assertEqual(columnar.append(now=self.later, batch_size=1), {'prices': 3, 'sales': 3})
+        self.assertTrue(columnar.is_ready())
+        with CaptureQueriesContext(connection) as queries:
+            series = [build_series(start, end, resolution, category_id)
+                      for resolution in ['hour', 'day'] for category_id in [None, self.vegetables.id]]
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(series, expected)
+
+    def test_append_is_incremental_and_drops_torn_writes(self):
+        self.create_order((self.tomatoes, 2), created_at=self.at(2))
+        self.assertEqual(columnar.append(now=self.later), {'prices': 2, 'sales': 1})
+        # An append that died after writing part of a column
+        with open(columnar.store_dir() / 'sales' / '2024-03-02' / 'qty.bin', 'ab') as f:
+            f.write(b'garbage')
+        self.create_order((self.apples, 5), created_at=self.at(2, hour=18))
+        self.create_order((self.apples, 1), created_at=timezone.now())
+        self.assertEqual(columnar.append(now=timezone.now()),
+                         {'prices': 0, 'sales': 1})
+
+        sales = columnar.scan('sales', self.at(2, hour=0), self.at(3, hour=0), ['qty', 'product'])
+        self.assertEqual(sales['qty'].tolist(), [2, 5])
+        self.assertEqual(sales['product'].tolist(), [self.tomatoes.id, self.apples.id])
+        sales = columnar.scan('sales', self.at(2, hour=13), self.at(3), ['qty'], category_id=self.fruits.id)
+        self.assertEqual(sales['qty'].tolist(), [5])
+
+    def test_store_is_off_without_a_directory(self):
+        with override_settings(INSIGHTS_COLUMNAR_DIR=''):
+            self.assertIsNone(columnar.append())
+            self.assertFalse(columnar.is_ready())
+
+
+class InsightsExportTests(InsightsTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.at = timezone.make_aware(datetime(2024, 3, 2, 12))
+        PriceHistory.objects.update(recorded_at=self.at)
+        self.create_order((self.tomatoes, 2), (self.apples, 1), created_at=self.at, paid=True)
+        self.create_order((self.apples, 3), created_at=self.at + timezone.timedelta(days=5), paid=True)
+        rollup_trends()
+        self.seller.is_seller = True
+        self.seller.save()
+        self.client.force_login(self.seller)
+
+    def export(self, **params):
+        params = {'start': '2024-03-01', 'end': '2024-03-04', **params}
+        return self.client.get(reverse('insights:export_data'), params)
+
+    def test_csv_and_jsonl_stream(self):
+        response = self.export(dataset='sales', format='csv')
+        self.assertTrue(response.streaming)
+        self.assertIn('sales-20240301-20240304.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(r['product'], r['quantity']) for r in rows], [('Tomatoes', '2'), ('Apples', '1')])
+
+        response = self.export(dataset='prices', format='jsonl', category=self.fruits.id)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines, [{'recorded_at': '2024-03-02T12:00:00Z', 'product_id': self.apples.id,
+                                  'product': 'Apples', 'category': 'Fruits', 'price': '2.00'}])
+
+    def test_parquet_is_written_in_row_groups(self):
+        import pyarrow.parquet as pq
+
+        with mock.patch('insights.exports.PARQUET_ROW_GROUP_SIZE', 1):
+            response = self.export(dataset='trends', format='parquet', end='2024-03-10')
+            chunks = list(response.streaming_content)
+        parquet = pq.ParquetFile(BytesIO(b''.join(chunks)))
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        self.assertGreater(len(chunks), 3)
+        table = parquet.read()
+        self.assertEqual(table.column('category').to_pylist(), ['Vegetables', 'Fruits', 'Fruits'])
+        self.assertEqual(table.column('total_sales').to_pylist(), [2, 1, 3])
+        self.assertEqual(table.column('date').to_pylist()[0], date(2024, 3, 2))
+
+    def test_large_exports_run_in_the_background(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        storage = FileSystemStorage(location=media.name)
+        with override_settings(INSIGHTS_EXPORT_STREAM_MAX_ROWS=1), \
+                mock.patch.object(InsightsExport._meta.get_field('file'), 'storage', storage), \
+                mock.patch('insights.views.run_insights_export.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.export(dataset='sales', format='csv')
+            self.assertEqual(response.status_code, 202)
+            export = InsightsExport.objects.get()
+            delay.assert_called_once_with(str(export.id))
+            self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'pending')
+
+            run_export(export)
+            status = self.client.get(response.json()['status_url']).json()
+            self.assertEqual(status['status'], 'done')
+            self.assertEqual(export.file.name, f'insights/{export.id}.csv')
+            response = self.client.get(status['download_url'])
+            self.assertIn('sales-20240301-20240304.csv', response['Content-Disposition'])
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+            self.client.force_login(self.buyer)
+            self.assertEqual(self.client.get(status['download_url']).status_code, 403)
+            self.buyer.is_staff = True
+            self.buyer.save()
+            self.assertEqual(self.client.get(status['download_url']).status_code, 404)
+
+    def test_exports_are_for_staff_and_sellers(self):
+        self.client.logout()
+        self.assertEqual(self.export().status_code, 302)
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.export().status_code, 403)
+        self.buyer.is_staff = True
+        self.buyer.save()
+        self.assertEqual(self.export().status_code, 200)
+
+    def test_export_status_is_for_its_creator(self):
+        with override_settings(INSIGHTS_EXPORT_STREAM_MAX_ROWS=1), \
+                mock.patch('insights.views.run_insights_export.delay'):
+            status_url = self.export(dataset='sales', format='csv').json()['status_url']
+        self.assertEqual(InsightsExport.objects.get().created_by, self.seller)
+        self.assertEqual(self.client.get(status_url).status_code, 200)
+
+        other = User.objects.create_user(username='grower', email='grower@example.com', password='password',
+                                         is_staff=True)
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(status_url).status_code, 302)
+
+    def test_invalid_export_parameters(self):
+        self.assertEqual(self.export(format='pdf').status_code, 400)
+        self.assertEqual(self.export(dataset='users').status_code, 400)
@@ -0,0 +1,159 @@
+"""
+Daily market trends per category.
+
+``MarketTrend`` holds one row per category and day with the average price
+and the units sold. Only paid orders count, those in one of the metrics'
+``SALE_STATUSES``. ``rollup_trends()`` finds the days touched by price
+history added since the ``TrendWatermark`` and the days of the orders whose
+status moved into or out of a sale status since then, so a cancellation or
+refund takes its order off the day it was placed. It recomputes every
+category for those days only, and upserts the rows with
+``bulk_create(update_conflicts=True)``, so recomputing a day is idempotent;
+rows of a recomputed day that no longer has data for their category are
+deleted. The new rows, the ``CategorySketch`` rows for the same days (see
+``sketches``) and the watermark are written in one transaction.
+
+The average price is the mean of the list prices recorded that day or, on
+days without a price change, of the unit prices paid. Days follow the
+project time zone. Prices flagged as anomalies can be left out, see
+``anomalies``. Rows are only picked up once they are
+``INSIGHTS_SETTLE_DELAY`` seconds old, so nothing still being written when a
+run starts is skipped.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from payments.models import OrderItem
+from .anomalies import trend_prices
+from .metrics import SALE_STATUSES, sale_changes
+from .models import CategorySketch, MarketTrend, PriceHistory, TrendWatermark
+from .sketches import day_sketches
+
+WATERMARK_ID = 1
+
+
+def _after(queryset, time_field, at, last_id):
+    """Rows past an ``(at, id)`` watermark"""
+    if last_id is None:
+        return queryset
+    return queryset.filter(Q(**{f'{time_field}__gt': at}) | Q(**{time_field: at, 'id__gt': last_id}))
+
+
+def _new_rows(queryset, time_field, day_field=None):
+    """Days of ``day_field`` touched by ``queryset`` and its last ``(at, id)``, or ``(set(), None)``"""
+    last = queryset.order_by(f'-{time_field}', '-id').values_list(time_field, 'id').first()
+    if last is None:
+        return set(), None
+    days = queryset.annotate(day=TruncDate(day_field or time_field)).values_list('day', flat=True)
+    days = set(days.order_by().distinct())
+    return days, last
+
+
+def day_stats(days):
+    """``{(category id, day): (average price, units sold)}`` for every category on ``days``"""
+    start = timezone.make_aware(datetime.combine(min(days), datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(max(days) + timedelta(days=1), datetime.min.time()))
+
+    list_prices = (
+        trend_prices(PriceHistory.objects.filter(recorded_at__gte=start, recorded_at__lt=end))
+        .annotate(day=TruncDate('recorded_at'))
+        .values_list('product__category_id', 'day')
+        .annotate(average=Avg('price'))
+        .order_by()
+    )
+    sales = (
+        OrderItem.objects.filter(
+            order__created_at__gte=start, order__created_at__lt=end, order__status__in=SALE_STATUSES
+        )
+        .annotate(day=TruncDate('order__created_at'))
+        .values_list('product__category_id', 'day')
+        .annotate(units=Sum('quantity'), average=Avg('unit_price'))
+        .order_by()
+    )
+
+    stats = {}
+    for category_id, day, units, average in sales:
+        if day in days:
+            stats[category_id, day] = (average, units)
+    for category_id, day, average in list_prices:
+        if day in days:
+            stats[category_id, day] = (average, stats.get((category_id, day), (None, 0))[1])
+    return {
+        key: (Decimal(average).quantize(Decimal('0.01')), units)
+        for key, (average, units) in stats.items()
+    }
+
+
+def _replace_days(model, rows, days, update_fields):
+    """Upsert ``rows`` and delete the other rows of ``days``, which no longer have data"""
+    keys = {(row.category_id, row.date) for row in rows}
+    stale = [
+        pk for pk, category_id, day in model.objects.filter(date__in=days).values_list('id', 'category_id', 'date')
+        if (category_id, day) not in keys
+    ]
+    model.objects.filter(id__in=stale).delete()
+    model.objects.bulk_create(
+        rows, batch_size=1000, update_conflicts=True,
+        unique_fields=['category', 'date'], update_fields=update_fields,
+    )
+
+
+def rollup_days(days):
+    """Recompute the ``MarketTrend`` and ``CategorySketch`` rows of ``days``; returns the trend rows written"""
+    if not days:
+        return 0
+    trends = [
+        MarketTrend(category_id=category_id, date=day, average_price=average, total_sales=units)
+        for (category_id, day), (average, units) in day_stats(days).items()
+    ]
+    with transaction.atomic():
+        _replace_days(MarketTrend, trends, days, ['average_price', 'total_sales'])
+        _replace_days(CategorySketch, day_sketches(days), days, ['buyers', 'sellers', 'list_prices', 'paid_prices'])
+    return len(trends)
+
+
+def rollup_trends(now=None, rebuild=False):
+    """
+    Recompute the ``MarketTrend`` rows touched since the last run.
+
+    With ``rebuild``, or without a watermark, every day with data or with
+    rows is recomputed. Returns the number of rows written.
+    """
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=settings.INSIGHTS_SETTLE_DELAY)
+    with transaction.atomic():
+        watermark, _ = TrendWatermark.objects.select_for_update().get_or_create(pk=WATERMARK_ID)
+        if rebuild:
+            watermark.price_id = watermark.change_id = None
+        full = watermark.price_id is None and watermark.change_id is None
+
+        price_days, last_price = _new_rows(
+            _after(PriceHistory.objects.filter(recorded_at__lte=cutoff), 'recorded_at',
+                   watermark.price_recorded_at, watermark.price_id),
+            'recorded_at',
+        )
+        change_days, last_change = _new_rows(
+            _after(sale_changes().filter(created_at__lte=cutoff), 'created_at',
+                   watermark.change_created_at, watermark.change_id),
+            'created_at', 'order__created_at',
+        )
+        days = price_days | change_days
+        if full:
+            # Days rolled up before that may have no data any more
+            for model in (MarketTrend, CategorySketch):
+                days |= set(model.objects.values_list('date', flat=True).order_by().distinct())
+        if not days:
+            return 0
+
+        count = rollup_days(days)
+        if last_price is not None:
+            watermark.price_recorded_at, watermark.price_id = last_price
+        if last_change is not None:
+            watermark.change_created_at, watermark.change_id = last_change
+        watermark.save()
+    return count
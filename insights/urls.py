@@ -5,6 +5,12 @@ app_name = 'insights'
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
-    path('api/data/', views.api_data, name='api_data'),
+    path('seller/', views.seller_dashboard, name='seller_dashboard'),
+    path('api/', views.api_data, name='api_data'),
+    path('api/data/', views.api_data),
+    path('api/stats/', views.api_stats, name='api_stats'),
+    path('api/forecast/', views.api_forecast, name='api_forecast'),
     path('export/', views.export_data, name='export_data'),
+    path('export/<uuid:export_id>/', views.export_status, name='export_status'),
+    path('export/<uuid:export_id>/download/', views.export_download, name='export_download'),
 ]
\ No newline at end of file
@@ -1,31 +1,160 @@
-from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.shortcuts import get_object_or_404, render
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cube import DEFAULT_DAYS, seller_dashboard_context
+from .exports import DATASETS, FORMATS, export_chunks, export_filename, export_queryset
+from .forecasts import category_forecasts
+from .metrics import dashboard_context
+from .models import InsightsExport
+from .series import MAX_POINTS, RESOLUTIONS, get_series
+from .sketches import get_market_stats
+from .tasks import run_insights_export
+
+DEFAULT_RANGE_DAYS = 30
 
 def dashboard(request):
-    """Analytics dashboard"""
-    return render(request, 'insights/index.html', {
-        'total_products': 150,
-        'active_sellers': 25,
-        'avg_price': 45.99,
-        'total_orders': 320,
-        'categories': [],
-        'top_products': [],
-        'top_categories': [],
-        'detailed_products': [],
-    })
+    """Analytics dashboard, read from the materialized metrics tables"""
+    return render(request, 'insights/index.html', dashboard_context())
+
+@login_required
+def seller_dashboard(request):
+    """A seller's own views, cart adds, orders and revenue per product, read from the seller cube"""
+    if not request.user.is_seller:
+        raise PermissionDenied
+    days = request.GET.get('days', str(DEFAULT_DAYS))
+    days = min(max(int(days), 1), 365) if days.isdigit() else DEFAULT_DAYS
+    return render(request, 'insights/seller.html', seller_dashboard_context(request.user, days))
+
+def parse_bound(value):
+    """Aware datetime from an ISO date or datetime string"""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.combine(day, datetime.min.time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValueError(f'{value!r} is not an ISO date or datetime')
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+def series_params(query):
+    """``(start, end, resolution, category id, points)`` from the query string"""
+    if 'end' in query:
+        end = parse_bound(query['end'])
+    else:
+        end = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), datetime.min.time()))
+    start = parse_bound(query['start']) if 'start' in query else end - timedelta(days=DEFAULT_RANGE_DAYS)
+    if start >= end:
+        raise ValueError('end must be after start')
+    resolution = query.get('resolution', 'day')
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    category = query.get('category') or None
+    points = query.get('points', str(MAX_POINTS))
+    if not (category is None or category.isdigit()) or not points.isdigit():
+        raise ValueError('category and points must be whole numbers')
+    return start, end, resolution, category and int(category), min(max(int(points), 3), MAX_POINTS)
 
 def api_data(request):
-    """API endpoint for dashboard data"""
+    """Price and sales series for the dashboard charts"""
+    try:
+        start, end, resolution, category_id, points = series_params(request.GET)
+        series = get_series(start, end, resolution, category_id, points)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse(
+        dict(series, start=int(start.timestamp()), end=int(end.timestamp())),
+        json_dumps_params={'separators': (',', ':')},
+    )
+
+def api_stats(request):
+    """Approximate unique buyers, active sellers and price percentiles for a date range"""
+    try:
+        start, end, _, category_id, _ = series_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    first, last = timezone.localdate(start), timezone.localdate(end - timedelta(microseconds=1))
+    stats = get_market_stats(first, last, category_id)
+    return JsonResponse(dict(stats, start=first.isoformat(), end=last.isoformat()))
+
+def api_forecast(request):
+    """Stored 30-day price forecasts per category, biggest expected gain first"""
+    category = request.GET.get('category') or None
+    if not (category is None or category.isdigit()):
+        return JsonResponse({'success': False, 'error': 'category must be a whole number'}, status=400)
+    return JsonResponse({'categories': category_forecasts(category and int(category))})
+
+def can_export(user):
+    return user.is_staff or user.is_seller
+
+@login_required
+def export_data(request):
+    """Stream price history, market trends or sales as CSV, JSONL or Parquet, for staff and sellers"""
+    if not can_export(request.user):
+        raise PermissionDenied
+    dataset = request.GET.get('dataset', 'sales')
+    export_format = request.GET.get('format', 'csv')
+    try:
+        if dataset not in DATASETS:
+            raise ValueError(f"dataset must be one of {', '.join(DATASETS)}")
+        if export_format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        start, end, _, category_id, _ = series_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    # Bounded count: only needs to know whether the limit is passed
+    max_rows = settings.INSIGHTS_EXPORT_STREAM_MAX_ROWS
+    if export_queryset(dataset, start, end, category_id)[:max_rows + 1].count() > max_rows:
+        export = InsightsExport.objects.create(
+            dataset=dataset, export_format=export_format, start=start, end=end, category_id=category_id,
+            created_by=request.user,
+        )
+        transaction.on_commit(lambda: run_insights_export.delay(str(export.id)))
+        return JsonResponse({
+            'success': True,
+            'status': export.status,
+            'status_url': reverse('insights:export_status', args=[export.id]),
+        }, status=202)
+
+    content_type, _ = FORMATS[export_format]
+    response = StreamingHttpResponse(
+        export_chunks(dataset, export_format, start, end, category_id), content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, export_format, start, end)}"'
+    return response
+
+@login_required
+def export_status(request, export_id):
+    """Progress of one of the user's background exports, with its download link once done"""
+    if not can_export(request.user):
+        raise PermissionDenied
+    export = get_object_or_404(InsightsExport, pk=export_id, created_by=request.user)
     return JsonResponse({
-        'price_labels': ['Jan', 'Feb', 'Mar', 'Apr', 'May'],
-        'price_data': [25, 30, 28, 35, 32],
-        'sales_labels': ['Jan', 'Feb', 'Mar', 'Apr', 'May'],
-        'sales_data': [10, 15, 12, 20, 18],
-        'category_labels': ['Fruits', 'Vegetables', 'Grains'],
-        'category_data': [40, 35, 25],
+        'success': export.status != 'failed',
+        'status': export.status,
+        'download_url': reverse('insights:export_download', args=[export.id]) if export.status == 'done' else None,
+        'error': export.error or None,
     })
 
-def export_data(request):
-    """Export dashboard data"""
-    format_type = request.GET.get('format', 'csv')
-    return HttpResponse(f"<h1>Export Data</h1><p>Exporting data as {format_type}.</p>")
\ No newline at end of file
+@login_required
+def export_download(request, export_id):
+    """The file of one of the user's finished background exports"""
+    if not can_export(request.user):
+        raise PermissionDenied
+    export = get_object_or_404(InsightsExport, pk=export_id, created_by=request.user, status='done')
+    if not export.file:
+        raise Http404
+    filename = export_filename(export.dataset, export.export_format, export.start, export.end)
+    return FileResponse(export.file.open('rb'), as_attachment=True, filename=filename,
+                        content_type=FORMATS[export.export_format][0])
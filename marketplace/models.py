@@ -1,5 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.dispatch import Signal
+
+# Sent by ProductQuerySet.update(), and so bulk_update(), with
+# prices={product id: new price} for the products whose price changed,
+# which the save() signals never see; once per PRICE_CHUNK_SIZE products
+prices_updated = Signal()
+PRICE_CHUNK_SIZE = 1000
 
 class Category(models.Model):
     """Product categories"""
@@ -15,6 +22,31 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    """
+    Bulk writes that announce price changes through ``prices_updated``.
+
+    ``bulk_update()`` writes through ``update()``, so it is covered too.
+    """
+
+    def update(self, **kwargs):
+        if 'price' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            products = Product.objects.using(self.db).order_by()
+            before = dict(
+                products.filter(pk__in=self.values('pk')).select_for_update().values_list('pk', 'price')
+            )
+            updated = super().update(**kwargs)
+            # Read back in chunks to keep the IN lists bounded
+            pks = list(before)
+            for start in range(0, len(pks), PRICE_CHUNK_SIZE):
+                after = products.filter(pk__in=pks[start:start + PRICE_CHUNK_SIZE]).values_list('pk', 'price')
+                changed = {pk: price for pk, price in after if price != before[pk]}
+                if changed:
+                    prices_updated.send(sender=Product, prices=changed)
+        return updated
+
 class Product(models.Model):
     """Products in the marketplace"""
     name = models.CharField(max_length=200)
@@ -31,5 +63,7 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.name
\ No newline at end of file
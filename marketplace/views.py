@@ -2,6 +2,7 @@ from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse
 from django.db.models import Q
 
+from insights.cube import record_event
 from .models import Product, Category
 
 def product_list(request):
@@ -49,6 +50,7 @@ def product_list(request):
 def product_detail(request, pk):
     """Product detail view"""
     product = get_object_or_404(Product, pk=pk, is_active=True)
+    record_event(product, 'views')
     
     # Get related products from the same category
     related_products = Product.objects.filter(
@@ -1,11 +1,53 @@
-from django.contrib import admin
+import json
+import tempfile
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from .models import (
-    PaymentMethod, Order, OrderItem, Payment, 
-    UserBalance, PaymentSecurity
+    PaymentMethod, PricingRule, Order, OrderItem, Payment, 
+    OrderStatusHistory, UserBalance, PaymentSecurity, PaymentSecurityRollup, BlockedIP, WebhookEvent,
+    PayoutBatch, SellerPayout, SellerBalance
 )
+from .audit import block_ips, unblock_ips
+from .exports import FORMATS, csv_chunks, export_rows, gzip_chunks, write_export
+from .transitions import bulk_transition_orders
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the planner's row estimate on large tables.
+
+    An exact COUNT(*) over millions of rows takes longer than the page
+    itself. On PostgreSQL the changelist query is EXPLAINed first and the
+    estimate used when it is above ``estimate_threshold``; smaller results
+    and other databases get an exact count.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == 'postgresql':
+            plan = json.loads(queryset.explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too large to count on every page view"""
+    paginator = EstimatedCountPaginator
+    # Skips the unfiltered COUNT(*) shown next to filtered result counts
+    show_full_result_count = False
 
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
@@ -26,12 +68,23 @@ class PaymentMethodAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(PricingRule)
+class PricingRuleAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'region', 'category', 'rate', 'fixed_amount', 'is_active', 'updated_at']
+    list_filter = ['kind', 'is_active', 'category']
+    search_fields = ['region', 'category__name']
+    list_editable = ['is_active']
+    list_select_related = ['category']
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ['order_number', 'customer', 'status', 'total_amount', 'grand_total', 'created_at', 'items_count']
+class OrderAdmin(LargeTableAdmin):
+    list_display = ['order_number', 'customer', 'status', 'total_amount', 'grand_total', 'created_at',
+                    'items_count', 'units_count']
     list_filter = ['status', 'created_at', 'customer']
     search_fields = ['order_number', 'customer__username', 'customer__email']
-    readonly_fields = ['order_number', 'created_at', 'updated_at']
+    # Status changes go through the actions, which record them in the
+    # history that the insights sales totals are folded from
+    readonly_fields = ['order_number', 'status', 'created_at', 'updated_at']
     date_hierarchy = 'created_at'
     
     fieldsets = (
@@ -46,29 +99,113 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
     
+    actions = ['mark_confirmed', 'mark_processing', 'mark_shipped', 'mark_delivered', 'mark_cancelled',
+               'mark_refunded', 'export_csv', 'export_xlsx', 'export_parquet']
+    
     def items_count(self, obj):
-        return obj.items.count()
+        return obj.line_count or 0
     items_count.short_description = 'Items'
+    items_count.admin_order_field = 'line_count'
+    
+    def units_count(self, obj):
+        return obj.unit_count or 0
+    units_count.short_description = 'Units'
+    units_count.admin_order_field = 'unit_count'
+    
+    def _bulk_transition(self, request, queryset, to_status):
+        moved, skipped = bulk_transition_orders(queryset, to_status, user=request.user, note='Admin action')
+        message = f'{moved} orders marked as {to_status}.'
+        if skipped:
+            message += f' {skipped} orders could not move to {to_status} from their current status.'
+        self.message_user(request, message, messages.WARNING if skipped else messages.SUCCESS)
+    
+    def mark_confirmed(self, request, queryset):
+        self._bulk_transition(request, queryset, 'confirmed')
+    mark_confirmed.short_description = "Mark selected orders as confirmed"
+    
+    def mark_processing(self, request, queryset):
+        self._bulk_transition(request, queryset, 'processing')
+    mark_processing.short_description = "Mark selected orders as processing"
+    
+    def mark_shipped(self, request, queryset):
+        self._bulk_transition(request, queryset, 'shipped')
+    mark_shipped.short_description = "Mark selected orders as shipped"
+    
+    def mark_delivered(self, request, queryset):
+        self._bulk_transition(request, queryset, 'delivered')
+    mark_delivered.short_description = "Mark selected orders as delivered"
+    
+    def mark_cancelled(self, request, queryset):
+        self._bulk_transition(request, queryset, 'cancelled')
+    mark_cancelled.short_description = "Cancel selected orders"
+    
+    def mark_refunded(self, request, queryset):
+        self._bulk_transition(request, queryset, 'refunded')
+    mark_refunded.short_description = "Mark selected orders as refunded"
+    
+    def _export(self, queryset, export_format):
+        content_type, extension = FORMATS[export_format]
+        filename = f"orders-{timezone.now():%Y%m%d-%H%M%S}{extension}"
+        rows = export_rows(orders=queryset)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(gzip_chunks(csv_chunks(rows)), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+        # Zip and Parquet footers are written last, so spool to disk first
+        spool = tempfile.TemporaryFile()
+        write_export(export_format, rows, spool)
+        spool.seek(0)
+        return FileResponse(spool, as_attachment=True, filename=filename, content_type=content_type)
+    
+    def export_csv(self, request, queryset):
+        return self._export(queryset, 'csv')
+    export_csv.short_description = "Export order lines of selected orders (CSV, gzip)"
+    
+    def export_xlsx(self, request, queryset):
+        return self._export(queryset, 'xlsx')
+    export_xlsx.short_description = "Export order lines of selected orders (Excel)"
+    
+    def export_parquet(self, request, queryset):
+        return self._export(queryset, 'parquet')
+    export_parquet.short_description = "Export order lines of selected orders (Parquet)"
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('customer').prefetch_related('items')
+        # Per-row subqueries rather than a join, so the queryset has no
+        # GROUP BY when actions use it as a subquery
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return super().get_queryset(request).select_related('customer').annotate(
+            line_count=Subquery(items.annotate(n=Count('id')).values('n')),
+            unit_count=Subquery(items.annotate(n=Sum('quantity')).values('n')),
+        )
+
+@admin.register(OrderStatusHistory)
+class OrderStatusHistoryAdmin(LargeTableAdmin):
+    list_display = ['order', 'from_status', 'to_status', 'changed_by', 'note', 'created_at']
+    list_filter = ['to_status', 'created_at']
+    search_fields = ['order__order_number', 'note']
+    readonly_fields = ['order', 'from_status', 'to_status', 'changed_by', 'note', 'created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('order__customer', 'changed_by')
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ['order', 'product', 'quantity', 'unit_price', 'total_price']
     list_filter = ['order__status']
     search_fields = ['order__order_number', 'product__name']
     readonly_fields = ['total_price']
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('order', 'product')
+        return super().get_queryset(request).select_related('order__customer', 'product')
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(LargeTableAdmin):
     list_display = ['payment_id', 'order_link', 'customer', 'payment_method', 'amount', 'status', 'created_at']
     list_filter = ['status', 'payment_method', 'created_at']
     search_fields = ['payment_id', 'order__order_number', 'customer__username']
-    readonly_fields = ['payment_id', 'created_at', 'updated_at', 'security_hash']
+    # Payments move through the gateway, webhooks and reconciliation, which
+    # check the allowed transitions and confirm the order
+    readonly_fields = ['payment_id', 'status', 'created_at', 'updated_at', 'security_hash']
     date_hierarchy = 'created_at'
     
     fieldsets = (
@@ -90,8 +227,8 @@ class PaymentAdmin(admin.ModelAdmin):
     )
     
     def order_link(self, obj):
-        if obj.order:
-            url = reverse('admin:payments_order_change', args=[obj.order.id])
+        if obj.order_id:
+            url = reverse('admin:payments_order_change', args=[obj.order_id])
             return format_html('<a href="{}">{}</a>', url, obj.order.order_number)
         return '-'
     order_link.short_description = 'Order'
@@ -120,7 +257,7 @@ class UserBalanceAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('user')
 
 @admin.register(PaymentSecurity)
-class PaymentSecurityAdmin(admin.ModelAdmin):
+class PaymentSecurityAdmin(LargeTableAdmin):
     list_display = ['event_type', 'user', 'ip_address', 'risk_score', 'is_blocked', 'created_at']
     list_filter = ['event_type', 'is_blocked', 'created_at', 'risk_score']
     search_fields = ['ip_address', 'user__username']
@@ -145,15 +282,65 @@ class PaymentSecurityAdmin(admin.ModelAdmin):
     actions = ['block_ip', 'unblock_ip']
     
     def block_ip(self, request, queryset):
+        ip_addresses = set(queryset.values_list('ip_address', flat=True))
         updated = queryset.update(is_blocked=True)
+        block_ips(ip_addresses, reason=f'Blocked by {request.user}')
         self.message_user(request, f'{updated} IP addresses have been blocked.')
     block_ip.short_description = "Block selected IP addresses"
     
     def unblock_ip(self, request, queryset):
+        ip_addresses = set(queryset.values_list('ip_address', flat=True))
         updated = queryset.update(is_blocked=False)
+        unblock_ips(ip_addresses)
         self.message_user(request, f'{updated} IP addresses have been unblocked.')
     unblock_ip.short_description = "Unblock selected IP addresses"
 
+@admin.register(PaymentSecurityRollup)
+class PaymentSecurityRollupAdmin(LargeTableAdmin):
+    list_display = ['hour', 'event_type', 'user', 'ip_address', 'event_count', 'max_risk_score']
+    list_filter = ['event_type', 'hour']
+    search_fields = ['ip_address', 'user__username']
+    date_hierarchy = 'hour'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(BlockedIP)
+class BlockedIPAdmin(admin.ModelAdmin):
+    list_display = ['ip_address', 'reason', 'blocked_at']
+    search_fields = ['ip_address', 'reason']
+    readonly_fields = ['blocked_at']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(LargeTableAdmin):
+    list_display = ['event_id', 'payment_id', 'sequence', 'status', 'received_at', 'processed_at']
+    list_filter = ['status', 'received_at']
+    search_fields = ['event_id', 'payment_id']
+    readonly_fields = ['event_id', 'payment_id', 'sequence', 'payload', 'received_at', 'processed_at']
+    date_hierarchy = 'received_at'
+
+class SellerPayoutInline(admin.TabularInline):
+    model = SellerPayout
+    extra = 0
+    readonly_fields = ['seller', 'amount', 'item_count', 'reversed_amount', 'reversed_item_count']
+    can_delete = False
+
+@admin.register(PayoutBatch)
+class PayoutBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'payment_count', 'item_count', 'total_amount', 'reversed_amount',
+                    'watermark_updated_at', 'created_at']
+    readonly_fields = ['payment_count', 'item_count', 'total_amount', 'reversed_count', 'reversed_amount',
+                       'watermark_updated_at', 'watermark_payment_id', 'created_at']
+    date_hierarchy = 'created_at'
+    inlines = [SellerPayoutInline]
+
+@admin.register(SellerBalance)
+class SellerBalanceAdmin(admin.ModelAdmin):
+    list_display = ['seller', 'total_earned', 'item_count', 'last_batch', 'updated_at']
+    search_fields = ['seller__username', 'seller__email']
+    readonly_fields = ['seller', 'total_earned', 'item_count', 'last_batch', 'updated_at']
+    list_select_related = ['seller', 'last_batch']
+
 # Customize admin site
 admin.site.site_header = "AgroMarket Payment Administration"
 admin.site.site_title = "AgroMarket Payments"
@@ -0,0 +1,230 @@
+"""
+Payment security audit storage.
+
+``PaymentSecurity`` rows are partitioned by month on ``created_at``. On
+PostgreSQL the table is natively range-partitioned (see migration 0005) and
+each month lives in its own ``payments_paymentsecurity_pYYYYMM`` table. Other
+backends keep a single table and treat each month as a logical partition
+addressed by the ``created_at`` index.
+
+Every event also bumps an hourly ``PaymentSecurityRollup`` row so risk checks
+(the checkout rate limit and the fraud features) read small aggregates, plus
+at most the partial hour at the start of their window from the raw rows, and
+blocked addresses live in ``BlockedIP``, which survives archival of the raw
+events.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import PaymentSecurity, PaymentSecurityRollup, BlockedIP
+
+ARCHIVE_FIELDS = [
+    'id', 'event_type', 'user_id', 'ip_address', 'user_agent',
+    'details', 'risk_score', 'is_blocked', 'created_at',
+]
+
+
+def _bump_rollup(hour, event_type, user, ip_address, risk_score):
+    return PaymentSecurityRollup.objects.filter(
+        hour=hour, event_type=event_type, user=user, ip_address=ip_address
+    ).update(
+        event_count=F('event_count') + 1,
+        risk_score_total=F('risk_score_total') + risk_score,
+        max_risk_score=Greatest('max_risk_score', risk_score),
+    )
+
+
+def record_security_event(event_type, user, ip_address, user_agent='', details=None, risk_score=0):
+    """Store a security event and add it to its hourly rollup"""
+    with transaction.atomic():
+        event = PaymentSecurity.objects.create(
+            event_type=event_type,
+            user=user,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            details=details or {},
+            risk_score=risk_score,
+        )
+        hour = event.created_at.replace(minute=0, second=0, microsecond=0)
+        if not _bump_rollup(hour, event_type, user, ip_address, risk_score):
+            try:
+                with transaction.atomic():
+                    PaymentSecurityRollup.objects.create(
+                        hour=hour,
+                        event_type=event_type,
+                        user=user,
+                        ip_address=ip_address,
+                        event_count=1,
+                        risk_score_total=risk_score,
+                        max_risk_score=risk_score,
+                    )
+            except IntegrityError:
+                # A concurrent event created the bucket first
+                _bump_rollup(hour, event_type, user, ip_address, risk_score)
+    return event
+
+
+def recent_event_count(user, event_type, window, now=None):
+    """
+    Events of ``user`` in the last ``window``.
+
+    Whole hours inside the window are read from the hourly rollups and the
+    partial hour at its start from the raw events, at most an hour of one
+    user's events by the ``(user, event_type, created_at)`` index, so the
+    count covers exactly the window.
+    """
+    since = ((now or timezone.now()) - window).astimezone(dt_timezone.utc)
+    first_hour = since.replace(minute=0, second=0, microsecond=0)
+    leading = 0
+    if first_hour < since:
+        first_hour += timedelta(hours=1)
+        leading = PaymentSecurity.objects.filter(
+            user=user, event_type=event_type, created_at__gte=since, created_at__lt=first_hour,
+        ).count()
+    total = PaymentSecurityRollup.objects.filter(
+        user=user, event_type=event_type, hour__gte=first_hour,
+    ).aggregate(total=Sum('event_count'))['total']
+    return leading + (total or 0)
+
+
+def is_ip_blocked(ip_address):
+    """Whether payments from ``ip_address`` are blocked"""
+    return BlockedIP.objects.filter(ip_address=ip_address).exists()
+
+
+def block_ips(ip_addresses, reason=''):
+    """Block every address in ``ip_addresses``"""
+    BlockedIP.objects.bulk_create(
+        [BlockedIP(ip_address=ip, reason=reason) for ip in set(ip_addresses)],
+        ignore_conflicts=True,
+    )
+
+
+def unblock_ips(ip_addresses):
+    """Unblock addresses that no longer have any blocked security event"""
+    still_blocked = PaymentSecurity.objects.filter(
+        ip_address__in=ip_addresses, is_blocked=True
+    ).values('ip_address')
+    BlockedIP.objects.filter(ip_address__in=ip_addresses).exclude(
+        ip_address__in=still_blocked
+    ).delete()
+
+
+# Partitions
+
+def month_start(value):
+    """First instant of the UTC month containing ``value``"""
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    """``value`` (a month start) shifted by ``months``"""
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f"{PaymentSecurity._meta.db_table}_p{start:%Y%m}"
+
+
+def is_partitioned():
+    """Whether the audit table is a native PostgreSQL partitioned table"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s",
+            [PaymentSecurity._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def ensure_partitions(months_ahead=2, now=None):
+    """Create monthly partitions up to ``months_ahead`` months from now"""
+    if not is_partitioned():
+        return []
+    table = connection.ops.quote_name(PaymentSecurity._meta.db_table)
+    start = month_start(now or timezone.now())
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            lower = add_months(start, offset)
+            upper = add_months(lower, 1)
+            name = partition_name(lower)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(name)} "
+                f"PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper],
+            )
+            created.append(name)
+    return created
+
+
+def expired_partitions(cutoff):
+    """Month start dates whose whole month is older than ``cutoff``"""
+    oldest = PaymentSecurity.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    if oldest is None:
+        return []
+    months = []
+    current = month_start(oldest)
+    while add_months(current, 1) <= cutoff:
+        months.append(current)
+        current = add_months(current, 1)
+    return months
+
+
+def archive_partition(start, archive_dir, chunk_size=5000):
+    """
+    Stream one month of events to ``archive_dir`` as gzipped JSON lines.
+
+    Rows are read with a server-side cursor, so memory stays flat regardless
+    of partition size. Returns the archive path (None for an empty month)
+    and the number of rows.
+    """
+    end = add_months(start, 1)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"payment_security_{start:%Y_%m}.jsonl.gz")
+    tmp_path = f"{path}.tmp"
+
+    rows = (
+        PaymentSecurity.objects.filter(created_at__gte=start, created_at__lt=end)
+        .order_by('id')
+        .values_list(*ARCHIVE_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+        for row in rows:
+            archive.write(json.dumps(dict(zip(ARCHIVE_FIELDS, row)), default=str))
+            archive.write('\n')
+            count += 1
+    if not count:
+        os.remove(tmp_path)
+        return None, 0
+    os.replace(tmp_path, path)
+    return path, count
+
+
+def drop_partition(start):
+    """Remove one month of raw events"""
+    if is_partitioned():
+        table = connection.ops.quote_name(PaymentSecurity._meta.db_table)
+        name = partition_name(start)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {connection.ops.quote_name(name)}")
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+    # SQLite fallback layout, and any rows that landed in the default partition
+    PaymentSecurity.objects.filter(
+        created_at__gte=start, created_at__lt=add_months(start, 1)
+    ).delete()
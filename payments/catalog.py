@@ -0,0 +1,116 @@
+"""
+In-process catalog of active payment methods.
+
+Each worker keeps the active ``PaymentMethod`` rows and their fee schedules in
+memory. Saving or deleting a method bumps a version key in the shared cache;
+workers compare against it at most every
+``PAYMENT_METHOD_CATALOG_CHECK_INTERVAL`` seconds and reload when it changed.
+"""
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PaymentMethod
+
+VERSION_KEY = 'payments:method_catalog_version'
+CENT = Decimal('0.01')
+
+_lock = threading.Lock()
+_catalog = None
+
+
+class PaymentMethodCatalog:
+    """Snapshot of active payment methods with precomputed fee schedules"""
+
+    def __init__(self, methods, version):
+        self.version = version
+        self.methods = tuple(methods)
+        self.by_id = {method.id: method for method in self.methods}
+        # (rate, fixed fee, min amount, max amount) per method
+        self.schedules = {
+            method.id: (
+                method.processing_fee_percentage / Decimal('100'),
+                method.processing_fee_fixed,
+                method.min_amount,
+                method.max_amount,
+            )
+            for method in self.methods
+        }
+        self.checked_at = time.monotonic()
+
+    def __iter__(self):
+        return iter(self.methods)
+
+    def __len__(self):
+        return len(self.methods)
+
+    def get(self, method_id):
+        """Active method by id, or None"""
+        try:
+            return self.by_id.get(int(method_id))
+        except (TypeError, ValueError):
+            return None
+
+    def calculate_fees(self, method, amount):
+        """Processing fee for ``amount``, same as ``PaymentMethod.calculate_fees``"""
+        rate, fixed, _, _ = self.schedules[method.id]
+        return amount * rate + fixed
+
+    def accepts(self, method, amount):
+        """Whether ``amount`` is within the method's limits"""
+        _, _, min_amount, max_amount = self.schedules[method.id]
+        return min_amount <= amount <= max_amount
+
+    def quote(self, amount):
+        """Price every active method for ``amount`` in one pass"""
+        quotes = []
+        for method in self.methods:
+            rate, fixed, min_amount, max_amount = self.schedules[method.id]
+            fee = (amount * rate + fixed).quantize(CENT)
+            quotes.append({
+                'method': method,
+                'fee': fee,
+                'total': amount + fee,
+                'available': min_amount <= amount <= max_amount,
+            })
+        return quotes
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def get_catalog():
+    """Return the current catalog, reloading it if an admin changed a method"""
+    global _catalog
+    catalog = _catalog
+    interval = settings.PAYMENT_METHOD_CATALOG_CHECK_INTERVAL
+    if catalog is not None and time.monotonic() - catalog.checked_at < interval:
+        return catalog
+
+    with _lock:
+        catalog = _catalog
+        version = _current_version()
+        if catalog is not None and catalog.version == version:
+            catalog.checked_at = time.monotonic()
+            return catalog
+        catalog = PaymentMethodCatalog(PaymentMethod.objects.filter(is_active=True), version)
+        _catalog = catalog
+        return catalog
+
+
+def invalidate_catalog():
+    """Drop this worker's catalog and tell other workers to reload theirs"""
+    global _catalog
+    with _lock:
+        _catalog = None
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
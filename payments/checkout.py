@@ -0,0 +1,84 @@
+"""
+Cached checkout page context.
+
+The context built by ``CheckoutView.get`` is cached per user and keyed by
+version tokens held in the shared cache: one for the user's cart, one for
+their account balance and, for Buy Now, one for the product. The caller
+adds the payment method catalog and pricing rule table versions. A
+repeated GET reads the tokens and the context in two cache round trips and
+no database queries.
+
+Tokens are replaced after the transaction that changed the cart, balance or
+product commits, so a concurrent GET never caches pre-commit data under a
+new token. Losing a token to eviction only causes a rebuild.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+CONTEXT_TIMEOUT = 600  # seconds
+VERSION_TIMEOUT = 86400  # seconds
+
+CART_VERSION_KEY = 'payments:checkout:cart:{}'
+BALANCE_VERSION_KEY = 'payments:checkout:balance:{}'
+PRODUCT_VERSION_KEY = 'payments:checkout:product:{}'
+
+
+def _bump(keys):
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(
+            lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, VERSION_TIMEOUT)
+        )
+
+
+def bump_cart_versions(user_ids):
+    """Invalidate cached checkout pages of users whose cart changed"""
+    _bump(CART_VERSION_KEY.format(user_id) for user_id in user_ids)
+
+
+def bump_balance_version(user_id):
+    _bump([BALANCE_VERSION_KEY.format(user_id)])
+
+
+def bump_product_versions(product_ids):
+    """Invalidate cached Buy Now checkout pages of products whose price or stock changed"""
+    _bump(PRODUCT_VERSION_KEY.format(product_id) for product_id in product_ids)
+
+
+def _versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    for key, version in missing.items():
+        if not cache.add(key, version, VERSION_TIMEOUT):
+            version = cache.get(key, version)
+        versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def get_checkout_context(user_id, variant, extra_key, build):
+    """
+    Cached context for one checkout page.
+
+    ``variant`` is ``None`` for the cart checkout or ``(product_id,
+    quantity)`` for Buy Now, and ``extra_key`` lists other values the context
+    depends on. ``build()`` returns the context dict, or a response to send
+    instead, which is not cached.
+    """
+    keys = [CART_VERSION_KEY.format(user_id), BALANCE_VERSION_KEY.format(user_id)]
+    if variant is not None:
+        keys.append(PRODUCT_VERSION_KEY.format(variant[0]))
+    versions = _versions(keys)
+    suffix = 'cart' if variant is None else f"buy:{variant[0]}:{variant[1]}"
+    # Hashed because extra values may hold characters not allowed in keys
+    digest = hashlib.sha1('|'.join([*map(str, extra_key), *versions]).encode()).hexdigest()
+    key = f"payments:checkout:{user_id}:{suffix}:{digest}"
+
+    context = cache.get(key)
+    if context is None:
+        context = build()
+        if isinstance(context, dict):
+            cache.set(key, context, CONTEXT_TIMEOUT)
+    return context
@@ -0,0 +1,386 @@
+"""
+Rule based fraud scoring.
+
+A rule is a weight plus a condition over named features. Conditions only use
+comparison and ``&``/``|`` operators, so the same rule scores one checkout
+(features are Python scalars) or a whole batch of historical payments
+(features are NumPy arrays) without changes.
+
+Per-request features are computed lazily, only for the features the enabled
+rules need, and read precomputed aggregates (``BlockedIP``,
+``PaymentSecurityRollup``, ``UserPaymentStats``) rather than raw history.
+Enable rules with the ``PAYMENT_FRAUD_RULES`` setting and try new ones against
+history first with ``manage.py backtest_fraud_rules``.
+"""
+import math
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import Payment, PaymentSecurity, PaymentSecurityRollup, UserPaymentStats, BlockedIP
+
+IP_REUSE_WINDOW_DAYS = 7
+MIN_HISTORY = 5  # payments needed before amount z-scores count
+
+
+class Rule:
+    """A weighted fraud indicator"""
+
+    def __init__(self, name, weight, features, condition, description):
+        self.name = name
+        self.weight = weight
+        self.features = tuple(features)
+        self.condition = condition
+        self.description = description
+
+    def __repr__(self):
+        return f"<Rule {self.name} +{self.weight}>"
+
+    def evaluate(self, features):
+        return self.condition(features)
+
+
+RULES = {}
+
+
+def register_rule(rule):
+    """Make a rule available to ``PAYMENT_FRAUD_RULES``"""
+    RULES[rule.name] = rule
+    return rule
+
+
+# Rules in the default configuration
+register_rule(Rule(
+    'blocked_ip', 50, ['ip_blocked'],
+    lambda f: f['ip_blocked'],
+    'IP address is blocked',
+))
+register_rule(Rule(
+    'suspicious_user_agent', 20, ['ua_length'],
+    lambda f: f['ua_length'] < 20,
+    'Suspicious user agent',
+))
+register_rule(Rule(
+    'high_amount', 30, ['amount'],
+    lambda f: f['amount'] > 1000,
+    'High transaction amount',
+))
+register_rule(Rule(
+    'unusual_time', 15, ['hour'],
+    lambda f: (f['hour'] >= 2) & (f['hour'] <= 5),
+    'Unusual transaction time',
+))
+
+# Feature based rules, off by default until backtested
+register_rule(Rule(
+    'high_velocity', 25, ['velocity'],
+    lambda f: f['velocity'] >= 5,
+    'Many payment attempts in the last hour',
+))
+register_rule(Rule(
+    'amount_outlier', 25, ['amount_zscore'],
+    lambda f: (f['amount_zscore'] >= 3) | (f['amount_zscore'] <= -3),
+    'Amount unusual for this customer',
+))
+register_rule(Rule(
+    'shared_ip', 30, ['ip_accounts'],
+    lambda f: f['ip_accounts'] >= 3,
+    'IP address used by several accounts',
+))
+register_rule(Rule(
+    'low_entropy_user_agent', 10, ['ua_length', 'ua_entropy'],
+    lambda f: (f['ua_length'] > 0) & (f['ua_entropy'] < 3.0),
+    'Scripted user agent',
+))
+
+
+def shannon_entropy(text):
+    """Shannon entropy of ``text`` in bits per character"""
+    if not text:
+        return 0.0
+    length = len(text)
+    return -sum(n / length * math.log2(n / length) for n in Counter(text).values())
+
+
+# Per-request features
+
+def _velocity(ctx):
+    # Attempts in the current and previous hourly rollup buckets
+    hour = ctx['now'].replace(minute=0, second=0, microsecond=0)
+    total = PaymentSecurityRollup.objects.filter(
+        user=ctx['user'],
+        event_type='payment_attempt',
+        hour__gte=hour - timezone.timedelta(hours=1),
+    ).aggregate(total=Sum('event_count'))['total']
+    return total or 0
+
+
+def _amount_zscore(ctx):
+    stats = UserPaymentStats.objects.filter(user=ctx['user']).first()
+    if stats is None or stats.payment_count < MIN_HISTORY or not stats.amount_std:
+        return 0.0
+    return (float(ctx['amount']) - stats.mean_amount) / stats.amount_std
+
+
+def _ip_accounts(ctx):
+    return (
+        PaymentSecurityRollup.objects.filter(
+            ip_address=ctx['ip_address'],
+            hour__gte=ctx['now'] - timezone.timedelta(days=IP_REUSE_WINDOW_DAYS),
+            user__isnull=False,
+        )
+        .values('user').distinct().count()
+    )
+
+
+FEATURES = {
+    'ip_blocked': lambda ctx: BlockedIP.objects.filter(ip_address=ctx['ip_address']).exists(),
+    'ua_length': lambda ctx: len(ctx['user_agent']),
+    'ua_entropy': lambda ctx: shannon_entropy(ctx['user_agent']),
+    'amount': lambda ctx: ctx['amount'],
+    'hour': lambda ctx: ctx['now'].hour,
+    'velocity': _velocity,
+    'amount_zscore': _amount_zscore,
+    'ip_accounts': _ip_accounts,
+}
+
+
+# Batch features
+#
+# Each history feature is rebuilt as the live feature saw it when the payment
+# was scored, just before the payment was created. Complete hourly rollups
+# are read as they are; the current hour's bucket only held the events
+# before the payment, so that part comes from the raw ``PaymentSecurity``
+# events and is undercounted once those are archived.
+
+def _utc(seconds):
+    return datetime.fromtimestamp(float(seconds), tz=dt_timezone.utc)
+
+
+def _batch_velocity(users, micros, bucket):
+    """Payment attempts in the previous and, up to each payment, the current hour"""
+    hour_micros = 3600 * 10**6
+    previous = {
+        (user_id, int(hour.timestamp()) * 10**6): total
+        for user_id, hour, total in PaymentSecurityRollup.objects.filter(
+            user_id__in=set(users.tolist()),
+            event_type='payment_attempt',
+            hour__gte=_utc((bucket.min() - hour_micros) / 10**6),
+            hour__lt=_utc(bucket.max() / 10**6),
+        ).values_list('user_id', 'hour').annotate(total=Sum('event_count')).order_by()
+    }
+    velocity = np.fromiter(
+        (previous.get((user, hour - hour_micros), 0) for user, hour in zip(users.tolist(), bucket.tolist())),
+        dtype=np.int64, count=len(users),
+    )
+
+    events = list(
+        PaymentSecurity.objects.filter(
+            user_id__in=set(users.tolist()),
+            event_type='payment_attempt',
+            created_at__gte=_utc(bucket.min() / 10**6),
+            created_at__lt=_utc(micros.max() / 10**6),
+        ).values_list('user_id', 'created_at')
+    )
+    if events:
+        event_users = np.array([user_id for user_id, _ in events], dtype=np.int64)
+        event_micros = np.array([int(created.timestamp() * 10**6) for _, created in events], dtype=np.int64)
+        rank = np.unique(np.concatenate([users, event_users]), return_inverse=True)[1].reshape(-1)
+        row_rank, event_rank = rank[:len(users)], rank[len(users):]
+        # One sorted (user, time) key lets searchsorted count every window
+        span = int(max(micros.max(), event_micros.max()) - bucket.min()) + 1
+        keys = np.sort(event_rank * span + (event_micros - bucket.min()))
+        row_key = row_rank * span
+        velocity += (
+            np.searchsorted(keys, row_key + (micros - bucket.min()), side='left')
+            - np.searchsorted(keys, row_key + (bucket - bucket.min()), side='left')
+        )
+    return velocity
+
+
+def _batch_amount_zscore(users, amount, micros):
+    """Amount z-scores against ``UserPaymentStats`` as they stood before each payment"""
+    user_ids = set(users.tolist())
+    since = _utc(micros.min() / 10**6)
+    # The stats now, less every payment from the batch start on...
+    base = {
+        stats.user_id: [stats.payment_count, stats.amount_sum, stats.amount_sq_sum]
+        for stats in UserPaymentStats.objects.filter(user_id__in=user_ids)
+    }
+    later = (
+        Payment.objects.filter(customer_id__in=user_ids, created_at__gte=since)
+        .values_list('customer_id')
+        .annotate(count=Count('id'), total=Sum('amount'), total_sq=Sum(F('amount') * F('amount')))
+        .order_by()
+    )
+    for user_id, count, total, total_sq in later:
+        if user_id in base:
+            base[user_id] = [base[user_id][0] - count, base[user_id][1] - float(total),
+                             base[user_id][2] - float(total_sq)]
+
+    # ...plus the user's earlier payments in the batch
+    order = np.lexsort((micros, users))
+    sorted_users = users[order]
+    first = np.r_[True, sorted_users[1:] != sorted_users[:-1]]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+    earlier = {}
+    for name, values in (('count', np.ones(len(order))), ('sum', amount[order]), ('sq', amount[order] ** 2)):
+        running = np.cumsum(values) - values
+        earlier[name] = np.empty(len(order))
+        earlier[name][order] = running - running[group_start]
+
+    zero = [0, 0.0, 0.0]
+    n = np.fromiter((base.get(user, zero)[0] for user in users.tolist()), dtype=np.float64) + earlier['count']
+    total = np.fromiter((base.get(user, zero)[1] for user in users.tolist()), dtype=np.float64) + earlier['sum']
+    total_sq = np.fromiter((base.get(user, zero)[2] for user in users.tolist()), dtype=np.float64) + earlier['sq']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        std = np.where(n >= 2, np.sqrt(np.maximum(total_sq / n - mean * mean, 0.0)), 0.0)
+    enough = (n >= MIN_HISTORY) & (std > 0)
+    amount_zscore = np.zeros(len(users), dtype=np.float64)
+    amount_zscore[enough] = (amount[enough] - mean[enough]) / std[enough]
+    return amount_zscore
+
+
+def _batch_ip_accounts(ips, micros, bucket):
+    """Distinct accounts seen on each payment's IP address in the week before it"""
+    window = IP_REUSE_WINDOW_DAYS * 86400 * 10**6
+    ip_set = set(ips.tolist()) - {''}
+    observations = {}
+    rollups = PaymentSecurityRollup.objects.filter(
+        ip_address__in=ip_set, user__isnull=False,
+        hour__gte=_utc((micros.min() - window) / 10**6), hour__lt=_utc(bucket.max() / 10**6),
+    ).values_list('ip_address', 'user_id', 'hour').distinct()
+    events = PaymentSecurity.objects.filter(
+        ip_address__in=ip_set, user__isnull=False,
+        created_at__gte=_utc(bucket.min() / 10**6), created_at__lt=_utc(micros.max() / 10**6),
+    ).values_list('ip_address', 'user_id', 'created_at')
+    for kind, rows in ((0, rollups), (1, events)):
+        for ip, user_id, when in rows.order_by():
+            observations.setdefault(ip, ([], []))[kind].append((int(when.timestamp() * 10**6), user_id))
+
+    rows_by_ip = {}
+    for row, ip in enumerate(ips.tolist()):
+        if ip in observations:
+            rows_by_ip.setdefault(ip, []).append(row)
+
+    ip_accounts = np.zeros(len(ips), dtype=np.int64)
+    for ip, (complete, current) in observations.items():
+        complete, current = sorted(complete), sorted(current)
+        complete_times = np.array([when for when, _ in complete], dtype=np.int64)
+        current_times = np.array([when for when, _ in current], dtype=np.int64)
+        for row in rows_by_ip.get(ip, ()):
+            # Whole buckets up to this hour, then this hour's events so far
+            lo, hi = np.searchsorted(complete_times, [micros[row] - window, bucket[row]], side='left')
+            accounts = {user_id for _, user_id in complete[lo:hi]}
+            lo, hi = np.searchsorted(current_times, [bucket[row], micros[row]], side='left')
+            accounts.update(user_id for _, user_id in current[lo:hi])
+            ip_accounts[row] = len(accounts)
+    return ip_accounts
+
+
+def batch_features(rows):
+    """
+    Feature arrays for historical payments.
+
+    ``rows`` are ``(customer_id, amount, ip_address, user_agent, created_at)``
+    tuples, holding every payment of their customers from the first row on.
+    History based features (velocity, z-scores, IP reuse) are computed point
+    in time, with the live features' windows and sources.
+    """
+    count = len(rows)
+    if not count:
+        return {name: np.empty(0) for name in FEATURES}
+
+    customer_ids, amounts, ips, user_agents, created = zip(*rows)
+    users = np.fromiter(customer_ids, dtype=np.int64, count=count)
+    amount = np.fromiter((float(a) for a in amounts), dtype=np.float64, count=count)
+    micros = np.fromiter((int(c.timestamp() * 10**6) for c in created), dtype=np.int64, count=count)
+    bucket = micros - micros % (3600 * 10**6)
+    hour = np.fromiter((c.astimezone(dt_timezone.utc).hour for c in created), dtype=np.int64, count=count)
+    ips = np.array([ip or '' for ip in ips], dtype=object)
+
+    # User agents repeat heavily, so score each distinct string once
+    ua_values, ua_index = np.unique(np.array(user_agents, dtype=object), return_inverse=True)
+    ua_length = np.array([len(ua) for ua in ua_values], dtype=np.int64)[ua_index]
+    ua_entropy = np.array([shannon_entropy(ua) for ua in ua_values], dtype=np.float64)[ua_index]
+
+    blocked = set(BlockedIP.objects.filter(ip_address__in=set(ips) - {''}).values_list('ip_address', flat=True))
+    ip_blocked = np.fromiter((ip in blocked for ip in ips), dtype=bool, count=count)
+
+    return {
+        'ip_blocked': ip_blocked,
+        'ua_length': ua_length,
+        'ua_entropy': ua_entropy,
+        'amount': amount,
+        'hour': hour,
+        'velocity': _batch_velocity(users, micros, bucket),
+        'amount_zscore': _batch_amount_zscore(users, amount, micros),
+        'ip_accounts': _batch_ip_accounts(ips, micros, bucket),
+    }
+
+
+class FraudEngine:
+    """Scores payments with a fixed set of rules"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.features = sorted({name for rule in self.rules for name in rule.features})
+
+    def score(self, user, ip_address, user_agent, amount, now=None):
+        """Risk score and triggered indicators for one checkout"""
+        ctx = {
+            'user': user,
+            'ip_address': ip_address,
+            'user_agent': user_agent or '',
+            'amount': amount,
+            'now': now or timezone.now(),
+        }
+        features = {name: FEATURES[name](ctx) for name in self.features}
+        risk_score = 0
+        indicators = []
+        for rule in self.rules:
+            if rule.evaluate(features):
+                risk_score += rule.weight
+                indicators.append(rule.description)
+        return risk_score, indicators
+
+    def score_batch(self, features):
+        """Vectorized scores and per-rule hit masks for feature arrays"""
+        hits = {rule.name: np.asarray(rule.evaluate(features), dtype=bool) for rule in self.rules}
+        scores = np.zeros(len(features['amount']), dtype=np.int64)
+        for rule in self.rules:
+            scores += hits[rule.name] * rule.weight
+        return scores, hits
+
+    def score_payments(self, queryset, chunk_size=5000):
+        """Rescore historical payments in time order, ``chunk_size`` at a time"""
+        rows = queryset.order_by('created_at', 'id').values_list(
+            'id', 'customer_id', 'amount', 'ip_address', 'user_agent', 'created_at'
+        ).iterator(chunk_size=chunk_size)
+        ids, scores, hits = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], []
+        while chunk := list(islice(rows, chunk_size)):
+            ids.append(np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk)))
+            chunk_scores, chunk_hits = self.score_batch(batch_features([row[1:] for row in chunk]))
+            scores.append(chunk_scores)
+            hits.append(chunk_hits)
+        hits = {
+            rule.name: np.concatenate([np.empty(0, dtype=bool)] + [chunk[rule.name] for chunk in hits])
+            for rule in self.rules
+        }
+        return np.concatenate(ids), np.concatenate(scores), hits
+
+
+def get_engine(rule_names=None):
+    """Engine for the given rule names, defaulting to ``PAYMENT_FRAUD_RULES``"""
+    names = settings.PAYMENT_FRAUD_RULES if rule_names is None else rule_names
+    unknown = [name for name in names if name not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown fraud rules: {', '.join(unknown)}")
+    return FraudEngine(RULES[name] for name in names)
@@ -0,0 +1,241 @@
+"""
+Payment gateway client.
+
+Calls go through one pooled ``httpx.AsyncClient`` per process, running on a
+background event loop thread, so keep-alive connections are shared by every
+request thread and a call from a sync view only blocks its own thread, for
+at most the call's deadline.
+
+Every call has a deadline that covers all of its attempts. Connection
+errors, timeouts, 429 and 5xx responses are retried with exponential backoff
+and full jitter while the deadline allows, and requests carry an
+idempotency key so a retried create never makes a second session. A circuit
+breaker fails calls immediately after repeated failures, until a probe
+succeeds, so a degraded gateway cannot tie up every worker.
+
+Configure with ``PAYMENT_GATEWAY_URL``; without it ``get_gateway()``
+returns None and checkout keeps using the built-in processing page.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.05  # seconds
+BACKOFF_MAX = 1.0  # seconds
+
+
+class GatewayError(Exception):
+    """The gateway rejected or failed a request"""
+
+
+class GatewayUnavailable(GatewayError):
+    """The gateway did not answer in time or the circuit is open"""
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures for ``reset_timeout`` seconds"""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Whether a call may go out; only one probe runs while half-open"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Payment gateway circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class GatewayClient:
+    """Async client for the payment gateway's REST API"""
+
+    def __init__(self, base_url, api_key='', timeout=3.0, retries=2, max_connections=20,
+                 breaker_threshold=5, breaker_reset=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._client = None
+        self._client_pid = None
+
+    def _http(self):
+        # Created lazily on the loop that uses it, and again in a forked child
+        if self._client is None or self._client_pid != os.getpid():
+            self._client_pid = os.getpid()
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={'Authorization': f'Bearer {self.api_key}'} if self.api_key else {},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def request(self, method, path, json=None, idempotency_key=None, timeout=None):
+        """JSON response of one call, retried within a single deadline"""
+        if not self.breaker.allow():
+            raise GatewayUnavailable('Payment gateway circuit is open')
+
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+        deadline = time.monotonic() + (timeout or self.timeout)
+        try:
+            response = await self._send(method, path, json, headers, deadline)
+        except BaseException:
+            # Includes cancellation, so a half-open probe is never left pending
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        if response.status_code >= 400:
+            raise GatewayError(f'Payment gateway rejected the request ({response.status_code}): {response.text[:200]}')
+        try:
+            return response.json()
+        except ValueError:
+            raise GatewayError('Payment gateway returned invalid JSON')
+
+    async def _send(self, method, path, json, headers, deadline):
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise httpx.TimeoutException('deadline exceeded')
+                response = await self._http().request(
+                    method, path, json=json, headers=headers, timeout=remaining
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = GatewayUnavailable(f'Payment gateway returned {response.status_code}')
+            except httpx.TimeoutException:
+                error = GatewayUnavailable(f'Payment gateway timed out after {attempt + 1} attempt(s)')
+            except httpx.TransportError as e:
+                error = GatewayUnavailable(f'Payment gateway connection failed: {e}')
+
+            # Full jitter, and only if the wait still leaves time for a try
+            backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            attempt += 1
+            if attempt > self.retries or time.monotonic() + backoff >= deadline:
+                raise error
+            await asyncio.sleep(backoff)
+
+    async def create_session(self, payment):
+        """Start a hosted payment session; returns ``(session id, redirect url)``"""
+        data = await self.request(
+            'POST', '/v1/payment_sessions',
+            json={
+                'reference': payment.payment_id,
+                'amount': str(payment.total_amount),
+                'currency': settings.PAYMENT_GATEWAY_CURRENCY,
+            },
+            idempotency_key=payment.payment_id,
+        )
+        return data['id'], data['url']
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class _LoopThread:
+    """Event loop on a daemon thread, recreated after a fork"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name='payment-gateway', daemon=True).start()
+            return self._loop
+
+
+_loop_thread = _LoopThread()
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def run_sync(coro, timeout):
+    """Run ``coro`` on the gateway loop and wait at most ``timeout`` seconds"""
+    future = asyncio.run_coroutine_threadsafe(coro, _loop_thread.loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Not the builtin TimeoutError before Python 3.11
+        future.cancel()
+        raise GatewayUnavailable('Payment gateway call exceeded its deadline')
+
+
+def get_gateway():
+    """Process-wide gateway client, or None if no gateway is configured"""
+    global _gateway
+    if not settings.PAYMENT_GATEWAY_URL:
+        return None
+    with _gateway_lock:
+        if _gateway is None or _gateway.base_url != settings.PAYMENT_GATEWAY_URL.rstrip('/'):
+            _gateway = GatewayClient(
+                settings.PAYMENT_GATEWAY_URL,
+                api_key=settings.PAYMENT_GATEWAY_API_KEY,
+                timeout=settings.PAYMENT_GATEWAY_TIMEOUT,
+                retries=settings.PAYMENT_GATEWAY_RETRIES,
+                max_connections=settings.PAYMENT_GATEWAY_MAX_CONNECTIONS,
+                breaker_threshold=settings.PAYMENT_GATEWAY_BREAKER_THRESHOLD,
+                breaker_reset=settings.PAYMENT_GATEWAY_BREAKER_RESET,
+            )
+        return _gateway
+
+
+def create_session(payment):
+    """Blocking ``create_session`` for sync views, bounded by the call deadline"""
+    gateway = get_gateway()
+    # A little slack so the client's own deadline fires first
+    return run_sync(gateway.create_session(payment), gateway.timeout + 0.5)
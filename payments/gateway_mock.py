@@ -0,0 +1,90 @@
+"""
+Local stand-in for the payment gateway, for tests and load experiments.
+
+Implements ``POST /v1/payment_sessions`` with idempotency keys, and can add
+latency or fail a share of requests with 503 to exercise the client's
+deadlines, retries and circuit breaker.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGatewayHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive, so the client's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if self.path != '/v1/payment_sessions':
+            return self.send_json(404, {'error': 'not found'})
+        if server.rng.random() < server.failure_rate:
+            return self.send_json(503, {'error': 'unavailable'})
+        if 'amount' not in payload:
+            return self.send_json(400, {'error': 'amount is required'})
+
+        key = self.headers.get('Idempotency-Key') or uuid.uuid4().hex
+        with server.lock:
+            session = server.sessions.get(key)
+            if session is None:
+                session_id = f"sess_{uuid.uuid4().hex[:16]}"
+                session = {
+                    'id': session_id,
+                    'url': f"http://{server.server_address[0]}:{server.server_address[1]}/pay/{session_id}",
+                    'reference': payload.get('reference'),
+                    'amount': payload['amount'],
+                }
+                server.sessions[key] = session
+        self.send_json(200, session)
+
+
+class MockGatewayServer(ThreadingHTTPServer):
+    """Threaded mock gateway; use as a context manager to run it in the background"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=None):
+        super().__init__((host, port), MockGatewayHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.request_count = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
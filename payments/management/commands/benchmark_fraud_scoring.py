@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payments.fraud import RULES, batch_features, get_engine
+
+User = get_user_model()
+
+BROWSER_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request fraud scoring latency and batch scoring throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500,
+                            help='Per-request scores to time')
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help='Synthetic payments for the batch benchmark')
+        parser.add_argument('--rules', nargs='+', default=None,
+                            help='Rules to enable (defaults to PAYMENT_FRAUD_RULES)')
+        parser.add_argument('--all-rules', action='store_true',
+                            help='Enable every registered rule')
+
+    def handle(self, *args, **options):
+        rule_names = list(RULES) if options['all_rules'] else options['rules']
+        engine = get_engine(rule_names)
+        user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('Create at least one user to benchmark against.')
+
+        self.stdout.write(f"Rules: {', '.join(rule.name for rule in engine.rules)}")
+
+        timings = []
+        for i in range(options['iterations']):
+            started = time.perf_counter()
+            engine.score(user, f'10.0.{i % 256}.{i % 7}', BROWSER_UA, 25 + i % 1000)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"Per-request: p50 {statistics.median(timings):.3f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.3f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms "
+            f"over {len(timings)} scores"
+        )
+
+        size = options['batch_size']
+        now = timezone.now()
+        rows = [
+            (i % 5000, 10 + (i * 37) % 2000, f'10.{i % 200}.{i % 13}.1', BROWSER_UA if i % 50 else 'curl/8.0',
+             now - timezone.timedelta(seconds=i * 17))
+            for i in range(size)
+        ]
+        started = time.perf_counter()
+        features = batch_features(rows)
+        feature_time = time.perf_counter() - started
+        scores, _ = engine.score_batch(features)
+        total_time = time.perf_counter() - started
+        self.stdout.write(
+            f"Batch: {size} payments in {total_time * 1000:.1f} ms "
+            f"(features {feature_time * 1000:.1f} ms, {size / total_time:,.0f}/s), "
+            f"{int((scores > 0).sum())} with a non-zero score"
+        )
@@ -0,0 +1,62 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from payments.identifiers import new_identifier
+from payments.models import Order
+
+User = get_user_model()
+
+
+def random_order_number():
+    # Twelve hex characters like the old payment ids; the old eight character
+    # order numbers collide too often to insert this many rows
+    return f"ORD-{uuid.uuid4().hex[:12].upper()}"
+
+
+class Command(BaseCommand):
+    help = 'Compare order insert throughput with random and time-ordered order numbers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000,
+                            help='Orders to insert per scheme')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        customer = User.objects.order_by('id').first()
+        if customer is None:
+            raise CommandError('Create at least one user to benchmark against.')
+
+        started = time.perf_counter()
+        for _ in range(options['rows']):
+            new_identifier('ORD')
+        generate_time = time.perf_counter() - started
+        self.stdout.write(f"Generation: {options['rows'] / generate_time:,.0f} identifiers/s")
+
+        for label, make_number in [('random (uuid4)', random_order_number),
+                                   ('time-ordered', lambda: new_identifier('ORD'))]:
+            elapsed = self.insert(customer, make_number, options['rows'], options['batch_size'])
+            self.stdout.write(f"Insert {label}: {options['rows']} rows in {elapsed:.2f}s "
+                              f"({options['rows'] / elapsed:,.0f} rows/s)")
+
+    def insert(self, customer, make_number, rows, batch_size):
+        """Time bulk inserts of ``rows`` orders, rolled back afterwards"""
+        elapsed = 0.0
+        with transaction.atomic():
+            for offset in range(0, rows, batch_size):
+                orders = [
+                    Order(order_number=make_number(), customer=customer,
+                          total_amount=Decimal('10.00'), grand_total=Decimal('10.00'),
+                          shipping_address='benchmark', billing_address='benchmark')
+                    for _ in range(min(batch_size, rows - offset))
+                ]
+                started = time.perf_counter()
+                Order.objects.bulk_create(orders)
+                elapsed += time.perf_counter() - started
+            transaction.set_rollback(True)
+        return elapsed
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from payments.gateway_mock import MockGatewayServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local mock payment gateway (set PAYMENT_GATEWAY_URL to its address)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to wait before answering each request')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='Share of requests answered with 503')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = MockGatewayServer(
+            options['host'], options['port'],
+            latency=options['latency'], failure_rate=options['failure_rate'], seed=options['seed'],
+        )
+        self.stdout.write(f"Mock payment gateway listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply queued payment gateway webhook events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximum number of payments handled per pass')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep between polls when idle')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            applied = process_pending_events(limit=batch_size)
+            if applied:
+                self.stdout.write(f"Applied {applied} webhook event(s)")
+            if not options['loop']:
+                break
+            if not applied:
+                time.sleep(options['interval'])
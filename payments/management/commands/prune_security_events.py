@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from payments import audit
+
+
+class Command(BaseCommand):
+    help = 'Archive and drop PaymentSecurity partitions older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.PAYMENT_SECURITY_RETENTION_DAYS,
+                            help='Keep raw events newer than this many days')
+        parser.add_argument('--archive-dir', default=settings.PAYMENT_SECURITY_ARCHIVE_DIR,
+                            help='Directory for compressed JSONL archives')
+        parser.add_argument('--months-ahead', type=int, default=2,
+                            help='Future monthly partitions to create (PostgreSQL only)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the partitions that would be archived')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            for name in audit.ensure_partitions(options['months_ahead']):
+                self.stdout.write(f"Partition ready: {name}")
+
+        cutoff = timezone.now() - timezone.timedelta(days=options['retention_days'])
+        months = audit.expired_partitions(cutoff)
+        if not months:
+            self.stdout.write("No partitions past retention.")
+            return
+
+        for start in months:
+            if options['dry_run']:
+                self.stdout.write(f"Would archive {start:%Y-%m}")
+                continue
+            # The archive is written before anything is dropped, so a crash
+            # leaves the partition in place and the next run rewrites the file
+            path, count = audit.archive_partition(start, options['archive_dir'])
+            with transaction.atomic():
+                audit.drop_partition(start)
+            if path:
+                self.stdout.write(self.style.SUCCESS(f"Archived {count} event(s) from {start:%Y-%m} to {path}"))
+            else:
+                self.stdout.write(f"Dropped empty partition {start:%Y-%m}")
@@ -0,0 +1,71 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.reconciliation import reconcile_file
+
+
+class Command(BaseCommand):
+    help = 'Reconcile payments against a gateway settlement CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('settlement_file', help='Settlement CSV (optionally .gz)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Settlement rows joined per database lookup')
+        parser.add_argument('--id-column', default='transaction_id')
+        parser.add_argument('--amount-column', default='amount')
+        parser.add_argument('--status-column', default='status')
+        parser.add_argument('--report', default='',
+                            help='Write mismatched and unknown transactions to this CSV')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report mismatches without updating payments')
+
+    def handle(self, *args, **options):
+        columns = {
+            'id': options['id_column'],
+            'amount': options['amount_column'],
+            'status': options['status_column'],
+        }
+        report_file = open(options['report'], 'w', newline='') if options['report'] else None
+        on_mismatch = None
+        if report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(['transaction_id', 'issue', 'payment_status', 'settled_status',
+                             'payment_amount', 'settled_amount'])
+            on_mismatch = lambda *row: writer.writerow(row)
+
+        started = time.perf_counter()
+
+        def progress(result):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  {result.rows:,} rows ({result.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        try:
+            result = reconcile_file(
+                options['settlement_file'], columns,
+                chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'],
+                on_mismatch=on_mismatch,
+                on_progress=progress if options['verbosity'] > 1 else None,
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        finally:
+            if report_file:
+                report_file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Reconciled {result.rows:,} settlement rows in {elapsed:.2f}s "
+            f"({result.rows / max(elapsed, 1e-9):,.0f} rows/s)"
+        )
+        self.stdout.write(
+            f"  matched {result.matched:,}, unknown transactions {result.missing:,}, "
+            f"duplicate transactions {result.duplicates:,}, invalid rows {result.invalid:,}"
+        )
+        verb = 'would update' if options['dry_run'] else 'updated'
+        self.stdout.write(
+            f"  amount mismatches {result.amount_mismatches:,}, statuses {verb} {result.status_updates:,}, "
+            f"status corrections rejected {result.rejected:,}"
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from payments.payouts import run_payouts
+
+
+class Command(BaseCommand):
+    help = 'Allocate newly completed payments to seller payouts and take back refunded ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Maximum number of payments per payout batch')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            batches = run_payouts(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        except IntegrityError:
+            raise CommandError('Another payout run allocated the same order lines; try again.')
+        elapsed = time.perf_counter() - started
+
+        for batch in batches:
+            self.stdout.write(
+                f"Batch {batch.id}: {batch.payment_count} payments, "
+                f"{batch.item_count} items, ${batch.total_amount}, "
+                f"{batch.reversed_count} refunded items, -${batch.reversed_amount}"
+            )
+        self.stdout.write(f"Created {len(batches)} payout batch(es) in {elapsed:.2f}s")
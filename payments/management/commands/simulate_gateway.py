@@ -0,0 +1,100 @@
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import reverse
+
+from payments.models import Payment
+from payments.views import payment_webhook
+from payments.webhooks import process_pending_events, sign_payload
+
+
+class Command(BaseCommand):
+    help = 'Replay bursts of duplicate and out-of-order gateway webhooks against local payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('payment_ids', nargs='*',
+                            help='Payments to target (defaults to pending payments)')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Number of pending payments to target when none are given')
+        parser.add_argument('--duplicates', type=int, default=3,
+                            help='Times each event is delivered')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed for delivery order')
+        parser.add_argument('--url', default='',
+                            help='Base URL of a running server (in-process when omitted)')
+        parser.add_argument('--process', action='store_true',
+                            help='Run the webhook worker after delivery')
+
+    def handle(self, *args, **options):
+        payment_ids = options['payment_ids'] or list(
+            Payment.objects.filter(status='pending')
+            .values_list('payment_id', flat=True)[:options['limit']]
+        )
+        if not payment_ids:
+            raise CommandError('No payments to simulate against.')
+
+        rng = random.Random(options['seed'])
+        deliveries = []
+        for payment_id in payment_ids:
+            transaction_id = f"SIM-{uuid.uuid4().hex[:12].upper()}"
+            for sequence, status in enumerate(['processing', 'completed'], start=1):
+                event = {
+                    'event_id': f"evt_{uuid.uuid4().hex}",
+                    'sequence': sequence,
+                    'status': status,
+                    'transaction_id': transaction_id,
+                }
+                deliveries.extend([(payment_id, event)] * options['duplicates'])
+        rng.shuffle(deliveries)
+
+        counts = {'queued': 0, 'duplicate': 0, 'error': 0}
+        started = time.perf_counter()
+        for payment_id, event in deliveries:
+            result = self.deliver(options['url'], payment_id, json.dumps(event).encode())
+            counts[result] += 1
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Delivered {len(deliveries)} webhook(s) in {elapsed * 1000:.1f} ms "
+            f"({elapsed * 1000 / len(deliveries):.2f} ms avg): "
+            f"{counts['queued']} queued, {counts['duplicate']} duplicate, {counts['error']} error"
+        )
+
+        if options['process']:
+            applied = process_pending_events(limit=len(payment_ids))
+            self.stdout.write(f"Applied {applied} webhook event(s)")
+            for payment in Payment.objects.filter(payment_id__in=payment_ids):
+                self.stdout.write(f"  {payment.payment_id}: {payment.status}")
+
+    def deliver(self, base_url, payment_id, body):
+        """Send one webhook and classify the response"""
+        path = reverse('payments:webhook', args=[payment_id])
+        headers = {'X-Webhook-Signature': sign_payload(body)}
+
+        if base_url:
+            request = urllib.request.Request(
+                base_url.rstrip('/') + path, data=body, method='POST',
+                headers={'Content-Type': 'application/json', **headers},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    data = json.loads(response.read())
+            except (urllib.error.URLError, ValueError):
+                return 'error'
+        else:
+            request = RequestFactory().post(
+                path, data=body, content_type='application/json',
+                HTTP_X_WEBHOOK_SIGNATURE=headers['X-Webhook-Signature'],
+            )
+            response = payment_webhook(request, payment_id)
+            if response.status_code != 200:
+                return 'error'
+            data = json.loads(response.content)
+
+        return 'duplicate' if data.get('duplicate') else 'queued'
@@ -0,0 +1,108 @@
+import csv
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ImproperlyConfigured
+
+from payments.models import Payment
+from payments.signing import LEGACY, LEGACY_FIELDS, SIGNED_FIELDS, VALID, check_chunk, get_keys, get_signer
+
+
+class Command(BaseCommand):
+    help = 'Verify the HMAC signature of every payment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Payments per database fetch and per worker task')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Worker processes (1 verifies in this process)')
+        parser.add_argument('--report', default='',
+                            help='Write payments that fail verification to this CSV')
+        parser.add_argument('--sign-legacy', action='store_true',
+                            help='Sign payments whose pre-signing hash still verifies')
+
+    def handle(self, *args, **options):
+        try:
+            keys, key_id = get_keys()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        rows = (
+            Payment.objects.order_by('id')
+            .values_list('id', *SIGNED_FIELDS, *LEGACY_FIELDS, 'security_hash')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        chunks = iter(lambda: list(islice(rows, options['chunk_size'])), [])
+
+        report_file = open(options['report'], 'w', newline='') if options['report'] else None
+        writer = csv.writer(report_file) if report_file else None
+        if writer:
+            writer.writerow(['id', 'result'])
+
+        totals = {}
+        legacy_ids = []
+        started = time.perf_counter()
+        try:
+            for counts, failures in self.verify(chunks, keys, key_id, options['workers']):
+                for result, count in counts.items():
+                    totals[result] = totals.get(result, 0) + count
+                for pk, result in failures:
+                    if writer:
+                        writer.writerow([pk, result])
+                    if result == LEGACY:
+                        legacy_ids.append(pk)
+        finally:
+            if report_file:
+                report_file.close()
+        elapsed = time.perf_counter() - started
+
+        checked = sum(totals.values())
+        self.stdout.write(
+            f"Checked {checked:,} payments in {elapsed:.2f}s ({checked / max(elapsed, 1e-9):,.0f}/s)"
+        )
+        for result, count in sorted(totals.items()):
+            self.stdout.write(f"  {result}: {count:,}")
+
+        if options['sign_legacy'] and legacy_ids:
+            signed = self.sign(legacy_ids, options['chunk_size'])
+            self.stdout.write(f"Signed {signed:,} legacy payments")
+
+        if totals.get(VALID, 0) + totals.get(LEGACY, 0) < checked:
+            raise CommandError('Some payments failed signature verification.')
+
+    def verify(self, chunks, keys, key_id, workers):
+        """Results per chunk, keeping at most two chunks per worker in flight"""
+        if workers <= 1:
+            for chunk in chunks:
+                yield check_chunk(chunk, keys, key_id)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(check_chunk, chunk, keys, key_id))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def sign(self, ids, chunk_size):
+        """Sign legacy payments, checking their old hash again as they are read"""
+        signer = get_signer()
+        signed = 0
+        signed_end = 1 + len(SIGNED_FIELDS)
+        for start in range(0, len(ids), chunk_size):
+            rows = Payment.objects.filter(id__in=ids[start:start + chunk_size]).values_list(
+                'id', *SIGNED_FIELDS, *LEGACY_FIELDS, 'security_hash'
+            )
+            payments = [
+                Payment(id=row[0], security_hash=signer.sign(row[1:signed_end]))
+                for row in rows
+                if signer.check(row[1:signed_end], row[-1], row[signed_end:-1]) == LEGACY
+            ]
+            Payment.objects.bulk_update(payments, ['security_hash'])
+            signed += len(payments)
+        return signed
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_order_summary(apps, schema_editor):
+    Order = apps.get_model('payments', 'Order')
+    OrderItem = apps.get_model('payments', 'OrderItem')
+
+    summaries = {}
+    items = OrderItem.objects.order_by('order_id', 'id').values_list('order_id', 'product__image')
+    for order_id, image in items.iterator(chunk_size=2000):
+        summary = summaries.setdefault(order_id, [0, image or ''])
+        summary[0] += 1
+
+    batch = []
+    for order in Order.objects.filter(id__in=summaries).only('id').iterator(chunk_size=2000):
+        order.item_count, order.thumbnail = summaries[order.id]
+        batch.append(order)
+        if len(batch) >= 500:
+            Order.objects.bulk_update(batch, ['item_count', 'thumbnail'])
+            batch = []
+    Order.objects.bulk_update(batch, ['item_count', 'thumbnail'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_webhookevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-created_at', '-id'], name='payments_order_history_idx'),
+        ),
+        migrations.RunPython(backfill_order_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncHour
+
+
+def backfill_rollups_and_blocks(apps, schema_editor):
+    PaymentSecurity = apps.get_model('payments', 'PaymentSecurity')
+    PaymentSecurityRollup = apps.get_model('payments', 'PaymentSecurityRollup')
+    BlockedIP = apps.get_model('payments', 'BlockedIP')
+
+    blocked = PaymentSecurity.objects.filter(is_blocked=True).values_list('ip_address', flat=True).distinct()
+    BlockedIP.objects.bulk_create(
+        [BlockedIP(ip_address=ip) for ip in blocked.iterator()],
+        ignore_conflicts=True,
+    )
+
+    rollups = (
+        PaymentSecurity.objects.annotate(hour=TruncHour('created_at'))
+        .values('hour', 'event_type', 'user_id', 'ip_address')
+        .annotate(
+            event_count=Count('id'),
+            risk_score_total=Sum('risk_score'),
+            max_risk_score=Max('risk_score'),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rollups.iterator():
+        batch.append(PaymentSecurityRollup(**row))
+        if len(batch) >= 1000:
+            PaymentSecurityRollup.objects.bulk_create(batch)
+            batch = []
+    PaymentSecurityRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_order_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(unique=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('blocked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Blocked IP',
+                'ordering': ['-blocked_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentSecurityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('event_type', models.CharField(choices=[('payment_attempt', 'Payment Attempt'), ('fraud_detection', 'Fraud Detection'), ('suspicious_activity', 'Suspicious Activity'), ('rate_limit_exceeded', 'Rate Limit Exceeded'), ('ip_blocked', 'IP Blocked')], max_length=30)),
+                ('ip_address', models.GenericIPAddressField()),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('risk_score_total', models.IntegerField(default=0)),
+                ('max_risk_score', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paymentsecurity',
+            index=models.Index(fields=['user', 'event_type', 'created_at'], name='payments_security_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentsecurity',
+            index=models.Index(fields=['created_at'], name='payments_security_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentsecurityrollup',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='paymentsecurityrollup',
+            index=models.Index(fields=['user', 'event_type', 'hour'], name='payments_rollup_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentsecurityrollup',
+            index=models.Index(fields=['ip_address', 'hour'], name='payments_rollup_ip_idx'),
+        ),
+        migrations.RunPython(backfill_rollups_and_blocks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+"""
+Convert payments_paymentsecurity into a PostgreSQL table range-partitioned by
+month on created_at. Other databases keep the plain table; payments.audit
+treats each month as a logical partition there.
+"""
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = 'payments_paymentsecurity'
+LEGACY = f'{TABLE}_legacy'
+SEQUENCE = f'{TABLE}_id_seq'
+MONTHS_AHEAD = 2
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        # Remember secondary indexes and foreign keys so they keep their names
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE tablename = %s AND indexname <> %s",
+            [TABLE, f'{TABLE}_pkey'],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        legacy_sequence = cursor.fetchone()[0]
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY}')
+        cursor.execute(f'ALTER INDEX {TABLE}_pkey RENAME TO {LEGACY}_pkey')
+        if legacy_sequence:
+            cursor.execute(f'ALTER SEQUENCE {legacy_sequence} RENAME TO {LEGACY}_id_seq')
+
+        # The partition key must be part of the primary key, and identity
+        # columns are not allowed on partitioned tables before PostgreSQL 17
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, created_at)')
+
+        cursor.execute(f'SELECT min(created_at) FROM {LEGACY}')
+        oldest = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        start = (oldest or now).astimezone(timezone.utc)
+        month = datetime(start.year, start.month, 1, tzinfo=timezone.utc)
+        last = add_months(datetime(now.year, now.month, 1, tzinfo=timezone.utc), MONTHS_AHEAD)
+        while month <= last:
+            upper = add_months(month, 1)
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [month, upper],
+            )
+            month = upper
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {LEGACY}')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE(max(id), 0) + 1, false) FROM {TABLE}")
+        cursor.execute(f'DROP TABLE {LEGACY}')
+
+        # Definitions were read before the rename, so they target the new table
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_security_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum, FloatField
+from django.db.models.functions import Cast
+
+
+def backfill_payment_stats(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    UserPaymentStats = apps.get_model('payments', 'UserPaymentStats')
+
+    amount = Cast('amount', FloatField())
+    rows = (
+        Payment.objects.values('customer_id')
+        .annotate(
+            payment_count=Count('id'),
+            amount_sum=Sum(amount),
+            amount_sq_sum=Sum(amount * amount),
+            last_payment_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    UserPaymentStats.objects.bulk_create(
+        [
+            UserPaymentStats(
+                user_id=row['customer_id'],
+                payment_count=row['payment_count'],
+                amount_sum=row['amount_sum'] or 0,
+                amount_sq_sum=row['amount_sq_sum'] or 0,
+                last_payment_at=row['last_payment_at'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_partition_paymentsecurity'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPaymentStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payment_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('payment_count', models.PositiveIntegerField(default=0)),
+                ('amount_sum', models.FloatField(default=0)),
+                ('amount_sq_sum', models.FloatField(default=0)),
+                ('last_payment_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'User payment stats',
+            },
+        ),
+        migrations.RunPython(backfill_payment_stats, migrations.RunPython.noop),
+    ]
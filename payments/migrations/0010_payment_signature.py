@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_order_number_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='security_hash',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:25
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_initial'),
+        ('payments', '0010_payment_signature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('shipping', 'Shipping'), ('tax', 'Tax')], max_length=10)),
+                ('region', models.CharField(blank=True, help_text='Buyer location; blank matches any', max_length=100)),
+                ('rate', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text="Percentage of the matching lines' subtotal", max_digits=5, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))])),
+                ('fixed_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Charged once per order', max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.00'))])),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Blank matches any category', null=True, on_delete=django.db.models.deletion.CASCADE, to='marketplace.category')),
+            ],
+            options={
+                'ordering': ['kind', 'region'],
+            },
+        ),
+    ]
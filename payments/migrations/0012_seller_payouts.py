@@ -0,0 +1,99 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:28
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_pricingrule'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PayoutBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_count', models.PositiveIntegerField(default=0)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('watermark_updated_at', models.DateTimeField()),
+                ('watermark_payment_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Payout batches',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SellerBalance',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seller_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_earned', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SellerPayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('item_count', models.PositiveIntegerField()),
+            ],
+            options={
+                'ordering': ['-batch_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'updated_at', 'id'], name='payments_payment_payout_idx'),
+        ),
+        migrations.AddField(
+            model_name='payoutallocation',
+            name='order_item',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payout_allocation', to='payments.orderitem'),
+        ),
+        migrations.AddField(
+            model_name='payoutallocation',
+            name='payment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payout_allocations', to='payments.payment'),
+        ),
+        migrations.AddField(
+            model_name='sellerbalance',
+            name='last_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.payoutbatch'),
+        ),
+        migrations.AddField(
+            model_name='sellerpayout',
+            name='batch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to='payments.payoutbatch'),
+        ),
+        migrations.AddField(
+            model_name='sellerpayout',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='payoutallocation',
+            name='payout',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='payments.sellerpayout'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerpayout',
+            constraint=models.UniqueConstraint(fields=('batch', 'seller'), name='payments_sellerpayout_batch_seller_uniq'),
+        ),
+    ]
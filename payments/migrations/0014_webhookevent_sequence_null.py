@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_order_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
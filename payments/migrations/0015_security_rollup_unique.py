@@ -0,0 +1,52 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    PaymentSecurityRollup = apps.get_model('payments', 'PaymentSecurityRollup')
+    duplicates = (
+        PaymentSecurityRollup.objects.values('hour', 'event_type', 'user_id', 'ip_address')
+        .annotate(
+            rows=Count('id'),
+            keep=Min('id'),
+            event_count_sum=Sum('event_count'),
+            risk_score_sum=Sum('risk_score_total'),
+            max_risk=Max('max_risk_score'),
+        )
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for bucket in duplicates.iterator():
+        rows = PaymentSecurityRollup.objects.filter(
+            hour=bucket['hour'], event_type=bucket['event_type'],
+            user_id=bucket['user_id'], ip_address=bucket['ip_address'],
+        )
+        rows.filter(id=bucket['keep']).update(
+            event_count=bucket['event_count_sum'],
+            risk_score_total=bucket['risk_score_sum'],
+            max_risk_score=bucket['max_risk'],
+        )
+        rows.exclude(id=bucket['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0014_webhookevent_sequence_null'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='paymentsecurityrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('hour', 'event_type', 'user', 'ip_address'), name='payments_rollup_bucket_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentsecurityrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('hour', 'event_type', 'ip_address'), name='payments_rollup_anon_bucket_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-19 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0015_security_rollup_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderstatushistory',
+            index=models.Index(fields=['created_at', 'id'], name='payments_history_created_idx'),
+        ),
+    ]
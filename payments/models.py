@@ -2,7 +2,9 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from decimal import Decimal
-import uuid
+
+from .identifiers import new_identifier
+from .signing import sign_payment
 
 class PaymentMethod(models.Model):
     """Available payment methods"""
@@ -59,6 +61,42 @@ class PaymentMethod(models.Model):
         total_fee = percentage_fee + self.processing_fee_fixed
         return total_fee
 
+class PricingRule(models.Model):
+    """Shipping or tax rule for a buyer region and product category"""
+    KINDS = [
+        ('shipping', 'Shipping'),
+        ('tax', 'Tax'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KINDS)
+    region = models.CharField(max_length=100, blank=True, help_text='Buyer location; blank matches any')
+    category = models.ForeignKey('marketplace.Category', on_delete=models.CASCADE, null=True, blank=True,
+                                 help_text='Blank matches any category')
+    rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        validators=[MinValueValidator(Decimal('0.00'))],
+        help_text='Percentage of the matching lines\' subtotal'
+    )
+    fixed_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        validators=[MinValueValidator(Decimal('0.00'))],
+        help_text='Charged once per order'
+    )
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['kind', 'region']
+    
+    def __str__(self):
+        scope = ' / '.join(filter(None, [self.region, self.category.name if self.category else ''])) or 'default'
+        return f"{self.get_kind_display()}: {scope}"
+
 class Order(models.Model):
     """Customer orders"""
     ORDER_STATUS = [
@@ -71,7 +109,7 @@ class Order(models.Model):
         ('refunded', 'Refunded'),
     ]
     
-    order_number = models.CharField(max_length=20, unique=True)
+    order_number = models.CharField(max_length=32, unique=True)
     customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
@@ -81,15 +119,30 @@ class Order(models.Model):
     shipping_address = models.TextField()
     billing_address = models.TextField()
     notes = models.TextField(blank=True)
+    # Summary precomputed at creation for the order history page
+    item_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', '-created_at', '-id'], name='payments_order_history_idx'),
+            # Date-range scans by finance exports and the admin date filter
+            models.Index(fields=['created_at', 'id'], name='payments_order_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number} - {self.customer.username}"
     
+    @staticmethod
+    def summarize_items(products):
+        """Item count and thumbnail for a list of ordered products"""
+        first = products[0] if products else None
+        thumbnail = first.image.name if first and first.image else ''
+        return {'item_count': len(products), 'thumbnail': thumbnail}
+    
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = self.generate_order_number()
@@ -97,13 +150,33 @@ class Order(models.Model):
     
     def generate_order_number(self):
         """Generate unique order number"""
-        return f"ORD-{uuid.uuid4().hex[:8].upper()}"
+        return new_identifier('ORD')
     
     @property
     def total_with_fees(self):
         """Total including all fees"""
         return self.grand_total
 
+class OrderStatusHistory(models.Model):
+    """Audit trail of order status transitions"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_history')
+    from_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    to_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = 'Order status history'
+        indexes = [
+            # Watermark scans by the insights sales tables
+            models.Index(fields=['created_at', 'id'], name='payments_history_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status} -> {self.to_status}"
+
 class OrderItem(models.Model):
     """Individual items in an order"""
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -139,9 +212,9 @@ class Payment(models.Model):
     processing_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
-    transaction_id = models.CharField(max_length=100, blank=True)
+    transaction_id = models.CharField(max_length=100, blank=True, db_index=True)
     gateway_response = models.JSONField(default=dict)
-    security_hash = models.CharField(max_length=64, blank=True)
+    security_hash = models.CharField(max_length=100, blank=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -149,6 +222,10 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Incremental scans of newly completed payments by the payout job
+            models.Index(fields=['status', 'updated_at', 'id'], name='payments_payment_payout_idx'),
+        ]
     
     def __str__(self):
         return f"Payment {self.payment_id} - {self.customer.username}"
@@ -158,17 +235,17 @@ class Payment(models.Model):
             self.payment_id = self.generate_payment_id()
         if not self.total_amount:
             self.total_amount = self.amount + self.processing_fee
+        if not self.security_hash:
+            self.security_hash = self.generate_security_hash()
         super().save(*args, **kwargs)
     
     def generate_payment_id(self):
         """Generate unique payment ID"""
-        return f"PAY-{uuid.uuid4().hex[:12].upper()}"
+        return new_identifier('PAY')
     
     def generate_security_hash(self):
-        """Generate security hash for payment validation"""
-        import hashlib
-        data = f"{self.payment_id}{self.order.order_number}{self.customer.id}{self.amount}"
-        return hashlib.sha256(data.encode()).hexdigest()
+        """HMAC signature of the payment's immutable values"""
+        return sign_payment(self)
 
 class UserBalance(models.Model):
     """User account balance for internal payments"""
@@ -197,6 +274,32 @@ class UserBalance(models.Model):
         self.amount += amount
         self.save()
 
+class UserPaymentStats(models.Model):
+    """Running payment aggregates per customer, used for fraud features"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='payment_stats')
+    payment_count = models.PositiveIntegerField(default=0)
+    amount_sum = models.FloatField(default=0)
+    amount_sq_sum = models.FloatField(default=0)
+    last_payment_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name_plural = 'User payment stats'
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.payment_count} payments"
+    
+    @property
+    def mean_amount(self):
+        return self.amount_sum / self.payment_count if self.payment_count else 0.0
+    
+    @property
+    def amount_std(self):
+        """Population standard deviation of payment amounts"""
+        if self.payment_count < 2:
+            return 0.0
+        variance = self.amount_sq_sum / self.payment_count - self.mean_amount ** 2
+        return max(variance, 0.0) ** 0.5
+
 class PaymentSecurity(models.Model):
     """Security settings and audit logs"""
     SECURITY_EVENT_TYPES = [
@@ -218,6 +321,144 @@ class PaymentSecurity(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'event_type', 'created_at'], name='payments_security_user_idx'),
+            models.Index(fields=['created_at'], name='payments_security_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.event_type} - {self.ip_address} at {self.created_at}"
+
+class PaymentSecurityRollup(models.Model):
+    """Hourly security event counts per user and IP address"""
+    hour = models.DateTimeField()
+    event_type = models.CharField(max_length=30, choices=PaymentSecurity.SECURITY_EVENT_TYPES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    ip_address = models.GenericIPAddressField()
+    event_count = models.PositiveIntegerField(default=0)
+    risk_score_total = models.IntegerField(default=0)
+    max_risk_score = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-hour']
+        indexes = [
+            models.Index(fields=['user', 'event_type', 'hour'], name='payments_rollup_user_idx'),
+            models.Index(fields=['ip_address', 'hour'], name='payments_rollup_ip_idx'),
+        ]
+        constraints = [
+            # NULLs never collide in a unique index, so anonymous rows get their own
+            models.UniqueConstraint(
+                fields=['hour', 'event_type', 'user', 'ip_address'],
+                condition=models.Q(user__isnull=False),
+                name='payments_rollup_bucket_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['hour', 'event_type', 'ip_address'],
+                condition=models.Q(user__isnull=True),
+                name='payments_rollup_anon_bucket_uniq',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} x{self.event_count} - {self.ip_address} at {self.hour}"
+
+class BlockedIP(models.Model):
+    """IP addresses blocked from making payments"""
+    ip_address = models.GenericIPAddressField(unique=True)
+    reason = models.CharField(max_length=200, blank=True)
+    blocked_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Blocked IP'
+        ordering = ['-blocked_at']
+    
+    def __str__(self):
+        return self.ip_address
+
+class WebhookEvent(models.Model):
+    """Inbound payment gateway events queued for processing"""
+    EVENT_STATUS = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_id = models.CharField(max_length=100, unique=True)
+    payment_id = models.CharField(max_length=50)
+    sequence = models.BigIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=EVENT_STATUS, default='pending')
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['payment_id', 'sequence', 'received_at']
+        indexes = [
+            models.Index(fields=['status', 'payment_id', 'sequence']),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_id} for {self.payment_id} ({self.status})"
+
+class PayoutBatch(models.Model):
+    """One run of the seller payout job"""
+    payment_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Allocations taken back because their payment was refunded after payout
+    reversed_count = models.PositiveIntegerField(default=0)
+    reversed_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Position in (updated_at, id) order of the last completed payment included
+    watermark_updated_at = models.DateTimeField()
+    watermark_payment_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-id']
+        verbose_name_plural = 'Payout batches'
+    
+    def __str__(self):
+        return f"Payout batch {self.id} - ${self.total_amount}"
+
+class SellerPayout(models.Model):
+    """Amount owed to one seller from one payout batch"""
+    batch = models.ForeignKey(PayoutBatch, on_delete=models.CASCADE, related_name='payouts')
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payouts')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    reversed_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    reversed_item_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-batch_id']
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'seller'], name='payments_sellerpayout_batch_seller_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.seller_id} - ${self.amount} (batch {self.batch_id})"
+
+class PayoutAllocation(models.Model):
+    """Order line paid out to its seller; each line is allocated once"""
+    payout = models.ForeignKey(SellerPayout, on_delete=models.CASCADE, related_name='allocations')
+    order_item = models.OneToOneField(OrderItem, on_delete=models.CASCADE, related_name='payout_allocation')
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='payout_allocations')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Batch that took the amount back after the payment was refunded
+    reversed_in = models.ForeignKey(PayoutBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='reversals')
+    
+    def __str__(self):
+        return f"Item {self.order_item_id} - ${self.amount}"
+
+class SellerBalance(models.Model):
+    """Running payout totals per seller, updated by each payout batch"""
+    seller = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='seller_balance')
+    total_earned = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    item_count = models.PositiveIntegerField(default=0)
+    last_batch = models.ForeignKey(PayoutBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.seller_id} - ${self.total_earned}"
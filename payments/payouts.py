@@ -0,0 +1,168 @@
+"""
+Seller payouts.
+
+Each run takes completed payments past the watermark of the previous
+``PayoutBatch``, in ``(updated_at, id)`` order, and allocates their order
+lines to the product sellers. The batch, the per-seller ``SellerPayout``
+rows, the per-line ``PayoutAllocation`` rows, the ``SellerBalance`` totals
+and the new watermark are written in one transaction, so a crash leaves the
+previous watermark in place and the next run redoes the batch. An order line
+can only be allocated once, which also stops two concurrent runs from paying
+the same line twice.
+
+``updated_at`` moves whenever a payment is saved, so an already paid out
+payment can come past the watermark again. Its lines are allocated already,
+so it adds nothing, and ``PayoutBatch.payment_count`` only counts payments
+that received allocations in the batch.
+
+A payment refunded after it was paid out is taken back by the next run: its
+allocations are marked ``reversed_in`` that batch, and their amounts are
+recorded as ``reversed_amount`` on the seller payouts and subtracted from
+``SellerBalance``. Orders cancelled or refunded while their payment stays
+completed are not reversed.
+
+Payments are only picked up once they are ``PAYOUT_SETTLE_DELAY`` seconds
+old, so transactions still in flight when a run starts are not skipped.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    OrderItem, Payment, PayoutAllocation, PayoutBatch, SellerBalance, SellerPayout
+)
+
+
+def get_watermark():
+    """``(updated_at, payment id)`` of the last payment paid out, or None"""
+    batch = PayoutBatch.objects.order_by('-id').only('watermark_updated_at', 'watermark_payment_id').first()
+    if batch is None:
+        return None
+    return batch.watermark_updated_at, batch.watermark_payment_id
+
+
+def pending_payments(watermark, cutoff):
+    """Completed payments after ``watermark`` and settled before ``cutoff``"""
+    payments = Payment.objects.filter(status='completed', updated_at__lte=cutoff)
+    if watermark is not None:
+        updated_at, payment_id = watermark
+        payments = payments.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=payment_id)
+        )
+    return payments.order_by('updated_at', 'id')
+
+
+def refunded_allocations():
+    """Allocations paid out for payments that have since been refunded"""
+    return PayoutAllocation.objects.filter(payment__status='refunded', reversed_in__isnull=True)
+
+
+def run_payout_batch(limit=1000, now=None):
+    """
+    Pay out up to ``limit`` newly completed payments and take back up to
+    ``limit`` allocations of refunded ones.
+
+    Returns the new ``PayoutBatch``, or None when there is nothing to do.
+    """
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=settings.PAYOUT_SETTLE_DELAY)
+    with transaction.atomic():
+        watermark = get_watermark()
+        payments = list(
+            pending_payments(watermark, cutoff).values_list('id', 'order_id', 'updated_at')[:limit]
+        )
+        reversals = list(
+            refunded_allocations().select_for_update(of=('self',))
+            .order_by('id').values_list('id', 'payout__seller_id', 'amount')[:limit]
+        )
+        if not payments and not reversals:
+            return None
+        if payments:
+            watermark = payments[-1][2], payments[-1][0]
+
+        payment_for_order = {order_id: payment_id for payment_id, order_id, _ in payments}
+        items = OrderItem.objects.filter(order_id__in=payment_for_order, payout_allocation__isnull=True)
+        rows = list(items.values_list('id', 'order_id', 'product__seller_id', 'total_price'))
+
+        earned = {}
+        for _, _, seller_id, amount in rows:
+            total, count = earned.get(seller_id, (Decimal('0.00'), 0))
+            earned[seller_id] = total + amount, count + 1
+        reversed_by_seller = {}
+        for _, seller_id, amount in reversals:
+            total, count = reversed_by_seller.get(seller_id, (Decimal('0.00'), 0))
+            reversed_by_seller[seller_id] = total + amount, count + 1
+
+        batch = PayoutBatch.objects.create(
+            payment_count=len({payment_for_order[order_id] for _, order_id, _, _ in rows}),
+            item_count=len(rows),
+            total_amount=sum((amount for amount, _ in earned.values()), Decimal('0.00')),
+            reversed_count=len(reversals),
+            reversed_amount=sum((amount for amount, _ in reversed_by_seller.values()), Decimal('0.00')),
+            watermark_updated_at=watermark[0],
+            watermark_payment_id=watermark[1],
+        )
+        if not earned and not reversed_by_seller:
+            return batch
+
+        no_change = (Decimal('0.00'), 0)
+        payouts = SellerPayout.objects.bulk_create([
+            SellerPayout(
+                batch=batch, seller_id=seller_id,
+                amount=earned.get(seller_id, no_change)[0],
+                item_count=earned.get(seller_id, no_change)[1],
+                reversed_amount=reversed_by_seller.get(seller_id, no_change)[0],
+                reversed_item_count=reversed_by_seller.get(seller_id, no_change)[1],
+            )
+            for seller_id in sorted(earned.keys() | reversed_by_seller.keys())
+        ])
+        payout_for_seller = {payout.seller_id: payout for payout in payouts}
+        PayoutAllocation.objects.bulk_create([
+            PayoutAllocation(
+                payout=payout_for_seller[seller_id],
+                order_item_id=item_id,
+                payment_id=payment_for_order[order_id],
+                amount=amount,
+            )
+            for item_id, order_id, seller_id, amount in rows
+        ], batch_size=1000)
+        if reversals:
+            PayoutAllocation.objects.filter(id__in=[row[0] for row in reversals]).update(reversed_in=batch)
+        update_balances(payouts, batch)
+    return batch
+
+
+def update_balances(payouts, batch):
+    """Fold a batch's seller payouts, less reversals, into the running ``SellerBalance`` rows"""
+    seller_ids = [payout.seller_id for payout in payouts]
+    balances = SellerBalance.objects.select_for_update().in_bulk(seller_ids)
+    new_balances = []
+    for payout in payouts:
+        amount = payout.amount - payout.reversed_amount
+        item_count = payout.item_count - payout.reversed_item_count
+        balance = balances.get(payout.seller_id)
+        if balance is None:
+            new_balances.append(SellerBalance(
+                seller_id=payout.seller_id, total_earned=amount,
+                item_count=item_count, last_batch=batch,
+            ))
+            continue
+        balance.total_earned += amount
+        balance.item_count += item_count
+        balance.last_batch = batch
+        balance.updated_at = batch.created_at
+    SellerBalance.objects.bulk_update(balances.values(), ['total_earned', 'item_count', 'last_batch', 'updated_at'])
+    SellerBalance.objects.bulk_create(new_balances)
+
+
+def run_payouts(batch_size=1000, max_batches=None, now=None):
+    """Run payout batches until caught up; returns the batches created"""
+    batches = []
+    while max_batches is None or len(batches) < max_batches:
+        batch = run_payout_batch(limit=batch_size, now=now)
+        if batch is None:
+            break
+        batches.append(batch)
+    return batches
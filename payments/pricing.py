@@ -0,0 +1,162 @@
+"""
+Checkout pricing.
+
+Shipping and tax come from active ``PricingRule`` rows, kept in memory per
+worker as a rule table and reloaded the same way as the payment method
+catalog: saving or deleting a rule bumps a version key in the shared cache,
+which workers check at most every ``PAYMENT_PRICING_RULES_CHECK_INTERVAL``
+seconds.
+
+For each line the most specific rule of each kind applies: region and
+category, then category, then region, then the default. Rates apply to the
+line subtotal and the largest fixed amount matching a line that costs
+something is charged once per order. Shipping and tax are rounded half up
+to cents. Without a default rule in the table, ``PAYMENT_DEFAULT_SHIPPING_FEE``
+and ``PAYMENT_DEFAULT_TAX_RATE`` are used.
+
+Cart quotes are memoized in the shared cache per cart version, so the cart
+page, the checkout page and order creation reuse one computed quote.
+"""
+import threading
+import time
+import uuid
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PricingRule
+
+VERSION_KEY = 'payments:pricing_rules_version'
+QUOTE_TIMEOUT = 3600  # seconds
+CENT = Decimal('0.01')
+KINDS = ('shipping', 'tax')
+
+_lock = threading.Lock()
+_table = None
+
+
+class Quote:
+    """Priced cart: per-line totals plus subtotal, shipping, tax and total"""
+
+    def __init__(self, lines, subtotal, shipping, tax):
+        self.lines = lines  # {product_id: (quantity, unit_price, line_total)}
+        self.subtotal = subtotal
+        self.shipping = shipping
+        self.tax = tax
+        self.total = subtotal + shipping + tax
+
+    def matches(self, items):
+        """Whether ``items`` (product, quantity) pairs are what was quoted"""
+        items = list(items)
+        return len(items) == len(self.lines) and all(
+            self.lines.get(product.id, (None, None))[:2] == (quantity, product.price)
+            for product, quantity in items
+        )
+
+
+class RuleTable:
+    """Active pricing rules keyed by (kind, region, category id)"""
+
+    def __init__(self, rules, version):
+        self.version = version
+        self.rules = {}
+        for rule in rules:
+            key = (rule.kind, rule.region.strip().lower(), rule.category_id)
+            self.rules[key] = (rule.rate / Decimal('100'), rule.fixed_amount)
+        self.rules.setdefault(('shipping', '', None), (Decimal('0'), settings.PAYMENT_DEFAULT_SHIPPING_FEE))
+        self.rules.setdefault(('tax', '', None), (settings.PAYMENT_DEFAULT_TAX_RATE / Decimal('100'), Decimal('0')))
+        self.checked_at = time.monotonic()
+
+    def match(self, kind, region, category_id):
+        rules = self.rules
+        return (
+            rules.get((kind, region, category_id))
+            or rules.get((kind, '', category_id))
+            or rules.get((kind, region, None))
+            or rules[(kind, '', None)]
+        )
+
+    def price(self, lines, region=''):
+        """
+        Price ``(product_id, category_id, unit_price, quantity)`` lines in
+        one pass.
+        """
+        region = (region or '').strip().lower()
+        priced = {}
+        subtotal = Decimal('0')
+        charges = {kind: Decimal('0') for kind in KINDS}
+        fixed = {kind: Decimal('0') for kind in KINDS}
+        for product_id, category_id, unit_price, quantity in lines:
+            line_total = unit_price * quantity
+            priced[product_id] = (quantity, unit_price, line_total)
+            subtotal += line_total
+            for kind in KINDS:
+                rate, amount = self.match(kind, region, category_id)
+                charges[kind] += line_total * rate
+                if line_total > 0:
+                    # Free lines never add a fixed charge, so a free order ships free
+                    fixed[kind] = max(fixed[kind], amount)
+        if not priced:
+            return Quote(priced, subtotal, Decimal('0'), Decimal('0'))
+        shipping, tax = (
+            (charges[kind] + fixed[kind]).quantize(CENT, rounding=ROUND_HALF_UP) for kind in KINDS
+        )
+        return Quote(priced, subtotal, shipping, tax)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def get_rule_table():
+    """Return the current rule table, reloading it if an admin changed a rule"""
+    global _table
+    table = _table
+    interval = settings.PAYMENT_PRICING_RULES_CHECK_INTERVAL
+    if table is not None and time.monotonic() - table.checked_at < interval:
+        return table
+
+    with _lock:
+        table = _table
+        version = _current_version()
+        if table is not None and table.version == version:
+            table.checked_at = time.monotonic()
+            return table
+        table = RuleTable(PricingRule.objects.filter(is_active=True), version)
+        _table = table
+        return table
+
+
+def invalidate_rules():
+    """Drop this worker's rule table and tell other workers to reload theirs"""
+    global _table
+    with _lock:
+        _table = None
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def quote_items(items, region=''):
+    """Quote ``(product, quantity)`` pairs, e.g. a Buy Now or session cart"""
+    return get_rule_table().price(
+        ((product.id, product.category_id, product.price, quantity) for product, quantity in items),
+        region,
+    )
+
+
+def quote_cart(cart, region=''):
+    """Quote a saved cart, reusing the cached quote for its current version"""
+    table = get_rule_table()
+    region = (region or '').strip().lower()
+    key = f"payments:quote:{cart.id}:{cart.version}:{table.version}:{region}"
+    quote = cache.get(key)
+    if quote is None:
+        lines = cart.items.values_list('product_id', 'product__category_id', 'product__price', 'quantity')
+        quote = table.price(lines, region)
+        cache.set(key, quote, QUOTE_TIMEOUT)
+    return quote
@@ -0,0 +1,198 @@
+"""
+Reconciliation of payments against gateway settlement files.
+
+Settlement rows are streamed in fixed-size chunks. Each chunk becomes a hash
+table keyed by transaction id, which is probed with one ``values_list``
+query for the matching ``Payment`` rows, so memory use depends on the chunk
+size rather than the file size.
+"""
+import csv
+import gzip
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, Payment
+from .transitions import PAYMENT_TRANSITIONS, bulk_transition_orders, bulk_transition_payments, can_transition
+
+# Gateway settlement statuses mapped to Payment.status
+STATUS_MAP = {
+    'settled': 'completed',
+    'succeeded': 'completed',
+    'success': 'completed',
+    'paid': 'completed',
+    'completed': 'completed',
+    'pending': 'pending',
+    'processing': 'processing',
+    'failed': 'failed',
+    'declined': 'failed',
+    'cancelled': 'cancelled',
+    'canceled': 'cancelled',
+    'voided': 'cancelled',
+    'refunded': 'refunded',
+}
+
+
+class ReconciliationResult:
+    """Running totals for a reconciliation run"""
+
+    def __init__(self):
+        self.rows = 0
+        self.matched = 0
+        self.missing = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.amount_mismatches = 0
+        self.status_updates = 0
+        self.rejected = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def open_settlement_file(path):
+    """Open a settlement CSV, transparently decompressing ``.gz`` files"""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', newline='', encoding='utf-8')
+    return open(path, newline='', encoding='utf-8')
+
+
+def parse_amount(value):
+    try:
+        return Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _apply_corrections(corrections, result, report):
+    """
+    Move payments to their settled status, one conditional ``UPDATE`` per
+    ``(from, to)`` pair, and confirm the orders of those completed
+    """
+    groups = {}
+    for correction in corrections:
+        groups.setdefault(correction[2:4], []).append(correction)
+    for (status, expected_status), group in groups.items():
+        with transaction.atomic():
+            moved = set(bulk_transition_payments([correction[0] for correction in group], status, expected_status))
+            Payment.objects.bulk_update(
+                [Payment(id=payment_id, gateway_response=response)
+                 for payment_id, _, _, _, response in group if payment_id in moved],
+                ['gateway_response'], batch_size=500,
+            )
+            if expected_status == 'completed' and moved:
+                bulk_transition_orders(Order.objects.filter(payments__id__in=moved), 'confirmed',
+                                       note='Payment settled')
+        result.status_updates += len(moved)
+        for payment_id, transaction_id, _, _, _ in group:
+            if payment_id not in moved:
+                # The payment changed since it was read
+                result.rejected += 1
+                report(transaction_id, 'rejected', status, expected_status, None, None)
+
+
+def reconcile_chunk(rows, columns, result, dry_run=False, on_mismatch=None):
+    """
+    Hash join one chunk of settlement rows against payments.
+
+    Status corrections are checked against the payment state machine, so a
+    settlement file can never move a payment backwards; corrections it
+    rejects are reported instead of written. Allowed ones are applied in
+    bulk, one conditional ``UPDATE`` per status pair.
+    """
+    report = on_mismatch or (lambda *args: None)
+    settlements = {}
+    for row in rows:
+        result.rows += 1
+        transaction_id = (row.get(columns['id']) or '').strip()
+        amount = parse_amount(row.get(columns['amount'], ''))
+        if not transaction_id or amount is None:
+            result.invalid += 1
+            continue
+        settlements[transaction_id] = (amount, (row.get(columns['status']) or '').strip().lower(), row)
+
+    if not settlements:
+        return
+
+    notes = []
+    corrections = []
+    matched = set()
+    now = timezone.now()
+    payments = list(Payment.objects.filter(transaction_id__in=settlements.keys()).values_list(
+        'id', 'transaction_id', 'total_amount', 'status', 'gateway_response'
+    ))
+    shared = Counter(payment[1] for payment in payments)
+    for payment_id, transaction_id, total_amount, status, gateway_response in payments:
+        amount, gateway_status, row = settlements[transaction_id]
+        expected_status = STATUS_MAP.get(gateway_status, status)
+        if transaction_id not in matched:
+            matched.add(transaction_id)
+            result.matched += 1
+        if shared[transaction_id] > 1:
+            # transaction_id is not unique; leave the ambiguous payments alone
+            result.duplicates += 1
+            report(transaction_id, 'duplicate', status, expected_status, total_amount, amount)
+            continue
+        amount_mismatch = amount != total_amount
+        status_mismatch = expected_status != status
+        if not (amount_mismatch or status_mismatch):
+            continue
+
+        reconciliation = {
+            'reconciled_at': now.isoformat(),
+            'settlement': row,
+        }
+        if amount_mismatch:
+            result.amount_mismatches += 1
+            reconciliation['amount_mismatch'] = {
+                'expected': str(total_amount),
+                'settled': str(amount),
+            }
+            report(transaction_id, 'amount', status, expected_status, total_amount, amount)
+        if status_mismatch and not can_transition(PAYMENT_TRANSITIONS, status, expected_status):
+            result.rejected += 1
+            report(transaction_id, 'rejected', status, expected_status, total_amount, amount)
+            status_mismatch = False
+        elif status_mismatch:
+            reconciliation['previous_status'] = status
+            report(transaction_id, 'status', status, expected_status, total_amount, amount)
+
+        response = dict(gateway_response or {})
+        response['reconciliation'] = reconciliation
+        if status_mismatch:
+            corrections.append((payment_id, transaction_id, status, expected_status, response))
+        else:
+            notes.append(Payment(id=payment_id, gateway_response=response, updated_at=now))
+
+    for transaction_id, (amount, gateway_status, row) in settlements.items():
+        if transaction_id not in matched:
+            result.missing += 1
+            report(transaction_id, 'missing', '', STATUS_MAP.get(gateway_status, gateway_status), None, amount)
+
+    if dry_run:
+        result.status_updates += len(corrections)
+        return
+    if notes:
+        Payment.objects.bulk_update(notes, ['gateway_response', 'updated_at'], batch_size=500)
+    _apply_corrections(corrections, result, report)
+
+
+def reconcile_file(path, columns, chunk_size=5000, dry_run=False, on_mismatch=None, on_progress=None):
+    """Reconcile every row of a settlement file"""
+    result = ReconciliationResult()
+    with open_settlement_file(path) as f:
+        reader = csv.DictReader(f)
+        missing_columns = set(columns.values()) - set(reader.fieldnames or [])
+        if missing_columns:
+            raise ValueError(f"Settlement file is missing columns: {', '.join(sorted(missing_columns))}")
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+            reconcile_chunk(chunk, columns, result, dry_run=dry_run, on_mismatch=on_mismatch)
+            if on_progress:
+                on_progress(result)
+    return result
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.models import Product, prices_updated
+from .catalog import invalidate_catalog
+from .checkout import bump_balance_version, bump_product_versions
+from .models import PaymentMethod, PricingRule, Payment, UserBalance, UserPaymentStats
+from .pricing import invalidate_rules
+
+
+@receiver([post_save, post_delete], sender=PaymentMethod)
+def payment_method_changed(sender, **kwargs):
+    """Reload the payment method catalog once the admin's edit commits"""
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver([post_save, post_delete], sender=PricingRule)
+def pricing_rule_changed(sender, **kwargs):
+    """Reload the pricing rule table once the admin's edit commits"""
+    transaction.on_commit(invalidate_rules)
+
+
+@receiver([post_save, post_delete], sender=UserBalance)
+def user_balance_changed(sender, instance, **kwargs):
+    """Invalidate the owner's cached checkout pages"""
+    bump_balance_version(instance.user_id)
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, created, **kwargs):
+    """Invalidate cached Buy Now checkout pages for the product"""
+    if not created:
+        bump_product_versions([instance.id])
+
+
+@receiver(prices_updated, sender=Product)
+def product_prices_updated(sender, prices, **kwargs):
+    """Invalidate cached Buy Now checkout pages for bulk repriced products"""
+    bump_product_versions(prices)
+
+
+@receiver(post_save, sender=Payment)
+def update_payment_stats(sender, instance, created, **kwargs):
+    """Fold a new payment into the customer's running aggregates"""
+    if not created:
+        return
+    amount = float(instance.amount)
+    increments = {
+        'payment_count': F('payment_count') + 1,
+        'amount_sum': F('amount_sum') + amount,
+        'amount_sq_sum': F('amount_sq_sum') + amount * amount,
+        'last_payment_at': instance.created_at,
+    }
+    stats = UserPaymentStats.objects.filter(user_id=instance.customer_id)
+    if stats.update(**increments):
+        return
+    _, created_stats = UserPaymentStats.objects.get_or_create(
+        user_id=instance.customer_id,
+        defaults={
+            'payment_count': 1,
+            'amount_sum': amount,
+            'amount_sq_sum': amount * amount,
+            'last_payment_at': instance.created_at,
+        },
+    )
+    if not created_stats:
+        # Another worker created the row first
+        stats.update(**increments)
@@ -0,0 +1,141 @@
+"""
+HMAC signatures for payments.
+
+A signature covers the values that must not change after a payment is
+created and is stored in ``Payment.security_hash`` as ``<key id>:<hex>``.
+Only local column values are signed (``order_id`` rather than the order
+number), so signing and verifying never load related rows and a whole table
+can be checked from a single ``values_list`` query.
+
+Payments from before signing hold the old unkeyed SHA-256 of
+``payment_id``, order number, ``customer_id`` and ``amount``. Those verify as
+``LEGACY`` only while that hash still matches the row; anything else without
+a key id, including a blank hash, is ``INVALID``.
+
+Keys come from ``PAYMENT_SIGNING_KEYS`` (key id to secret) and new
+signatures use ``PAYMENT_SIGNING_KEY_ID``. Old keys stay in the mapping
+after a rotation so existing signatures keep verifying. Without configured
+keys a key derived from ``SECRET_KEY`` is used.
+"""
+import hashlib
+import hmac
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+SIGNED_FIELDS = ('payment_id', 'order_id', 'customer_id', 'payment_method_id', 'amount', 'total_amount')
+LEGACY_FIELDS = ('payment_id', 'order__order_number', 'customer_id', 'amount')
+
+DEFAULT_KEY_ID = 'k0'
+CENTS = Decimal('0.01')
+
+VALID = 'valid'
+LEGACY = 'legacy'  # unkeyed hash written before signing existed
+UNKNOWN_KEY = 'unknown_key'
+INVALID = 'invalid'
+
+
+def get_keys():
+    """Signing keys as ``{key_id: bytes}`` and the id used for new signatures"""
+    keys = settings.PAYMENT_SIGNING_KEYS
+    if not keys:
+        derived = hmac.new(settings.SECRET_KEY.encode(), b'payments.signing', hashlib.sha256).digest()
+        return {DEFAULT_KEY_ID: derived}, DEFAULT_KEY_ID
+    key_id = settings.PAYMENT_SIGNING_KEY_ID
+    if key_id not in keys:
+        raise ImproperlyConfigured('PAYMENT_SIGNING_KEY_ID must name one of PAYMENT_SIGNING_KEYS.')
+    return {kid: secret.encode() for kid, secret in keys.items()}, key_id
+
+
+def canonical(values):
+    """Message bytes for values in ``SIGNED_FIELDS`` order"""
+    parts = []
+    for value in values:
+        if isinstance(value, (Decimal, float)):
+            value = Decimal(str(value)).quantize(CENTS)
+        parts.append('' if value is None else str(value))
+    return '|'.join(parts).encode()
+
+
+def legacy_digest(values):
+    """Pre-signing SHA-256 for values in ``LEGACY_FIELDS`` order"""
+    payment_id, order_number, customer_id, amount = values
+    amount = Decimal(str(amount)).quantize(CENTS)
+    return hashlib.sha256(f"{payment_id}{order_number}{customer_id}{amount}".encode()).hexdigest()
+
+
+class Signer:
+    """Signs and verifies value tuples with a fixed set of keys"""
+
+    def __init__(self, keys, key_id):
+        self.key_id = key_id
+        # Keyed hashes are copied per message instead of rekeyed
+        self.macs = {kid: hmac.new(secret, digestmod=hashlib.sha256) for kid, secret in keys.items()}
+
+    def digest(self, key_id, values):
+        mac = self.macs[key_id].copy()
+        mac.update(canonical(values))
+        return mac.hexdigest()
+
+    def sign(self, values):
+        return f"{self.key_id}:{self.digest(self.key_id, values)}"
+
+    def check(self, values, signature, legacy_values=None):
+        """
+        One of ``VALID``, ``LEGACY``, ``UNKNOWN_KEY`` or ``INVALID``.
+
+        ``legacy_values`` (in ``LEGACY_FIELDS`` order) are needed to accept
+        a pre-signing hash.
+        """
+        key_id, sep, digest = (signature or '').partition(':')
+        if not sep:
+            if signature and legacy_values is not None and hmac.compare_digest(
+                signature, legacy_digest(legacy_values)
+            ):
+                return LEGACY
+            return INVALID
+        if key_id not in self.macs:
+            return UNKNOWN_KEY
+        if hmac.compare_digest(digest, self.digest(key_id, values)):
+            return VALID
+        return INVALID
+
+    def check_rows(self, rows):
+        """
+        Check ``(pk, *SIGNED_FIELDS, *LEGACY_FIELDS, signature)`` rows.
+
+        Returns a count per result and the ``(pk, result)`` pairs that are
+        not valid.
+        """
+        counts = dict.fromkeys((VALID, LEGACY, UNKNOWN_KEY, INVALID), 0)
+        failures = []
+        signed_end = 1 + len(SIGNED_FIELDS)
+        for row in rows:
+            result = self.check(row[1:signed_end], row[-1], row[signed_end:-1])
+            counts[result] += 1
+            if result != VALID:
+                failures.append((row[0], result))
+        return counts, failures
+
+
+def get_signer():
+    return Signer(*get_keys())
+
+
+def payment_values(payment):
+    """Signed values of a payment instance, read without touching relations"""
+    return tuple(getattr(payment, field) for field in SIGNED_FIELDS)
+
+
+def sign_payment(payment):
+    return get_signer().sign(payment_values(payment))
+
+
+def verify_payment(payment):
+    return get_signer().check(payment_values(payment), payment.security_hash) == VALID
+
+
+def check_chunk(rows, keys, key_id):
+    """Worker pool entry point; takes keys explicitly so it needs no settings"""
+    return Signer(keys, key_id).check_rows(rows)
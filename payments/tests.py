@@ -1,3 +1,994 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from cart.models import Cart, CartItem
+from marketplace.models import Category, Product
+
+from .models import (
+    PaymentMethod, PricingRule, Order, OrderItem, OrderStatusHistory, Payment, PaymentSecurity, UserBalance,
+    PaymentSecurityRollup, PayoutAllocation, PayoutBatch, SellerBalance, UserPaymentStats, WebhookEvent
+)
+from . import audit, gateway
+from .audit import block_ips, unblock_ips, is_ip_blocked, record_security_event
+from .catalog import get_catalog
+from .exports import HEADER
+from .fraud import FEATURES, batch_features, get_engine
+from .gateway_mock import MockGatewayServer
+from .identifiers import IdGenerator, identifier_timestamp, new_identifier
+from .payouts import run_payouts
+from .pricing import invalidate_rules, quote_cart, quote_items
+from .reconciliation import reconcile_file
+from .signing import DEFAULT_KEY_ID, verify_payment
+from .transitions import InvalidTransition, bulk_transition_orders, transition_order, transition_payment
+from .views import ORDER_HISTORY_PAGE_SIZE, PaymentSecurityMixin
+from .webhooks import process_pending_events, sign_payload
+
+User = get_user_model()
+
+
+class PaymentTestMixin:
+    """Shared fixtures for payment tests"""
+
+    def create_payment(self, user=None, amount=Decimal('10.00')):
+        user = user or self.user
+        order = Order.objects.create(
+            customer=user,
+            total_amount=amount,
+            grand_total=amount,
+            shipping_address='1 Farm Road',
+            billing_address='1 Farm Road',
+        )
+        return Payment.objects.create(
+            order=order,
+            customer=user,
+            payment_method=self.payment_method,
+            amount=amount,
+            total_amount=amount,
+        )
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='password'
+        )
+        self.payment_method = PaymentMethod.objects.create(
+            name='Credit Card', payment_type='credit_card'
+        )
+        self.category = Category.objects.create(name='Vegetables', slug='vegetables')
+        self.product = Product.objects.create(
+            name='Tomatoes', slug='tomatoes', description='Fresh tomatoes',
+            price=Decimal('4.50'), category=self.category, seller=self.user,
+            quantity_available=100,
+        )
+
+
+@override_settings(PAYMENT_WEBHOOK_SECRET='test-secret')
+class PaymentWebhookTests(PaymentTestMixin, TestCase):
+
+    def post_event(self, payment, event, signature=None):
+        body = json.dumps(event).encode()
+        return self.client.post(
+            reverse('payments:webhook', args=[payment.payment_id]),
+            data=body,
+            content_type='application/json',
+            HTTP_X_WEBHOOK_SIGNATURE=signature if signature is not None else sign_payload(body),
+        )
+
+    def test_invalid_signature_is_rejected(self):
+        payment = self.create_payment()
+        response = self.post_event(payment, {'event_id': 'evt_1', 'status': 'completed'}, signature='bad')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    @override_settings(PAYMENT_WEBHOOK_SECRET='', DEBUG=False)
+    def test_unsigned_events_are_rejected_without_a_secret(self):
+        payment = self.create_payment()
+        response = self.post_event(payment, {'event_id': 'evt_1', 'status': 'completed'}, signature='')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_events_without_sequence_are_not_stale(self):
+        payment = self.create_payment()
+        self.post_event(payment, {'event_id': 'evt_1', 'sequence': 5, 'status': 'processing'})
+        process_pending_events()
+        self.post_event(payment, {'event_id': 'evt_2', 'status': 'completed'})
+        self.assertEqual(process_pending_events(), 1)
+
+        self.assertIsNone(WebhookEvent.objects.get(event_id='evt_2').sequence)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+    def test_webhook_only_enqueues(self):
+        payment = self.create_payment()
+        response = self.post_event(payment, {'event_id': 'evt_1', 'status': 'completed'})
+        self.assertEqual(response.status_code, 200)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+        self.assertEqual(WebhookEvent.objects.filter(status='pending').count(), 1)
+
+    def test_duplicate_events_are_applied_once(self):
+        payment = self.create_payment()
+        event = {'event_id': 'evt_1', 'sequence': 1, 'status': 'completed', 'transaction_id': 'TX-1'}
+        responses = [self.post_event(payment, event) for _ in range(5)]
+
+        self.assertEqual([r.json()['duplicate'] for r in responses], [False, True, True, True, True])
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(process_pending_events(), 1)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.transaction_id, 'TX-1')
+        self.assertEqual(payment.order.status, 'confirmed')
+
+    def test_out_of_order_events_are_skipped(self):
+        payment = self.create_payment()
+        self.post_event(payment, {'event_id': 'evt_2', 'sequence': 2, 'status': 'completed'})
+        process_pending_events()
+        self.post_event(payment, {'event_id': 'evt_1', 'sequence': 1, 'status': 'processing'})
+        process_pending_events()
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(WebhookEvent.objects.get(event_id='evt_1').status, 'skipped')
+
+    def test_events_in_one_batch_apply_in_sequence(self):
+        payment = self.create_payment()
+        self.post_event(payment, {'event_id': 'evt_2', 'sequence': 2, 'status': 'completed'})
+        self.post_event(payment, {'event_id': 'evt_1', 'sequence': 1, 'status': 'processing'})
+        self.assertEqual(process_pending_events(), 2)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+    def test_gateway_simulator_converges(self):
+        payments = [self.create_payment() for _ in range(3)]
+        call_command(
+            'simulate_gateway', *[p.payment_id for p in payments],
+            duplicates=4, seed=7, process=True, stdout=StringIO(),
+        )
+        self.assertEqual(WebhookEvent.objects.count(), 6)
+        self.assertFalse(Payment.objects.exclude(status='completed').exists())
+
+
+class PaymentMethodCatalogTests(PaymentTestMixin, TestCase):
+
+    def test_catalog_is_served_from_memory(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            catalog = get_catalog()
+            catalog.quote(Decimal('100.00'))
+
+    def test_catalog_reloads_when_method_changes(self):
+        self.assertEqual(len(get_catalog()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            PaymentMethod.objects.create(name='PayPal', payment_type='paypal')
+            # Other workers must not reload before the change commits
+            self.assertEqual(len(get_catalog()), 1)
+        self.assertEqual(len(get_catalog()), 2)
+        self.payment_method.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment_method.save()
+        self.assertIsNone(get_catalog().get(self.payment_method.id))
+
+    def test_quote_matches_model_fees_and_limits(self):
+        self.payment_method.processing_fee_percentage = Decimal('2.90')
+        self.payment_method.processing_fee_fixed = Decimal('0.30')
+        self.payment_method.max_amount = Decimal('50.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment_method.save()
+        catalog = get_catalog()
+        method = catalog.get(self.payment_method.id)
+
+        self.assertEqual(
+            catalog.calculate_fees(method, Decimal('40.00')),
+            self.payment_method.calculate_fees(Decimal('40.00'))
+        )
+        quotes = {q['method'].id: q for q in catalog.quote(Decimal('60.00'))}
+        self.assertEqual(quotes[method.id]['fee'], Decimal('2.04'))
+        self.assertFalse(quotes[method.id]['available'])
+
+
+class CheckoutViewTests(PaymentTestMixin, TestCase):
+
+    def test_buy_now_checkout_prices_payment_methods(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('payments:checkout'), {
+            'buy_now': 'true', 'product_id': self.product.id, 'quantity': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['subtotal'], Decimal('9.00'))
+        quote = response.context['payment_quotes'][0]
+        self.assertEqual(quote['method'].id, self.payment_method.id)
+        self.assertTrue(quote['available'])
+
+
+class OrderHistoryTests(PaymentTestMixin, TestCase):
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                customer=self.user,
+                total_amount=self.product.price,
+                grand_total=self.product.price,
+                shipping_address='1 Farm Road',
+                billing_address='1 Farm Road',
+                **Order.summarize_items([self.product]),
+            )
+            OrderItem.objects.create(
+                order=order, product=self.product, quantity=1, unit_price=self.product.price
+            )
+
+    def test_history_is_keyset_paginated(self):
+        self.create_orders(ORDER_HISTORY_PAGE_SIZE + 3)
+        self.client.force_login(self.user)
+
+        first = self.client.get(reverse('payments:order_list'))
+        self.assertEqual(len(first.context['orders']), ORDER_HISTORY_PAGE_SIZE)
+        self.assertIsNotNone(first.context['next_cursor'])
+
+        second = self.client.get(reverse('payments:order_list'), {'before': first.context['next_cursor']})
+        self.assertEqual(len(second.context['orders']), 3)
+        self.assertIsNone(second.context['next_cursor'])
+        seen = {o.id for o in first.context['orders']} | {o.id for o in second.context['orders']}
+        self.assertEqual(len(seen), ORDER_HISTORY_PAGE_SIZE + 3)
+
+    def test_history_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('payments:order_list'))
+        self.create_orders(8)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('payments:order_list'))
+        self.assertEqual(len(few), len(many))
+
+
+class PaymentSecurityAuditTests(PaymentTestMixin, TestCase):
+
+    def test_events_are_rolled_up_hourly(self):
+        for score in (10, 40, 20):
+            record_security_event('payment_attempt', self.user, '10.0.0.1', risk_score=score)
+        rollup = PaymentSecurityRollup.objects.get()
+        self.assertEqual(rollup.event_count, 3)
+        self.assertEqual(rollup.risk_score_total, 70)
+        self.assertEqual(rollup.max_risk_score, 40)
+
+    def test_rollup_bucket_created_concurrently_is_bumped(self):
+        record_security_event('payment_attempt', self.user, '10.0.0.1', risk_score=10)
+        bump = audit._bump_rollup
+        misses = [0]
+        # The first bump misses, as if the bucket were created after it ran
+        with mock.patch.object(audit, '_bump_rollup', side_effect=lambda *args: misses.pop() if misses else bump(*args)):
+            record_security_event('payment_attempt', self.user, '10.0.0.1', risk_score=30)
+        rollup = PaymentSecurityRollup.objects.get()
+        self.assertEqual(rollup.event_count, 2)
+        self.assertEqual(rollup.max_risk_score, 30)
+
+    def test_rate_limit_reads_rollups(self):
+        for _ in range(11):
+            record_security_event('payment_attempt', self.user, '10.0.0.1')
+        self.assertEqual(audit.recent_event_count(self.user, 'payment_attempt', timezone.timedelta(minutes=15)), 11)
+        with CaptureQueriesContext(connection) as queries:
+            allowed = PaymentSecurityMixin().check_rate_limit(self.user, '10.0.0.1')
+        self.assertFalse(allowed)
+        self.assertTrue(any('payments_paymentsecurityrollup' in q['sql'] for q in queries))
+
+    def test_rate_limit_window_is_exact_at_an_hour_boundary(self):
+        def attempt(hour, minute):
+            at = datetime(2024, 3, 1, hour, minute, tzinfo=dt_timezone.utc)
+            with mock.patch('django.utils.timezone.now', return_value=at):
+                record_security_event('payment_attempt', self.user, '10.0.0.1')
+
+        for hour, minute in [(9, 59), (10, 50), (10, 56), (11, 0), (11, 5)]:
+            attempt(hour, minute)
+        window = timezone.timedelta(minutes=15)
+        now = datetime(2024, 3, 1, 11, 10, tzinfo=dt_timezone.utc)
+        self.assertEqual(audit.recent_event_count(self.user, 'payment_attempt', window, now=now), 3)
+        now = datetime(2024, 3, 1, 11, 15, tzinfo=dt_timezone.utc)
+        self.assertEqual(audit.recent_event_count(self.user, 'payment_attempt', window, now=now), 2)
+        self.assertEqual(audit.recent_event_count(self.user, 'payment_attempt', window * 4, now=now), 4)
+
+    def test_blocked_ips_survive_unblocking_other_events(self):
+        first = record_security_event('payment_attempt', self.user, '10.0.0.2')
+        second = record_security_event('payment_attempt', self.user, '10.0.0.2')
+        PaymentSecurity.objects.update(is_blocked=True)
+        block_ips(['10.0.0.2'])
+        self.assertTrue(is_ip_blocked('10.0.0.2'))
+
+        PaymentSecurity.objects.filter(id=first.id).update(is_blocked=False)
+        unblock_ips(['10.0.0.2'])
+        self.assertTrue(is_ip_blocked('10.0.0.2'))
+
+        PaymentSecurity.objects.filter(id=second.id).update(is_blocked=False)
+        unblock_ips(['10.0.0.2'])
+        self.assertFalse(is_ip_blocked('10.0.0.2'))
+
+    def test_prune_archives_expired_months(self):
+        old = record_security_event('payment_attempt', self.user, '10.0.0.3', details={'amount': '5.00'})
+        record_security_event('payment_attempt', self.user, '10.0.0.3')
+        PaymentSecurity.objects.filter(id=old.id).update(
+            created_at=timezone.now() - timezone.timedelta(days=200)
+        )
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('prune_security_events', archive_dir=archive_dir, stdout=StringIO())
+            [archive] = os.listdir(archive_dir)
+            with gzip.open(os.path.join(archive_dir, archive), 'rt') as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual([row['id'] for row in rows], [old.id])
+        self.assertEqual(rows[0]['details'], {'amount': '5.00'})
+        self.assertEqual(PaymentSecurity.objects.count(), 1)
+        self.assertEqual(PaymentSecurityRollup.objects.get().event_count, 2)
+
+
+class FraudEngineTests(PaymentTestMixin, TestCase):
+    noon = timezone.now().replace(hour=12)
+
+    def test_default_rules_match_legacy_scoring(self):
+        block_ips(['10.0.0.9'])
+        engine = get_engine()
+        score, indicators = engine.score(self.user, '10.0.0.9', 'curl', Decimal('1500'), now=self.noon)
+        self.assertEqual(score, 100)
+        self.assertEqual(indicators, ['IP address is blocked', 'Suspicious user agent', 'High transaction amount'])
+        score, _ = engine.score(self.user, '10.0.0.1', 'x' * 40, Decimal('20'), now=self.noon.replace(hour=3))
+        self.assertEqual(score, 15)
+
+    def test_amount_zscore_uses_payment_stats(self):
+        for amount in ('10', '12', '8', '11', '9'):
+            self.create_payment(amount=Decimal(amount))
+        stats = UserPaymentStats.objects.get(user=self.user)
+        self.assertEqual(stats.payment_count, 5)
+        engine = get_engine(['amount_outlier'])
+        self.assertEqual(engine.score(self.user, '10.0.0.1', 'x' * 40, Decimal('500'))[0], 25)
+        self.assertEqual(engine.score(self.user, '10.0.0.1', 'x' * 40, Decimal('11'))[0], 0)
+
+    def test_batch_features_match_live_features(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='password')
+        checkouts = [
+            (self.user, '10', '10.0.0.1'), (self.user, '12', '10.0.0.1'), (other, '2000', '10.0.0.1'),
+            (self.user, '8', '10.0.0.2'), (self.user, '11', '10.0.0.1'), (self.user, '9', '10.0.0.1'),
+            (other, '15', '10.0.0.1'), (self.user, '500', '10.0.0.1'),
+        ]
+        names = ['velocity', 'amount_zscore', 'ip_accounts']
+        live = []
+        for user, amount, ip in checkouts:
+            ctx = {'user': user, 'ip_address': ip, 'user_agent': 'x' * 40,
+                   'amount': Decimal(amount), 'now': timezone.now()}
+            live.append([FEATURES[name](ctx) for name in names])
+            # As the checkout view does after scoring
+            payment = self.create_payment(user=user, amount=Decimal(amount))
+            Payment.objects.filter(id=payment.id).update(ip_address=ip, user_agent='x' * 40)
+            record_security_event('payment_attempt', user, ip)
+
+        rows = Payment.objects.order_by('created_at', 'id').values_list(
+            'customer_id', 'amount', 'ip_address', 'user_agent', 'created_at'
+        )
+        features = batch_features(list(rows))
+        for i, name in enumerate(names):
+            self.assertTrue(np.allclose(features[name], [values[i] for values in live]), name)
+        self.assertEqual(features['velocity'].tolist(), [0, 1, 0, 2, 3, 4, 1, 5])
+        self.assertEqual(features['ip_accounts'].tolist(), [0, 1, 1, 0, 2, 2, 2, 2])
+        self.assertGreater(features['amount_zscore'][-1], 3)
+        self.assertEqual(features['ua_length'].tolist(), [40] * len(checkouts))
+
+        engine = get_engine(['high_velocity', 'amount_outlier', 'shared_ip', 'high_amount'])
+        ids, scores, hits = engine.score_payments(Payment.objects.all(), chunk_size=3)
+        whole = engine.score_batch(features)[0]
+        self.assertEqual(scores.tolist(), whole.tolist())
+        self.assertEqual(hits['high_amount'].tolist(), [False, False, True] + [False] * 5)
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command('benchmark_fraud_scoring', iterations=20, batch_size=500, all_rules=True, stdout=out)
+        self.assertIn('Per-request', out.getvalue())
+        self.assertIn('Batch: 500 payments', out.getvalue())
+
+
+class ReconciliationTests(PaymentTestMixin, TestCase):
+
+    def test_reconcile_flags_and_updates_payments(self):
+        settled = self.create_payment(amount=Decimal('10.00'))
+        failed = self.create_payment(amount=Decimal('20.00'))
+        short = self.create_payment(amount=Decimal('30.00'))
+        for i, payment in enumerate([settled, failed, short]):
+            Payment.objects.filter(id=payment.id).update(transaction_id=f'TX-{i}')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'settlement.csv')
+            with open(path, 'w') as f:
+                f.write('transaction_id,amount,status\n')
+                f.write('TX-0,10.00,settled\n')
+                f.write('TX-1,20.00,declined\n')
+                f.write('TX-2,29.00,settled\n')
+                f.write('TX-9,5.00,settled\n')
+                f.write(',1.00,settled\n')
+            result = reconcile_file(path, {'id': 'transaction_id', 'amount': 'amount', 'status': 'status'}, chunk_size=2)
+
+        self.assertEqual(result.as_dict(), {
+            'rows': 5, 'matched': 3, 'missing': 1, 'invalid': 1, 'duplicates': 0,
+            'amount_mismatches': 1, 'status_updates': 3, 'rejected': 0,
+        })
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, 'failed')
+        short.refresh_from_db()
+        self.assertEqual(short.status, 'completed')
+        self.assertEqual(short.order.status, 'confirmed')
+        self.assertEqual(short.gateway_response['reconciliation']['amount_mismatch']['settled'], '29.00')
+
+    def test_reconcile_rejects_illegal_moves_and_reports_duplicates(self):
+        completed = self.create_payment(amount=Decimal('10.00'))
+        transition_payment(completed, 'completed')
+        first = self.create_payment(amount=Decimal('20.00'))
+        second = self.create_payment(amount=Decimal('20.00'))
+        Payment.objects.filter(id=completed.id).update(transaction_id='TX-0')
+        Payment.objects.filter(id__in=[first.id, second.id]).update(transaction_id='TX-1')
+
+        issues = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'settlement.csv')
+            with open(path, 'w') as f:
+                f.write('transaction_id,amount,status\n')
+                f.write('TX-0,12.00,pending\n')
+                f.write('TX-1,20.00,settled\n')
+            result = reconcile_file(
+                path, {'id': 'transaction_id', 'amount': 'amount', 'status': 'status'},
+                on_mismatch=lambda *row: issues.append(row[:2]),
+            )
+
+        self.assertEqual(result.matched, 2)
+        self.assertEqual(result.duplicates, 2)
+        self.assertEqual(result.rejected, 1)
+        self.assertEqual(result.status_updates, 0)
+        self.assertEqual(sorted(issues), [
+            ('TX-0', 'amount'), ('TX-0', 'rejected'), ('TX-1', 'duplicate'), ('TX-1', 'duplicate'),
+        ])
+        self.assertEqual(set(Payment.objects.filter(transaction_id='TX-1').values_list('status', flat=True)), {'pending'})
+        completed.refresh_from_db()
+        self.assertEqual(completed.status, 'completed')
+        self.assertEqual(completed.gateway_response['reconciliation']['amount_mismatch']['settled'], '12.00')
+
+    def test_corrections_are_applied_in_bulk(self):
+        def reconcile(count):
+            payments = [self.create_payment() for _ in range(count)]
+            tmp = tempfile.TemporaryDirectory()
+            self.addCleanup(tmp.cleanup)
+            path = os.path.join(tmp.name, 'settlement.csv')
+            with open(path, 'w') as f:
+                f.write('transaction_id,amount,status\n')
+                for payment in payments:
+                    Payment.objects.filter(id=payment.id).update(transaction_id=f'TX-{payment.id}')
+                    f.write(f'TX-{payment.id},10.00,{"settled" if payment.id % 2 else "declined"}\n')
+            with CaptureQueriesContext(connection) as queries:
+                result = reconcile_file(path, {'id': 'transaction_id', 'amount': 'amount', 'status': 'status'})
+            self.assertEqual(result.status_updates, count)
+            return payments, len(queries)
+
+        _, few = reconcile(2)
+        payments, many = reconcile(20)
+        self.assertEqual(few, many)
+        statuses = dict(Order.objects.filter(payments__in=payments).values_list('payments__status', 'status'))
+        self.assertEqual(statuses, {'completed': 'confirmed', 'failed': 'pending'})
+        self.assertEqual(OrderStatusHistory.objects.filter(order__payments__in=payments).count(), 10)
+
+
+class StatusTransitionTests(PaymentTestMixin, TestCase):
+
+    def test_invalid_and_stale_transitions_are_rejected(self):
+        order = self.create_payment().order
+        with self.assertRaises(InvalidTransition):
+            transition_order(order, 'delivered')
+
+        stale = Order.objects.get(id=order.id)
+        transition_order(order, 'confirmed')
+        with self.assertRaises(InvalidTransition):
+            transition_order(stale, 'cancelled')
+        self.assertEqual(order.status_history.get().to_status, 'confirmed')
+
+    def test_backwards_payment_transition_is_rejected(self):
+        payment = self.create_payment()
+        transition_payment(payment, 'completed')
+        with self.assertRaises(InvalidTransition):
+            transition_payment(payment, 'processing')
+
+    def test_bulk_transition_uses_one_update_per_source_status(self):
+        orders = [self.create_payment().order for _ in range(6)]
+        Order.objects.filter(id__in=[o.id for o in orders[:4]]).update(status='shipped')
+
+        with CaptureQueriesContext(connection) as queries:
+            moved, skipped = bulk_transition_orders(
+                Order.objects.filter(id__in=[o.id for o in orders]), 'delivered', user=self.user
+            )
+        self.assertEqual((moved, skipped), (4, 2))
+        updates = [q for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Order.objects.filter(status='delivered').count(), 4)
+        self.assertEqual(OrderStatusHistory.objects.filter(to_status='delivered', changed_by=self.user).count(), 4)
+
+
+class IdentifierTests(PaymentTestMixin, TestCase):
+
+    def test_identifiers_are_unique_and_time_ordered(self):
+        ids = [new_identifier('ORD') for _ in range(5000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(i) == 22 for i in ids))
+
+        order = self.create_payment().order
+        self.assertTrue(order.order_number.startswith('ORD-'))
+        created = identifier_timestamp(order.order_number)
+        self.assertLess(abs((created - order.created_at).total_seconds()), 5)
+        self.assertIsNone(identifier_timestamp('ORD-1A2B3C4D'))
+
+    def test_generator_redraws_node_after_fork(self):
+        generator = IdGenerator()
+        nodes = set()
+        for _ in range(5):
+            generator._pid = -1
+            generator.next_int()
+            nodes.add(generator.node)
+        self.assertGreater(len(nodes), 1)
+
+
+class PaymentSigningTests(PaymentTestMixin, TestCase):
+
+    def test_signature_covers_values_without_loading_relations(self):
+        payment = Payment.objects.get(id=self.create_payment().id)
+        with self.assertNumQueries(0):
+            self.assertTrue(verify_payment(payment))
+        self.assertTrue(payment.security_hash.startswith(f'{DEFAULT_KEY_ID}:'))
+
+        payment.amount = payment.amount + 1
+        self.assertFalse(verify_payment(payment))
+
+    @override_settings(PAYMENT_SIGNING_KEYS={'old': 'old-secret', 'new': 'new-secret'}, PAYMENT_SIGNING_KEY_ID='new')
+    def test_verify_command_reports_and_signs_legacy_payments(self):
+        with override_settings(PAYMENT_SIGNING_KEY_ID='old'):
+            rotated = self.create_payment()
+        current = self.create_payment()
+        legacy = self.create_payment()
+        tampered = self.create_payment()
+        tampered_legacy = self.create_payment()
+        blank = self.create_payment()
+        for payment in (legacy, tampered_legacy):
+            old_hash = hashlib.sha256(
+                f"{payment.payment_id}{payment.order.order_number}{payment.customer_id}{payment.amount}".encode()
+            ).hexdigest()
+            Payment.objects.filter(id=payment.id).update(security_hash=old_hash)
+        Payment.objects.filter(id=tampered.id).update(total_amount=Decimal('0.01'))
+        Payment.objects.filter(id=tampered_legacy.id).update(amount=Decimal('0.01'))
+        Payment.objects.filter(id=blank.id).update(security_hash='')
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_payment_signatures', workers=2, chunk_size=2, sign_legacy=True, stdout=out)
+        self.assertIn('valid: 2', out.getvalue())
+        self.assertIn('legacy: 1', out.getvalue())
+        self.assertIn('invalid: 3', out.getvalue())
+        self.assertIn('Signed 1 legacy payments', out.getvalue())
+
+        for payment in Payment.objects.filter(id__in=[rotated.id, current.id, legacy.id]):
+            self.assertTrue(verify_payment(payment))
+        for payment in Payment.objects.filter(id__in=[tampered.id, tampered_legacy.id, blank.id]):
+            self.assertFalse(verify_payment(payment))
+
+
+class PricingTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        invalidate_rules()
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_default_rules_price_buy_now(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('payments:checkout'), {
+            'buy_now': 'true', 'product_id': self.product.id, 'quantity': 2,
+        })
+        self.assertEqual(response.context['shipping'], Decimal('5.99'))
+        self.assertEqual(response.context['tax'], Decimal('0.72'))
+        self.assertEqual(response.context['total'], Decimal('15.71'))
+
+    def test_tax_is_rounded_to_cents(self):
+        self.product.price = Decimal('1.99')
+        quote = quote_items([(self.product, 1)])
+        self.assertEqual(quote.tax, Decimal('0.16'))  # 0.1592 before rounding
+        self.assertEqual(quote.total, Decimal('8.14'))
+
+    def test_free_orders_are_not_charged_shipping(self):
+        self.product.price = Decimal('0.00')
+        quote = quote_items([(self.product, 3)])
+        self.assertEqual((quote.shipping, quote.tax, quote.total), (Decimal('0'), Decimal('0'), Decimal('0')))
+
+    def test_rule_changes_apply_after_commit(self):
+        quote_items([(self.product, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            PricingRule.objects.create(kind='shipping', fixed_amount=Decimal('1.00'))
+            self.assertEqual(quote_items([(self.product, 1)]).shipping, Decimal('5.99'))
+        self.assertEqual(quote_items([(self.product, 1)]).shipping, Decimal('1.00'))
+
+    def test_most_specific_rule_wins(self):
+        fruit = Category.objects.create(name='Fruit', slug='fruit')
+        mango = Product.objects.create(
+            name='Mango', slug='mango', description='Ripe mangoes',
+            price=Decimal('10.00'), category=fruit, seller=self.user, quantity_available=10,
+        )
+        PricingRule.objects.create(kind='tax', rate=Decimal('10.00'))
+        PricingRule.objects.create(kind='tax', category=fruit, rate=Decimal('0.00'))
+        PricingRule.objects.create(kind='shipping', region='lagos', fixed_amount=Decimal('2.00'))
+        PricingRule.objects.create(kind='shipping', region='Lagos', category=fruit, fixed_amount=Decimal('3.50'))
+
+        quote = quote_items([(self.product, 2), (mango, 1)], region='Lagos')
+        self.assertEqual(quote.subtotal, Decimal('19.00'))
+        self.assertEqual(quote.tax, Decimal('0.90'))  # only the tomatoes are taxed
+        self.assertEqual(quote.shipping, Decimal('3.50'))  # largest fixed amount, once
+        self.assertEqual(quote_items([(mango, 1)], region='Abuja').shipping, Decimal('5.99'))
+
+    def test_cart_quote_is_memoized_per_cart_version(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        self.cart.refresh_from_db()
+        first = quote_cart(self.cart)
+        with CaptureQueriesContext(connection) as queries:
+            again = quote_cart(self.cart)
+        self.assertFalse([q for q in queries if 'cart_cartitem' in q['sql']])
+        self.assertEqual(again.total, first.total)
+
+        self.product.price = Decimal('5.00')
+        self.product.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(quote_cart(self.cart).subtotal, Decimal('10.00'))
+
+        Product.objects.filter(id=self.product.id).update(price=Decimal('6.00'))
+        self.cart.refresh_from_db()
+        self.assertEqual(quote_cart(self.cart).subtotal, Decimal('12.00'))
+
+    def test_cart_checkout_charges_the_quoted_total(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        self.client.force_login(self.user)
+        page = self.client.get(reverse('cart:view'))
+        response = self.client.post(
+            reverse('payments:checkout'),
+            json.dumps({'payment_method_id': self.payment_method.id, 'shipping_address': '1 Farm Road'}),
+            content_type='application/json',
+        )
+        self.assertTrue(response.json()['success'])
+        order = Order.objects.get()
+        self.assertEqual(order.grand_total, page.context['grand_total'])
+        self.assertEqual(order.items.get().total_price, Decimal('9.00'))
+
+    def test_balance_checkout_confirms_the_order(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        UserBalance.objects.create(user=self.user, amount=Decimal('100.00'))
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('payments:checkout'),
+            json.dumps({'payment_method_id': self.payment_method.id, 'use_balance': True,
+                        'shipping_address': '1 Farm Road'}),
+            content_type='application/json',
+        )
+        self.assertTrue(response.json()['success'])
+        order = Order.objects.get()
+        self.assertEqual((order.status, order.payments.get().status), ('confirmed', 'completed'))
+        self.assertEqual(OrderStatusHistory.objects.get(order=order).to_status, 'confirmed')
+
+
+@override_settings(PAYOUT_SETTLE_DELAY=0)
+class PayoutTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create_user(username='farmer', email='farmer@example.com', password='password')
+        self.product.seller = self.seller
+        self.product.save()
+
+    def complete_order(self, quantity):
+        payment = self.create_payment(amount=self.product.price * quantity)
+        OrderItem.objects.create(order=payment.order, product=self.product, quantity=quantity,
+                                 unit_price=self.product.price)
+        transition_payment(payment, 'completed')
+        return payment
+
+    def test_payouts_are_incremental(self):
+        self.complete_order(2)
+        self.complete_order(1)
+        self.create_payment()  # still pending
+
+        batches = run_payouts(batch_size=1)
+        self.assertEqual([b.payment_count for b in batches], [1, 1])
+        self.assertEqual(run_payouts(), [])
+
+        self.complete_order(4)
+        (batch,) = run_payouts()
+        self.assertEqual(batch.total_amount, Decimal('18.00'))
+
+        balance = SellerBalance.objects.get(seller=self.seller)
+        self.assertEqual(balance.total_earned, Decimal('31.50'))
+        self.assertEqual(balance.item_count, 3)
+        self.assertEqual(PayoutAllocation.objects.count(), 3)
+
+    def test_failed_batch_is_redone(self):
+        self.complete_order(2)
+        with mock.patch('payments.payouts.update_balances', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                run_payouts()
+        self.assertFalse(PayoutBatch.objects.exists())
+
+        (batch,) = run_payouts()
+        self.assertEqual(batch.item_count, 1)
+        self.assertEqual(SellerBalance.objects.get(seller=self.seller).total_earned, Decimal('9.00'))
+
+    def test_resaved_payment_is_not_counted_again(self):
+        payment = self.complete_order(2)
+        (batch,) = run_payouts()
+        self.assertEqual(batch.payment_count, 1)
+
+        payment.gateway_response = {'note': 'resent receipt'}
+        payment.save()
+        batches = run_payouts()
+        self.assertEqual([(b.payment_count, b.item_count) for b in batches], [(0, 0)])
+        balance = SellerBalance.objects.get(seller=self.seller)
+        self.assertEqual((balance.total_earned, balance.item_count), (Decimal('9.00'), 1))
+        self.assertEqual(run_payouts(), [])
+
+    def test_refund_after_payout_is_reversed(self):
+        refunded = self.complete_order(2)
+        self.complete_order(1)
+        run_payouts()
+
+        transition_payment(refunded, 'refunded')
+        (batch,) = run_payouts()
+        self.assertEqual((batch.payment_count, batch.reversed_count), (0, 1))
+        self.assertEqual(batch.reversed_amount, Decimal('9.00'))
+        payout = batch.payouts.get()
+        self.assertEqual((payout.amount, payout.reversed_amount), (Decimal('0.00'), Decimal('9.00')))
+
+        balance = SellerBalance.objects.get(seller=self.seller)
+        self.assertEqual((balance.total_earned, balance.item_count), (Decimal('4.50'), 1))
+        self.assertEqual(PayoutAllocation.objects.get(payment=refunded).reversed_in, batch)
+        self.assertEqual(run_payouts(), [])
+
+
+class CheckoutContextCacheTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cart = Cart.objects.create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+            self.balance = UserBalance.objects.create(user=self.user, amount=Decimal('50.00'))
+        self.client.force_login(self.user)
+
+    def get_checkout(self, **params):
+        return self.client.get(reverse('payments:checkout'), params)
+
+    def assert_cached(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_checkout(**params)
+        touched = [q['sql'] for q in queries if any(
+            table in q['sql'] for table in ('payments_', 'cart_', 'marketplace_')
+        )]
+        self.assertEqual(touched, [])
+        return response
+
+    def test_repeated_get_needs_no_queries(self):
+        first = self.get_checkout()
+        second = self.assert_cached()
+        self.assertEqual(second.context['total'], first.context['total'])
+
+        self.get_checkout(buy_now='true', product_id=self.product.id, quantity=3)
+        response = self.assert_cached(buy_now='true', product_id=self.product.id, quantity=3)
+        self.assertEqual(response.context['subtotal'], Decimal('13.50'))
+
+    def test_cart_and_balance_changes_refresh_the_page(self):
+        self.get_checkout()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.quantity = 4
+            self.item.save()
+        self.assertEqual(self.get_checkout().context['subtotal'], Decimal('18.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.balance.deduct(Decimal('20.00'))
+        self.assertEqual(self.get_checkout().context['user_balance'].amount, Decimal('30.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('1.00')
+            self.product.save()
+        self.assertEqual(self.get_checkout().context['subtotal'], Decimal('4.00'))
+
+    def test_bulk_repricing_refreshes_the_page(self):
+        buy_now = {'buy_now': 'true', 'product_id': self.product.id, 'quantity': 3}
+        self.get_checkout()
+        self.get_checkout(**buy_now)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=self.product.id).update(price=Decimal('2.00'))
+        self.assertEqual(self.get_checkout().context['subtotal'], Decimal('4.00'))
+        self.assertEqual(self.get_checkout(**buy_now).context['subtotal'], Decimal('6.00'))
+
+
+class PaymentGatewayTests(PaymentTestMixin, TestCase):
+
+    def buy_now(self):
+        self.client.force_login(self.user)
+        return self.client.post(
+            reverse('payments:buy_now', args=[self.product.id]),
+            json.dumps({'quantity': 1, 'payment_method_id': self.payment_method.id}),
+            content_type='application/json',
+        )
+
+    def test_checkout_starts_a_gateway_session(self):
+        with MockGatewayServer() as server, override_settings(PAYMENT_GATEWAY_URL=server.url):
+            response = self.buy_now()
+            payment = Payment.objects.get()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['redirect_url'].startswith(f'{server.url}/pay/'))
+            self.assertTrue(payment.transaction_id.startswith('sess_'))
+
+            # Retries reuse the session through the idempotency key
+            self.assertEqual(gateway.create_session(payment)[0], payment.transaction_id)
+
+    def test_slow_gateway_fails_within_the_deadline(self):
+        with MockGatewayServer(latency=1.0) as server, \
+                override_settings(PAYMENT_GATEWAY_URL=server.url, PAYMENT_GATEWAY_TIMEOUT=0.2):
+            started = time.monotonic()
+            response = self.buy_now()
+            self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Payment.objects.get().status, 'pending')
+
+    def test_run_sync_deadline_raises_unavailable_and_cancels(self):
+        cancelled = threading.Event()
+
+        async def hang():
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        # Before Python 3.11 futures raise their own TimeoutError, not the builtin
+        futures_timeout = type('TimeoutError', (Exception,), {})
+        with mock.patch('concurrent.futures._base.TimeoutError', futures_timeout), \
+                mock.patch('concurrent.futures.TimeoutError', futures_timeout):
+            with self.assertRaises(gateway.GatewayUnavailable):
+                gateway.run_sync(hang(), 0.2)
+        self.assertTrue(cancelled.wait(2))
+
+    def test_circuit_opens_after_repeated_failures(self):
+        with MockGatewayServer(failure_rate=1.0) as server:
+            client = gateway.GatewayClient(server.url, timeout=2.0, retries=1, breaker_threshold=2)
+            payment = self.create_payment()
+            for _ in range(2):
+                with self.assertRaises(gateway.GatewayUnavailable):
+                    gateway.run_sync(client.create_session(payment), 3)
+            self.assertEqual(server.request_count, 4)  # two calls, one retry each
+            self.assertEqual(client.breaker.state, 'open')
+
+            with self.assertRaises(gateway.GatewayUnavailable):
+                gateway.run_sync(client.create_session(payment), 3)
+            self.assertEqual(server.request_count, 4)
+
+
+class AdminChangelistTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(self.admin)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            payment = self.create_payment()
+            OrderItem.objects.create(order=payment.order, product=self.product, quantity=2,
+                                     unit_price=self.product.price)
+
+    def test_changelist_query_count_is_constant(self):
+        urls = [reverse(f'admin:payments_{model}_changelist')
+                for model in ('order', 'orderitem', 'payment', 'orderstatushistory')]
+        self.create_orders(2)
+        transition_order(Order.objects.first(), 'confirmed')
+        few = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            few[url] = len(queries)
+
+        self.create_orders(8)
+        for order in Order.objects.all()[:5]:
+            transition_order(order, 'cancelled')
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertEqual(len(queries), few[url], url)
+
+    def test_order_columns_are_annotated(self):
+        self.create_orders(1)
+        response = self.client.get(reverse('admin:payments_order_changelist'), {'o': '8'})
+        (order,) = response.context['cl'].result_list
+        self.assertEqual((order.line_count, order.unit_count), (1, 2))
+
+        response = self.client.post(reverse('admin:payments_order_changelist'), {
+            'action': 'mark_confirmed', '_selected_action': [order.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(id=order.id).status, 'confirmed')
+
+
+class OrderExportTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for day, quantity in [(1, 1), (2, 3), (3, 2)]:
+            payment = self.create_payment(amount=self.product.price * quantity)
+            OrderItem.objects.create(order=payment.order, product=self.product, quantity=quantity,
+                                     unit_price=self.product.price)
+            Order.objects.filter(id=payment.order_id).update(
+                created_at=timezone.make_aware(datetime(2024, 1, day, 12))
+            )
+        # A retried payment; the export shows the latest one
+        self.retry = Payment.objects.create(
+            order=payment.order, customer=self.user, payment_method=self.payment_method,
+            amount=payment.amount, total_amount=payment.total_amount, status='completed',
+        )
+
+    def export(self, export_format, *args):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, f'orders.{export_format}')
+        out = StringIO()
+        call_command('export_orders', path, '--format', export_format, '--chunk-size', '2', *args, stdout=out)
+        return path, out.getvalue()
+
+    def test_csv_export_is_gzipped_and_filtered_by_date(self):
+        path, output = self.export('csv', '--start', '2024-01-02', '--end', '2024-01-04')
+        self.assertIn('Exported 2 order lines', output)
+        with gzip.open(path, 'rt', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['quantity'] for row in rows], ['3', '2'])
+        self.assertEqual(rows[1]['payment_id'], self.retry.payment_id)
+        self.assertEqual(rows[1]['line_total'], '9.00')
+
+    def test_xlsx_and_parquet_exports(self):
+        import pyarrow.parquet as pq
+        from openpyxl import load_workbook
+
+        path, _ = self.export('parquet')
+        table = pq.read_table(path)
+        self.assertEqual(table.column_names, HEADER)
+        self.assertEqual(table.column('quantity').to_pylist(), [1, 3, 2])
+
+        path, _ = self.export('xlsx')
+        rows = list(load_workbook(path, read_only=True).active.values)
+        self.assertEqual(list(rows[0]), HEADER)
+        self.assertEqual(len(rows), 4)
+
+    def test_admin_action_streams_selected_orders(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        order = Order.objects.order_by('created_at').first()
+        response = self.client.post(reverse('admin:payments_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [order.id],
+        })
+        self.assertTrue(response.streaming)
+        content = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], HEADER)
+        self.assertEqual([row[0] for row in rows[1:]], [order.order_number])
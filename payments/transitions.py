@@ -0,0 +1,137 @@
+"""
+Order and payment status state machines.
+
+Every status change goes through a conditional ``UPDATE ... WHERE status =
+<from>``, so a concurrent change makes the transition fail instead of being
+silently overwritten, and only the status columns are written. Order
+transitions are recorded in ``OrderStatusHistory``.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderStatusHistory, Payment
+
+ORDER_TRANSITIONS = {
+    'pending': {'confirmed', 'cancelled'},
+    'confirmed': {'processing', 'shipped', 'cancelled', 'refunded'},
+    'processing': {'shipped', 'cancelled', 'refunded'},
+    'shipped': {'delivered', 'refunded'},
+    'delivered': {'refunded'},
+    'cancelled': set(),
+    'refunded': set(),
+}
+
+PAYMENT_TRANSITIONS = {
+    'pending': {'processing', 'completed', 'failed', 'cancelled'},
+    'processing': {'completed', 'failed', 'cancelled'},
+    'completed': {'refunded'},
+    'failed': set(),
+    'cancelled': set(),
+    'refunded': set(),
+}
+
+
+class InvalidTransition(Exception):
+    """Raised when a status change is not allowed or lost a race"""
+
+
+def can_transition(transitions, from_status, to_status):
+    return to_status in transitions.get(from_status, ())
+
+
+def sources_for(transitions, to_status):
+    """Statuses that may move to ``to_status``"""
+    return [status for status, targets in transitions.items() if to_status in targets]
+
+
+def _transition(instance, transitions, to_status, extra_fields):
+    from_status = instance.status
+    if from_status == to_status and not extra_fields:
+        return False
+    if from_status != to_status and not can_transition(transitions, from_status, to_status):
+        raise InvalidTransition(
+            f"{instance._meta.verbose_name} {instance.pk} cannot go from {from_status} to {to_status}"
+        )
+
+    now = timezone.now()
+    updated = type(instance).objects.filter(pk=instance.pk, status=from_status).update(
+        status=to_status, updated_at=now, **extra_fields
+    )
+    if not updated:
+        raise InvalidTransition(
+            f"{instance._meta.verbose_name} {instance.pk} is no longer {from_status}"
+        )
+    instance.status = to_status
+    instance.updated_at = now
+    for field, value in extra_fields.items():
+        setattr(instance, field, value)
+    return from_status != to_status
+
+
+def transition_payment(payment, to_status, **extra_fields):
+    """
+    Move a payment to ``to_status``, also writing ``extra_fields``.
+
+    Returns True if the status changed. Repeating the current status only
+    writes ``extra_fields``.
+    """
+    return _transition(payment, PAYMENT_TRANSITIONS, to_status, extra_fields)
+
+
+def transition_order(order, to_status, user=None, note=''):
+    """Move an order to ``to_status`` and record it in the history"""
+    from_status = order.status
+    with transaction.atomic():
+        changed = _transition(order, ORDER_TRANSITIONS, to_status, {})
+        if changed:
+            OrderStatusHistory.objects.create(
+                order=order, from_status=from_status, to_status=to_status,
+                changed_by=user, note=note,
+            )
+    return changed
+
+
+def bulk_transition_orders(queryset, to_status, user=None, note=''):
+    """
+    Move every order in ``queryset`` that may reach ``to_status``.
+
+    Runs one conditional ``UPDATE`` per source status and one bulk history
+    insert. Returns ``(moved, skipped)`` counts.
+    """
+    moved = 0
+    now = timezone.now()
+    with transaction.atomic():
+        total = queryset.count()
+        for from_status in sources_for(ORDER_TRANSITIONS, to_status):
+            batch = Order.objects.filter(id__in=queryset.values('id'), status=from_status)
+            # Lock the rows first so the history matches what the UPDATE touches
+            ids = list(batch.select_for_update().order_by().values_list('id', flat=True))
+            if not ids:
+                continue
+            updated = batch.update(status=to_status, updated_at=now)
+            OrderStatusHistory.objects.bulk_create([
+                OrderStatusHistory(
+                    order_id=order_id, from_status=from_status, to_status=to_status,
+                    changed_by=user, note=note,
+                )
+                for order_id in ids
+            ], batch_size=1000)
+            moved += updated
+    return moved, total - moved
+
+
+def bulk_transition_payments(payment_ids, from_status, to_status):
+    """
+    Move the payments of ``payment_ids`` that are still ``from_status``.
+
+    One conditional ``UPDATE`` for the whole batch. Returns the ids moved;
+    the others changed status since they were read.
+    """
+    if not can_transition(PAYMENT_TRANSITIONS, from_status, to_status):
+        raise InvalidTransition(f"Payments cannot go from {from_status} to {to_status}")
+    with transaction.atomic():
+        batch = Payment.objects.filter(id__in=payment_ids, status=from_status)
+        ids = list(batch.select_for_update().order_by().values_list('id', flat=True))
+        if ids:
+            Payment.objects.filter(id__in=ids).update(status=to_status, updated_at=timezone.now())
+    return ids
@@ -7,9 +7,12 @@ from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from datetime import datetime
 from decimal import Decimal
 import json
 import hashlib
@@ -19,69 +22,50 @@ import logging
 
 from .models import (
     PaymentMethod, Order, OrderItem, Payment, 
-    UserBalance, PaymentSecurity
+    UserBalance
 )
+from . import audit, gateway, webhooks
+from .catalog import get_catalog
+from .fraud import get_engine
+from .checkout import get_checkout_context
+from .pricing import get_rule_table, quote_cart, quote_items
+from .transitions import transition_order
 from marketplace.models import Product
 from cart.models import Cart, CartItem
 
 logger = logging.getLogger(__name__)
 
+ORDER_HISTORY_PAGE_SIZE = 10
+
 class PaymentSecurityMixin:
     """Mixin for payment security features"""
     
     def check_rate_limit(self, user, ip_address):
         """Check if user has exceeded rate limits"""
-        recent_attempts = PaymentSecurity.objects.filter(
-            user=user,
-            event_type='payment_attempt',
-            created_at__gte=timezone.now() - timezone.timedelta(minutes=15)
-        ).count()
+        # Whole hours come from the hourly rollups
+        recent_attempts = audit.recent_event_count(
+            user, 'payment_attempt', timezone.timedelta(minutes=15)
+        )
         
         if recent_attempts > 10:  # Max 10 attempts per 15 minutes
-            PaymentSecurity.objects.create(
-                event_type='rate_limit_exceeded',
-                user=user,
-                ip_address=ip_address,
-                risk_score=80,
-                details={'attempts': recent_attempts}
+            audit.record_security_event(
+                'rate_limit_exceeded',
+                user,
+                ip_address,
+                details={'attempts': recent_attempts},
+                risk_score=80
             )
             return False
         return True
     
     def check_fraud_indicators(self, request, amount):
         """Check for potential fraud indicators"""
-        risk_score = 0
-        fraud_indicators = []
-        
-        # Check IP address
-        ip_address = self.get_client_ip(request)
-        suspicious_ips = PaymentSecurity.objects.filter(
-            ip_address=ip_address,
-            is_blocked=True
-        ).exists()
-        
-        if suspicious_ips:
-            risk_score += 50
-            fraud_indicators.append('IP address is blocked')
-        
-        # Check user agent
-        user_agent = request.META.get('HTTP_USER_AGENT', '')
-        if not user_agent or len(user_agent) < 20:
-            risk_score += 20
-            fraud_indicators.append('Suspicious user agent')
-        
-        # Check amount patterns
-        if amount > 1000:  # High amount
-            risk_score += 30
-            fraud_indicators.append('High transaction amount')
-        
-        # Check time patterns (middle of night)
-        current_hour = timezone.now().hour
-        if 2 <= current_hour <= 5:
-            risk_score += 15
-            fraud_indicators.append('Unusual transaction time')
-        
-        return risk_score, fraud_indicators
+        return get_engine().score(
+            request.user,
+            self.get_client_ip(request),
+            request.META.get('HTTP_USER_AGENT', ''),
+            amount
+        )
     
     def get_client_ip(self, request):
         """Get client IP address"""
@@ -92,16 +76,49 @@ class PaymentSecurityMixin:
             ip = request.META.get('REMOTE_ADDR')
         return ip
     
+    def get_payment_gateway_url(self, payment):
+        """Get payment gateway URL based on payment method"""
+        if gateway.get_gateway() is None:
+            return f"/payments/process/{payment.payment_id}/"
+        session_id, url = gateway.create_session(payment)
+        Payment.objects.filter(pk=payment.pk).update(transaction_id=session_id, updated_at=timezone.now())
+        return url
+    
+    def gateway_redirect(self, payment):
+        """JSON response sending the customer to the payment gateway"""
+        try:
+            redirect_url = self.get_payment_gateway_url(payment)
+        except gateway.GatewayError as e:
+            logger.warning(f"Payment gateway error for {payment.payment_id}: {str(e)}")
+            return JsonResponse({
+                'success': False,
+                'payment_id': payment.payment_id,
+                'error': 'The payment provider is not responding. Please try again shortly.'
+            }, status=503)
+        return JsonResponse({
+            'success': True,
+            'payment_id': payment.payment_id,
+            'redirect_url': redirect_url
+        })
+    
     def log_security_event(self, event_type, user, ip_address, details=None, risk_score=0):
         """Log security events"""
-        PaymentSecurity.objects.create(
-            event_type=event_type,
-            user=user,
-            ip_address=ip_address,
-            details=details or {},
+        audit.record_security_event(
+            event_type,
+            user,
+            ip_address,
+            details=details,
             risk_score=risk_score
         )
 
+class BuyNowItem:
+    """Cart line stand-in for the Buy Now checkout page"""
+    
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.total_price = product.price * quantity
+
 @method_decorator(login_required, name='dispatch')
 class CheckoutView(PaymentSecurityMixin, View):
     """Checkout view for processing orders"""
@@ -113,72 +130,69 @@ class CheckoutView(PaymentSecurityMixin, View):
         product_id = request.GET.get('product_id')
         quantity = int(request.GET.get('quantity', 1))
         
+        variant = None
         if buy_now and product_id:
+            try:
+                variant = (int(product_id), quantity)
+            except ValueError:
+                messages.error(request, 'Product not found.')
+                return redirect('marketplace:product_list')
+        
+        # Served from cache until the cart, balance, product, payment methods
+        # or pricing rules change
+        payment_methods = get_catalog()
+        context = get_checkout_context(
+            request.user.id,
+            variant,
+            [payment_methods.version, get_rule_table().version, request.user.location],
+            lambda: self.build_context(request, variant, payment_methods),
+        )
+        if not isinstance(context, dict):
+            return context
+        
+        context = dict(context, payment_methods=payment_methods, product_id=product_id)
+        return render(request, 'payments/checkout.html', context)
+    
+    def build_context(self, request, variant, payment_methods):
+        """Checkout page context, or a redirect if checkout is not possible"""
+        if variant is not None:
             # Buy Now flow - single product purchase
+            product_id, quantity = variant
             try:
                 product = Product.objects.get(id=product_id, is_active=True)
-                if product.quantity_available < quantity:
-                    messages.error(request, f'Only {product.quantity_available} available.')
-                    return redirect('marketplace:product_detail', pk=product_id)
-                
-                # Calculate totals for single product
-                subtotal = product.price * quantity
-                shipping = Decimal('5.99') if subtotal > 0 else Decimal('0')
-                tax = subtotal * Decimal('0.08')  # 8% tax
-                total = subtotal + shipping + tax
-                
-                # Create a mock cart item for display
-                class MockCartItem:
-                    def __init__(self, product, quantity):
-                        self.product = product
-                        self.quantity = quantity
-                        self.total_price = product.price * quantity
-                
-                cart_items = [MockCartItem(product, quantity)]
-                
             except Product.DoesNotExist:
                 messages.error(request, 'Product not found.')
                 return redirect('marketplace:product_list')
+            if product.quantity_available < quantity:
+                messages.error(request, f'Only {product.quantity_available} available.')
+                return redirect('marketplace:product_detail', pk=product_id)
+            
+            quote = quote_items([(product, quantity)], request.user.location)
+            cart_items = [BuyNowItem(product, quantity)]
         else:
             # Regular checkout flow - from cart
-            if request.user.is_authenticated:
-                cart_items = CartItem.objects.filter(cart__user=request.user)
-            else:
-                cart_items = []
+            quantity = 1
+            cart = Cart.objects.filter(user=request.user).first()
+            cart_items = list(cart.items.select_related('product')) if cart else []
             
-            if not cart_items.exists():
+            if not cart_items:
                 messages.error(request, 'Your cart is empty.')
                 return redirect('cart:view')
             
-            # Calculate totals
-            subtotal = sum(item.total_price for item in cart_items)
-            shipping = Decimal('5.99') if subtotal > 0 else Decimal('0')
-            tax = subtotal * Decimal('0.08')  # 8% tax
-            total = subtotal + shipping + tax
+            quote = quote_cart(cart, request.user.location)
         
-        # Get available payment methods
-        payment_methods = PaymentMethod.objects.filter(is_active=True)
-        
-        # Get user balance if available
-        try:
-            user_balance = UserBalance.objects.get(user=request.user)
-        except UserBalance.DoesNotExist:
-            user_balance = None
-        
-        context = {
+        return {
             'cart_items': cart_items,
-            'subtotal': subtotal,
-            'shipping': shipping,
-            'tax': tax,
-            'total': total,
-            'payment_methods': payment_methods,
-            'user_balance': user_balance,
-            'buy_now': buy_now,
-            'product_id': product_id,
+            'subtotal': quote.subtotal,
+            'shipping': quote.shipping,
+            'tax': quote.tax,
+            'total': quote.total,
+            # Price available payment methods for this cart
+            'payment_quotes': payment_methods.quote(quote.total),
+            'user_balance': UserBalance.objects.filter(user=request.user).first(),
+            'buy_now': variant is not None,
             'quantity': quantity,
         }
-        
-        return render(request, 'payments/checkout.html', context)
     
     def post(self, request):
         """Process checkout"""
@@ -196,21 +210,35 @@ class CheckoutView(PaymentSecurityMixin, View):
                 }, status=429)
             
             # Get cart items
-            cart_items = CartItem.objects.filter(cart__user=request.user)
-            if not cart_items.exists():
+            cart = Cart.objects.filter(user=request.user).first()
+            cart_items = cart.items.select_related('product') if cart else CartItem.objects.none()
+            if not cart_items:
                 return JsonResponse({
                     'success': False,
                     'error': 'Cart is empty.'
                 }, status=400)
             
-            # Calculate totals
-            subtotal = sum(item.total_price for item in cart_items)
-            shipping = Decimal('5.99') if subtotal > 0 else Decimal('0')
-            tax = subtotal * Decimal('0.08')
-            total = subtotal + shipping + tax
+            # Reuse the quote shown on the cart and checkout pages
+            items = [(item.product, item.quantity) for item in cart_items]
+            quote = quote_cart(cart, request.user.location)
+            if not quote.matches(items):
+                quote = quote_items(items, request.user.location)
+            subtotal, shipping, tax, total = quote.subtotal, quote.shipping, quote.tax, quote.total
             
             # Get payment method
-            payment_method = get_object_or_404(PaymentMethod, id=payment_method_id, is_active=True)
+            catalog = get_catalog()
+            payment_method = catalog.get(payment_method_id)
+            if payment_method is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Invalid payment method.'
+                }, status=400)
+            if not catalog.accepts(payment_method, total):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Amount is outside the limits for this payment method.'
+                }, status=400)
+            processing_fee = catalog.calculate_fees(payment_method, total)
             
             # Check if user can afford with balance
             if use_balance:
@@ -229,7 +257,7 @@ class CheckoutView(PaymentSecurityMixin, View):
             
             # Fraud detection
             risk_score, fraud_indicators = self.check_fraud_indicators(request, total)
-            if risk_score > 70:
+            if risk_score > settings.PAYMENT_FRAUD_THRESHOLD:
                 self.log_security_event(
                     'fraud_detection',
                     request.user,
@@ -251,7 +279,8 @@ class CheckoutView(PaymentSecurityMixin, View):
                     grand_total=total,
                     shipping_address=data.get('shipping_address', ''),
                     billing_address=data.get('billing_address', ''),
-                    notes=data.get('notes', '')
+                    notes=data.get('notes', ''),
+                    **Order.summarize_items([item.product for item in cart_items])
                 )
                 
                 # Create order items
@@ -278,9 +307,9 @@ class CheckoutView(PaymentSecurityMixin, View):
                         status='completed',
                         transaction_id=f"BAL-{int(time.time())}",
                         ip_address=ip_address,
-                        user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                        security_hash=order.generate_order_number()
+                        user_agent=request.META.get('HTTP_USER_AGENT', '')
                     )
+                    transition_order(order, 'confirmed', user=request.user, note='Paid from account balance')
                     
                     # Clear cart
                     cart_items.delete()
@@ -297,12 +326,11 @@ class CheckoutView(PaymentSecurityMixin, View):
                         customer=request.user,
                         payment_method=payment_method,
                         amount=total,
-                        processing_fee=payment_method.calculate_fees(total),
-                        total_amount=total + payment_method.calculate_fees(total),
+                        processing_fee=processing_fee,
+                        total_amount=total + processing_fee,
                         status='pending',
                         ip_address=ip_address,
-                        user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                        security_hash=order.generate_order_number()
+                        user_agent=request.META.get('HTTP_USER_AGENT', '')
                     )
                     
                     # Log payment attempt
@@ -312,13 +340,10 @@ class CheckoutView(PaymentSecurityMixin, View):
                         ip_address,
                         {'order_id': order.id, 'amount': str(total)}
                     )
-                    
-                    # Redirect to payment gateway
-                    return JsonResponse({
-                        'success': True,
-                        'payment_id': payment.payment_id,
-                        'redirect_url': self.get_payment_gateway_url(payment)
-                    })
+            
+            # Start the gateway session after the order commits, so a slow
+            # gateway never holds row locks
+            return self.gateway_redirect(payment)
                     
         except json.JSONDecodeError:
             return JsonResponse({
@@ -331,12 +356,6 @@ class CheckoutView(PaymentSecurityMixin, View):
                 'success': False,
                 'error': 'An error occurred during checkout.'
             }, status=500)
-    
-    def get_payment_gateway_url(self, payment):
-        """Get payment gateway URL based on payment method"""
-        # This would integrate with actual payment gateways
-        # For now, return a demo URL
-        return f"/payments/process/{payment.payment_id}/"
 
 @method_decorator(login_required, name='dispatch')
 class BuyNowView(PaymentSecurityMixin, View):
@@ -369,13 +388,23 @@ class BuyNowView(PaymentSecurityMixin, View):
                 }, status=429)
             
             # Calculate totals
-            subtotal = product.price * quantity
-            shipping = Decimal('5.99') if subtotal > 0 else Decimal('0')
-            tax = subtotal * Decimal('0.08')
-            total = subtotal + shipping + tax
+            quote = quote_items([(product, quantity)], request.user.location)
+            subtotal, shipping, tax, total = quote.subtotal, quote.shipping, quote.tax, quote.total
             
             # Get payment method
-            payment_method = get_object_or_404(PaymentMethod, id=payment_method_id, is_active=True)
+            catalog = get_catalog()
+            payment_method = catalog.get(payment_method_id)
+            if payment_method is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Invalid payment method.'
+                }, status=400)
+            if not catalog.accepts(payment_method, total):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Amount is outside the limits for this payment method.'
+                }, status=400)
+            processing_fee = catalog.calculate_fees(payment_method, total)
             
             # Check balance if using account balance
             if use_balance:
@@ -394,7 +423,7 @@ class BuyNowView(PaymentSecurityMixin, View):
             
             # Fraud detection
             risk_score, fraud_indicators = self.check_fraud_indicators(request, total)
-            if risk_score > 70:
+            if risk_score > settings.PAYMENT_FRAUD_THRESHOLD:
                 self.log_security_event(
                     'fraud_detection',
                     request.user,
@@ -416,7 +445,8 @@ class BuyNowView(PaymentSecurityMixin, View):
                     grand_total=total,
                     shipping_address=data.get('shipping_address', ''),
                     billing_address=data.get('billing_address', ''),
-                    notes=data.get('notes', '')
+                    notes=data.get('notes', ''),
+                    **Order.summarize_items([product])
                 )
                 
                 # Create order item
@@ -446,9 +476,9 @@ class BuyNowView(PaymentSecurityMixin, View):
                         status='completed',
                         transaction_id=f"BAL-{int(time.time())}",
                         ip_address=ip_address,
-                        user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                        security_hash=order.generate_order_number()
+                        user_agent=request.META.get('HTTP_USER_AGENT', '')
                     )
+                    transition_order(order, 'confirmed', user=request.user, note='Paid from account balance')
                     
                     return JsonResponse({
                         'success': True,
@@ -462,12 +492,11 @@ class BuyNowView(PaymentSecurityMixin, View):
                         customer=request.user,
                         payment_method=payment_method,
                         amount=total,
-                        processing_fee=payment_method.calculate_fees(total),
-                        total_amount=total + payment_method.calculate_fees(total),
+                        processing_fee=processing_fee,
+                        total_amount=total + processing_fee,
                         status='pending',
                         ip_address=ip_address,
-                        user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                        security_hash=order.generate_order_number()
+                        user_agent=request.META.get('HTTP_USER_AGENT', '')
                     )
                     
                     # Log payment attempt
@@ -477,12 +506,10 @@ class BuyNowView(PaymentSecurityMixin, View):
                         ip_address,
                         {'order_id': order.id, 'amount': str(total)}
                     )
-                    
-                    return JsonResponse({
-                        'success': True,
-                        'payment_id': payment.payment_id,
-                        'redirect_url': self.get_payment_gateway_url(payment)
-                    })
+            
+            # Start the gateway session after the order commits, so a slow
+            # gateway never holds row locks
+            return self.gateway_redirect(payment)
                     
         except json.JSONDecodeError:
             return JsonResponse({
@@ -495,10 +522,6 @@ class BuyNowView(PaymentSecurityMixin, View):
                 'success': False,
                 'error': 'An error occurred during purchase.'
             }, status=500)
-    
-    def get_payment_gateway_url(self, payment):
-        """Get payment gateway URL"""
-        return f"/payments/process/{payment.payment_id}/"
 
 @method_decorator(login_required, name='dispatch')
 class PaymentProcessView(View):
@@ -522,42 +545,38 @@ class PaymentProcessView(View):
 @csrf_exempt
 @require_POST
 def payment_webhook(request, payment_id):
-    """Handle payment gateway webhooks"""
+    """
+    Handle payment gateway webhooks.
+
+    Events are verified, deduplicated and queued; the ``process_webhooks``
+    worker applies them so gateway retries never block on order updates.
+    """
     try:
-        payment = get_object_or_404(Payment, payment_id=payment_id)
-        
-        # Verify webhook signature (implement based on payment gateway)
+        # Verify webhook signature
         if not verify_webhook_signature(request):
             return HttpResponseForbidden('Invalid signature')
-        
-        # Process webhook data
+
         data = json.loads(request.body)
-        
-        if data.get('status') == 'completed':
-            payment.status = 'completed'
-            payment.transaction_id = data.get('transaction_id', '')
-            payment.gateway_response = data
-            payment.save()
-            
-            # Update order status
-            payment.order.status = 'confirmed'
-            payment.order.save()
-            
-            # Clear cart if this was a checkout
-            if hasattr(payment.order, 'cart'):
-                payment.order.cart.items.all().delete()
-        
-        return JsonResponse({'success': True})
-        
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False}, status=400)
+
+        event_id = webhooks.get_event_id(request, request.body, data)
+        queued = webhooks.enqueue_event(payment_id, event_id, data)
+
+        return JsonResponse({'success': True, 'duplicate': not queued})
+
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False}, status=400)
     except Exception as e:
         logger.error(f"Webhook error: {str(e)}")
         return JsonResponse({'success': False}, status=500)
 
 def verify_webhook_signature(request):
-    """Verify webhook signature (implement based on payment gateway)"""
-    # This would implement actual signature verification
-    # For demo purposes, return True
-    return True
+    """Verify webhook HMAC signature"""
+    return webhooks.verify_signature(
+        request.body,
+        request.META.get(webhooks.SIGNATURE_HEADER, '')
+    )
 
 @login_required
 def order_detail(request, order_id):
@@ -573,11 +592,55 @@ def order_detail(request, order_id):
 
 @login_required
 def order_list(request):
-    """Display user's orders"""
-    orders = Order.objects.filter(customer=request.user).order_by('-created_at')
+    """Display user's orders, newest first, one keyset page at a time"""
+    orders = (
+        Order.objects.filter(customer=request.user)
+        .only(
+            'id', 'order_number', 'grand_total', 'status',
+            'item_count', 'thumbnail', 'created_at',
+        )
+        .prefetch_related(Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related('product').only(
+                'id', 'order_id', 'quantity', 'unit_price', 'total_price',
+                'product__id', 'product__name',
+            ),
+        ))
+        .order_by('-created_at', '-id')
+    )
+    
+    # Keyset pagination: the cursor is the last (created_at, id) shown
+    cursor = decode_order_cursor(request.GET.get('before'))
+    if cursor:
+        created_at, order_id = cursor
+        orders = orders.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+        )
+    
+    orders = list(orders[:ORDER_HISTORY_PAGE_SIZE + 1])
+    has_more = len(orders) > ORDER_HISTORY_PAGE_SIZE
+    orders = orders[:ORDER_HISTORY_PAGE_SIZE]
     
     context = {
-        'orders': orders
+        'orders': orders,
+        'next_cursor': encode_order_cursor(orders[-1]) if has_more else None,
+        'is_first_page': cursor is None,
     }
     
     return render(request, 'payments/order_list.html', context)
+
+def encode_order_cursor(order):
+    """Opaque cursor pointing just past ``order``"""
+    raw = f"{order.created_at.isoformat()}|{order.id}"
+    return urlsafe_base64_encode(raw.encode())
+
+def decode_order_cursor(value):
+    """Parse an order cursor, returning None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        created_at, order_id = urlsafe_base64_decode(value).decode().split('|')
+        created_at = datetime.fromisoformat(created_at)
+        return created_at, int(order_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
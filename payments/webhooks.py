@@ -0,0 +1,185 @@
+"""
+Payment gateway webhook ingestion.
+
+The webhook view only verifies, deduplicates and enqueues events; applying
+them to payments and orders happens in ``process_pending_events``, which is
+run by the ``process_webhooks`` management command.
+"""
+import hashlib
+import hmac
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Payment, WebhookEvent
+from .transitions import transition_order, transition_payment
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'HTTP_X_WEBHOOK_SIGNATURE'
+EVENT_ID_HEADER = 'HTTP_X_WEBHOOK_EVENT_ID'
+DEDUPE_KEY_PREFIX = 'payments:webhook:'
+
+
+def sign_payload(body, secret=None):
+    """Return the hex HMAC-SHA256 signature for a raw webhook body"""
+    secret = settings.PAYMENT_WEBHOOK_SECRET if secret is None else secret
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature):
+    """Verify a webhook body against its signature header"""
+    secret = settings.PAYMENT_WEBHOOK_SECRET
+    if not secret:
+        # Unsigned events are only accepted in local development
+        if settings.DEBUG:
+            return True
+        logger.error("PAYMENT_WEBHOOK_SECRET is not set; rejecting webhook")
+        return False
+    if not signature:
+        return False
+    return hmac.compare_digest(sign_payload(body, secret), signature)
+
+
+def get_event_id(request, body, data):
+    """Event id from the payload or header, else a digest of the body"""
+    event_id = data.get('event_id') or request.META.get(EVENT_ID_HEADER)
+    if event_id:
+        return str(event_id)[:100]
+    return f"sha256:{hashlib.sha256(body).hexdigest()[:64]}"
+
+
+def get_event_sequence(data):
+    """Gateway ordering key for an event, or ``None`` when it has none"""
+    for key in ('sequence', 'created'):
+        value = data.get(key)
+        if value is not None:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def enqueue_event(payment_id, event_id, data):
+    """
+    Queue an event for processing.
+
+    Returns False when the event was already received. The cache gives a cheap
+    first check; the unique ``event_id`` column is the source of truth.
+    """
+    dedupe_key = f"{DEDUPE_KEY_PREFIX}{event_id}"
+    try:
+        if not cache.add(dedupe_key, 1, settings.PAYMENT_WEBHOOK_DEDUPE_TTL):
+            return False
+    except Exception as e:
+        logger.warning(f"Webhook dedupe cache unavailable: {str(e)}")
+        dedupe_key = None
+
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                event_id=event_id,
+                payment_id=payment_id,
+                sequence=get_event_sequence(data),
+                payload=data,
+            )
+    except IntegrityError:
+        return False
+    except Exception:
+        # Let the gateway retry instead of remembering an event we never stored
+        if dedupe_key:
+            cache.delete(dedupe_key)
+        raise
+    return True
+
+
+def apply_event(payment, data):
+    """Apply a single gateway event to a locked payment and its order"""
+    status = data.get('status')
+    if status not in dict(Payment.PAYMENT_STATUS):
+        raise ValueError(f"Unknown payment status: {status}")
+
+    fields = {'gateway_response': data}
+    if data.get('transaction_id'):
+        fields['transaction_id'] = data['transaction_id']
+    transition_payment(payment, status, **fields)
+
+    if status == 'completed' and payment.order.status == 'pending':
+        transition_order(payment.order, 'confirmed', note=f"Payment {payment.payment_id} completed")
+
+
+def apply_payment_events(payment_id):
+    """
+    Apply all pending events for one payment in gateway order.
+
+    The payment row is locked with ``select_for_update`` so concurrent workers
+    serialize per payment. Events older than the last applied one arrived out
+    of order and are skipped; events without a sequence are applied in
+    arrival order after the sequenced ones.
+    """
+    with transaction.atomic():
+        payment = (
+            Payment.objects.select_for_update(of=('self',))
+            .select_related('order')
+            .filter(payment_id=payment_id)
+            .first()
+        )
+        events = list(
+            WebhookEvent.objects.select_for_update()
+            .filter(payment_id=payment_id, status='pending')
+            .order_by(F('sequence').asc(nulls_last=True), 'received_at')
+        )
+        if not events:
+            return 0
+
+        now = timezone.now()
+        if payment is None:
+            for event in events:
+                event.status = 'failed'
+                event.error = 'Unknown payment'
+                event.processed_at = now
+            WebhookEvent.objects.bulk_update(events, ['status', 'error', 'processed_at'])
+            return 0
+
+        last_sequence = WebhookEvent.objects.filter(
+            payment_id=payment_id, status='processed'
+        ).aggregate(last=Max('sequence'))['last']
+
+        applied = 0
+        for event in events:
+            event.processed_at = now
+            # Events without a gateway sequence cannot be stale
+            if None not in (last_sequence, event.sequence) and event.sequence <= last_sequence:
+                event.status = 'skipped'
+                continue
+            try:
+                with transaction.atomic():
+                    apply_event(payment, event.payload)
+            except Exception as e:
+                logger.error(f"Webhook event {event.event_id} failed: {str(e)}")
+                event.status = 'failed'
+                event.error = str(e)
+                continue
+            event.status = 'processed'
+            if event.sequence is not None:
+                last_sequence = event.sequence
+            applied += 1
+
+        WebhookEvent.objects.bulk_update(events, ['status', 'error', 'processed_at'])
+        return applied
+
+
+def process_pending_events(limit=100):
+    """Drain pending events for up to ``limit`` payments"""
+    payment_ids = list(
+        WebhookEvent.objects.filter(status='pending')
+        .order_by('payment_id')
+        .values_list('payment_id', flat=True)
+        .distinct()[:limit]
+    )
+    return sum(apply_payment_events(payment_id) for payment_id in payment_ids)